@@ -0,0 +1,45 @@
+# analytics/management/commands/rebuild_rollups.py
+"""
+Recompute the play/download rollup tables from SongPlay / SongDownload.
+
+    python manage.py rebuild_rollups             # all history
+    python manage.py rebuild_rollups --days 2    # today and yesterday
+    python manage.py rebuild_rollups --prune     # only drop expired hourly rows
+    python manage.py rebuild_rollups --if-empty  # backfill on deploy, once
+
+Rollups are normally kept current as events are flushed; run this after
+bulk imports or if a flush failed to update them. Deploys run it with
+``--if-empty`` (procfile, render.yaml), so the first deploy with rollups
+backfills the plays and downloads recorded before it.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import rollups
+from analytics.models import SongRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild hourly/daily play and download rollups from the raw event tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only rebuild the last N days (default: everything)')
+        parser.add_argument('--prune', action='store_true',
+                            help='Only delete hourly rows older than ROLLUP_HOURLY_RETENTION_DAYS')
+        parser.add_argument('--if-empty', action='store_true', dest='if_empty',
+                            help='Only rebuild when there are no rollups yet')
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and SongRollup.objects.exists():
+            self.stdout.write("Rollups already exist, skipped")
+        elif not options['prune']:
+            if options['days'] is not None and options['days'] < 1:
+                raise CommandError('--days must be at least 1')
+            started = time.monotonic()
+            start = rollups.since(options['days']) if options['days'] else None
+            days = rollups.rebuild(start)
+            self.stdout.write(f"Rebuilt {days} days in {time.monotonic() - started:.1f}s")
+
+        deleted = rollups.prune()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} expired hourly rows"))
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('artists', '0002_initial'),
+        ('music', '0013_song_audio_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtistRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour/day (UTC)')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='artists.artist')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='analytics_a_period_2f0888_idx')],
+                'unique_together': {('artist', 'period', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='GenreRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour/day (UTC)')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='music.genre')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='analytics_g_period_ae7813_idx')],
+                'unique_together': {('genre', 'period', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SongRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour/day (UTC)')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('downloads', models.PositiveIntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='music.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket'], name='analytics_s_period_96caa9_idx')],
+                'unique_together': {('song', 'period', 'bucket')},
+            },
+        ),
+    ]
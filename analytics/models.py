@@ -1,3 +1,60 @@
+# analytics/models.py
 from django.db import models
 
-# Create your models here.
+
+class Rollup(models.Model):
+    """Plays and downloads counted per hour or per day (see analytics/rollups.py)"""
+    PERIOD_CHOICES = [
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour/day (UTC)")
+    plays = models.PositiveIntegerField(default=0)
+    downloads = models.PositiveIntegerField(default=0)
+
+    # Name of the foreign key this table is rolled up by
+    key_field = None
+
+    class Meta:
+        abstract = True
+
+
+class SongRollup(Rollup):
+    song = models.ForeignKey('music.Song', on_delete=models.CASCADE, related_name='rollups')
+
+    key_field = 'song'
+
+    class Meta:
+        unique_together = ['song', 'period', 'bucket']
+        indexes = [models.Index(fields=['period', 'bucket'])]
+
+    def __str__(self):
+        return f"{self.song_id} {self.period} {self.bucket:%Y-%m-%d %H:00}"
+
+
+class ArtistRollup(Rollup):
+    artist = models.ForeignKey('artists.Artist', on_delete=models.CASCADE, related_name='rollups')
+
+    key_field = 'artist'
+
+    class Meta:
+        unique_together = ['artist', 'period', 'bucket']
+        indexes = [models.Index(fields=['period', 'bucket'])]
+
+    def __str__(self):
+        return f"{self.artist_id} {self.period} {self.bucket:%Y-%m-%d %H:00}"
+
+
+class GenreRollup(Rollup):
+    genre = models.ForeignKey('music.Genre', on_delete=models.CASCADE, related_name='rollups')
+
+    key_field = 'genre'
+
+    class Meta:
+        unique_together = ['genre', 'period', 'bucket']
+        indexes = [models.Index(fields=['period', 'bucket'])]
+
+    def __str__(self):
+        return f"{self.genre_id} {self.period} {self.bucket:%Y-%m-%d %H:00}"
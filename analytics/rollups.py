@@ -0,0 +1,186 @@
+# analytics/rollups.py
+"""
+Hourly and daily play/download rollups per song, artist and genre.
+
+``record`` receives every batch of events written by ``music.ingest`` and
+adds them to their buckets with ``F()`` increments, so "last N days"
+rankings sum a handful of small rows per song instead of joining SongPlay.
+``rebuild`` recomputes the tables from the raw events when they drift.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from .models import ArtistRollup, GenreRollup, SongRollup
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_MODELS = (SongRollup, ArtistRollup, GenreRollup)
+PERIODS = ('hour', 'day')
+
+# Largest number of rows touched by one UPDATE statement
+UPSERT_BATCH_SIZE = 500
+
+
+def bucket_start(moment, period):
+    """Start of the UTC hour or day containing ``moment``."""
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    moment = moment.astimezone(dt_timezone.utc)
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def since(days):
+    """First daily bucket of a ``days`` long window ending today."""
+    return bucket_start(timezone.now(), 'day') - timedelta(days=days - 1)
+
+
+def _empty_totals():
+    return {model: defaultdict(lambda: [0, 0]) for model in ROLLUP_MODELS}
+
+
+def _add(totals, song_id, artist_id, genre_id, moment, plays=0, downloads=0):
+    for model, key in ((SongRollup, song_id), (ArtistRollup, artist_id), (GenreRollup, genre_id)):
+        if key is None:
+            continue
+        for period in PERIODS:
+            counts = totals[model][(key, period, bucket_start(moment, period))]
+            counts[0] += plays
+            counts[1] += downloads
+
+
+def apply(totals):
+    """
+    Add ``{model: {(key_id, period, bucket): [plays, downloads]}}`` to the
+    rollup tables. Missing rows are inserted empty first, then every row of
+    a bucket is incremented by one CASE UPDATE, so concurrent writers never
+    lose counts.
+    """
+    with transaction.atomic():
+        for model, rows in totals.items():
+            key = f'{model.key_field}_id'
+            by_bucket = defaultdict(dict)
+            for (key_id, period, bucket), counts in rows.items():
+                by_bucket[(period, bucket)][key_id] = counts
+
+            for (period, bucket), counts in by_bucket.items():
+                key_ids = list(counts)
+                model.objects.bulk_create(
+                    [model(**{key: key_id, 'period': period, 'bucket': bucket}) for key_id in key_ids],
+                    ignore_conflicts=True,
+                    batch_size=UPSERT_BATCH_SIZE,
+                )
+                for start in range(0, len(key_ids), UPSERT_BATCH_SIZE):
+                    batch = key_ids[start:start + UPSERT_BATCH_SIZE]
+                    updates = {}
+                    for index, field in enumerate(('plays', 'downloads')):
+                        whens = [When(**{key: key_id, 'then': Value(counts[key_id][index])})
+                                 for key_id in batch if counts[key_id][index]]
+                        if whens:
+                            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+                    if updates:
+                        model.objects.filter(
+                            period=period, bucket=bucket, **{f'{key}__in': batch}
+                        ).update(**updates)
+
+
+def record(plays=(), downloads=()):
+    """Roll up freshly written SongPlay / SongDownload objects."""
+    from music.models import Song
+
+    song_ids = {event.song_id for event in plays} | {event.song_id for event in downloads}
+    if not song_ids:
+        return
+    owners = {
+        song_id: (artist_id, genre_id)
+        for song_id, artist_id, genre_id in Song.objects.filter(pk__in=song_ids).values_list('pk', 'artist_id', 'genre_id')
+    }
+
+    totals = _empty_totals()
+    for event in plays:
+        if event.song_id in owners:
+            _add(totals, event.song_id, *owners[event.song_id], event.played_at or timezone.now(), plays=1)
+    for event in downloads:
+        if event.song_id in owners:
+            _add(totals, event.song_id, *owners[event.song_id], event.downloaded_at or timezone.now(), downloads=1)
+    apply(totals)
+
+
+def rebuild(start=None):
+    """
+    Recompute every bucket from ``start`` (default: the first event) to now
+    from SongPlay / SongDownload, one day per transaction. Returns days rebuilt.
+    """
+    from music.models import SongDownload, SongPlay
+
+    if start is None:
+        first = [
+            SongPlay.objects.order_by('played_at').values_list('played_at', flat=True).first(),
+            SongDownload.objects.order_by('downloaded_at').values_list('downloaded_at', flat=True).first(),
+        ]
+        first = [moment for moment in first if moment is not None]
+        if not first:
+            return 0
+        start = min(first)
+
+    day = bucket_start(start, 'day')
+    end = timezone.now()
+    days = 0
+    while day <= end:
+        next_day = day + timedelta(days=1)
+        totals = _empty_totals()
+        sources = (
+            (SongPlay.objects.filter(played_at__gte=day, played_at__lt=next_day), 'played_at', 'plays'),
+            (SongDownload.objects.filter(downloaded_at__gte=day, downloaded_at__lt=next_day), 'downloaded_at', 'downloads'),
+        )
+        for queryset, field, counter in sources:
+            grouped = (
+                queryset
+                .annotate(hour=TruncHour(field, tzinfo=dt_timezone.utc))
+                .values_list('song_id', 'song__artist_id', 'song__genre_id', 'hour')
+                .annotate(total=Count('id'))
+            )
+            for song_id, artist_id, genre_id, hour, total in grouped.iterator():
+                _add(totals, song_id, artist_id, genre_id, hour, **{counter: total})
+
+        with transaction.atomic():
+            for model in ROLLUP_MODELS:
+                model.objects.filter(bucket__gte=day, bucket__lt=next_day).delete()
+            apply(totals)
+        day = next_day
+        days += 1
+    return days
+
+
+def prune():
+    """Drop hourly buckets older than ROLLUP_HOURLY_RETENTION_DAYS. Returns rows deleted."""
+    cutoff = since(getattr(settings, 'ROLLUP_HOURLY_RETENTION_DAYS', 14))
+    return sum(
+        model.objects.filter(period='hour', bucket__lt=cutoff).delete()[0]
+        for model in ROLLUP_MODELS
+    )
+
+
+def recent(model, field='plays', days=7, period='day'):
+    """
+    ``field`` summed over the last ``days`` for each outer row, as an
+    annotation: ``Song.objects.annotate(weekly_plays=recent(SongRollup))``.
+    A correlated subquery, so it can sit next to other joins without
+    multiplying their counts.
+    """
+    totals = (
+        model.objects
+        .filter(**{model.key_field: OuterRef('pk')}, period=period, bucket__gte=since(days))
+        .values(model.key_field)
+        .annotate(total=Sum(field))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=IntegerField()), 0)
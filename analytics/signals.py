@@ -0,0 +1,20 @@
+# analytics/signals.py
+import logging
+
+from django.dispatch import receiver
+
+from music.ingest import events_flushed
+
+from . import rollups
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(events_flushed)
+def update_rollups(sender, plays=(), downloads=(), **kwargs):
+    """Fold each flushed batch of plays/downloads into the rollup tables"""
+    try:
+        rollups.record(plays, downloads)
+    except Exception:
+        # The raw events are already saved; `manage.py rebuild_rollups` catches up
+        logger.exception("Rollup update failed for %d plays, %d downloads", len(plays), len(downloads))
@@ -1,3 +1,78 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from artists.models import Artist
+from music.models import Genre, Song, SongDownload, SongPlay
+
+from . import rollups
+from .models import ArtistRollup, GenreRollup, SongRollup
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def rollup_rows():
+    return {
+        model.__name__: sorted(model.objects.values_list(f'{model.key_field}_id', 'period', 'bucket', 'plays', 'downloads'))
+        for model in rollups.ROLLUP_MODELS
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MEDIA_PROCESSING_ON_UPLOAD=False)
+class RollupTests(TestCase):
+    def setUp(self):
+        artist = Artist.objects.create(user=User.objects.create_user('artist', password='x'), name='Artist')
+        genre = Genre.objects.create(name='Bongo')
+        self.songs = [
+            Song.objects.create(title=title, artist=artist, genre=genre, audio_file=f'songs/{title}.mp3',
+                                is_approved=True)
+            for title in ('One', 'Two')
+        ]
+        now = timezone.now()
+        moments = [now, now - timedelta(hours=1), now - timedelta(days=2), now - timedelta(days=2, minutes=5)]
+        self.plays = [
+            SongPlay.objects.create(song=self.songs[index % 2], played_at=moment)
+            for index, moment in enumerate(moments)
+        ]
+        self.downloads = [SongDownload.objects.create(song=self.songs[0], downloaded_at=moments[2])]
+
+    def test_recorded_batches_match_a_rebuild(self):
+        rollups.record(self.plays[:2], self.downloads)
+        rollups.record(self.plays[2:])
+        recorded = rollup_rows()
+
+        for model in rollups.ROLLUP_MODELS:
+            model.objects.all().delete()
+        rollups.rebuild()
+        self.assertEqual(rollup_rows(), recorded)
+
+        day = rollups.bucket_start(self.plays[2].played_at, 'day')
+        self.assertEqual(GenreRollup.objects.get(period='day', bucket=day).plays, 2)
+        self.assertEqual(ArtistRollup.objects.get(period='day', bucket=day).downloads, 1)
+
+    def test_recent_sums_the_window(self):
+        rollups.record(self.plays, self.downloads)
+        weekly = dict(Song.objects.annotate(weekly=rollups.recent(SongRollup, days=7)).values_list('pk', 'weekly'))
+        self.assertEqual(weekly, {self.songs[0].pk: 2, self.songs[1].pk: 2})
+        daily = dict(Song.objects.annotate(daily=rollups.recent(SongRollup, days=1)).values_list('pk', 'daily'))
+        self.assertEqual(sum(daily.values()), sum(
+            1 for play in self.plays if play.played_at >= rollups.since(1)
+        ))
+
+    def test_deploy_backfill_runs_once(self):
+        output = StringIO()
+        call_command('rebuild_rollups', if_empty=True, stdout=output)
+        self.assertIn('Rebuilt', output.getvalue())
+        backfilled = rollup_rows()
+        daily = [row for row in backfilled['SongRollup'] if row[1] == 'day']
+        self.assertEqual(sum(row[3] for row in daily), len(self.plays))
+
+        SongPlay.objects.create(song=self.songs[0], played_at=timezone.now())
+        output = StringIO()
+        call_command('rebuild_rollups', if_empty=True, stdout=output)
+        self.assertIn('skipped', output.getvalue())
+        self.assertEqual(rollup_rows(), backfilled)
@@ -5,6 +5,7 @@ from django.utils import timezone
 from datetime import timedelta
 
 from music.models import Song, SongPlay, SongDownload
+from music import leaderboards
 from artists.models import Artist
 
 @login_required
@@ -37,10 +38,10 @@ def song_analytics(request, song_id):
 def top_songs(request):
     """Top songs analytics"""
     # Get top played songs
-    top_played = Song.objects.filter(is_approved=True).order_by('-plays')[:10]
+    top_played = leaderboards.top_songs('plays', 10)
     
     # Get top downloaded songs
-    top_downloaded = Song.objects.filter(is_approved=True).order_by('-downloads')[:10]
+    top_downloaded = leaderboards.top_songs('downloads', 10)
     
     context = {
         'top_played': top_played,
@@ -52,6 +53,6 @@ def get_song_stats(request, song_id):
     """Get current song statistics"""
     song = get_object_or_404(Song, id=song_id)
     return JsonResponse({
-        'plays': song.plays,
-        'downloads': song.downloads
+        'plays': song.current_plays,
+        'downloads': song.current_downloads
     })
\ No newline at end of file
@@ -5,4 +5,5 @@ class ArtistsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'artists'
 
-    
\ No newline at end of file
+    def ready(self):
+        import artists.receivers  # noqa: F401
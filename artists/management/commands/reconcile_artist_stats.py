@@ -0,0 +1,30 @@
+# artists/management/commands/reconcile_artist_stats.py
+"""
+Recompute ArtistStats from songs, follows and likes, repairing any drift
+in the incrementally maintained totals.
+
+    python manage.py reconcile_artist_stats
+    python manage.py reconcile_artist_stats --artist 12 --artist 40
+
+Run it from cron (e.g. nightly); it is a single UPDATE statement.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from artists import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored song, play, download, follower and like totals of every artist'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artist', type=int, action='append', dest='artist_ids',
+                            help='Only this artist id (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        updated = stats.refresh(options['artist_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {updated} artists in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artists', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtistStats',
+            fields=[
+                ('artist', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='artists.artist')),
+                ('songs', models.PositiveIntegerField(default=0, help_text='Approved songs')),
+                ('plays', models.PositiveIntegerField(default=0, help_text='Plays of approved songs')),
+                ('downloads', models.PositiveIntegerField(default=0, help_text='Downloads of approved songs')),
+                ('followers', models.PositiveIntegerField(default=0)),
+                ('likes', models.PositiveIntegerField(default=0, help_text='Likes on approved songs')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Artist stats',
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, group_by, aggregate):
+    return Coalesce(
+        Subquery(queryset.values(group_by).annotate(total=aggregate).values('total'), output_field=IntegerField()),
+        Value(0),
+    )
+
+
+def backfill_artist_stats(apps, schema_editor):
+    """Give every existing artist its totals (artists.stats.refresh, on the historical models)"""
+    Artist = apps.get_model('artists', 'Artist')
+    ArtistStats = apps.get_model('artists', 'ArtistStats')
+    Follow = apps.get_model('artists', 'Follow')
+    Song = apps.get_model('music', 'Song')
+    Like = apps.get_model('library', 'Like')
+
+    ArtistStats.objects.bulk_create(
+        [ArtistStats(artist_id=pk) for pk in Artist.objects.values_list('pk', flat=True)],
+        ignore_conflicts=True,
+    )
+    songs = Song.objects.filter(artist=OuterRef('pk'), is_approved=True)
+    likes = Like.objects.filter(song__artist=OuterRef('pk'), song__is_approved=True)
+    ArtistStats.objects.update(
+        songs=_count(songs, 'artist', Count('pk')),
+        plays=_count(songs, 'artist', Sum('plays')),
+        downloads=_count(songs, 'artist', Sum('downloads')),
+        followers=_count(Follow.objects.filter(artist=OuterRef('pk')), 'artist', Count('pk')),
+        likes=_count(likes, 'song__artist', Count('pk')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artists', '0003_artiststats'),
+        ('library', '0001_initial'),
+        ('music', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_artist_stats, migrations.RunPython.noop),
+    ]
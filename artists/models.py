@@ -38,4 +38,21 @@ class Follow(models.Model):
     
     class Meta:
         unique_together = ['follower', 'artist']
-        app_label = 'artists'  # Make sure this is here
\ No newline at end of file
+        app_label = 'artists'  # Make sure this is here
+
+class ArtistStats(models.Model):
+    """Running totals for an artist, kept current by artists/stats.py"""
+    artist = models.OneToOneField(Artist, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    songs = models.PositiveIntegerField(default=0, help_text="Approved songs")
+    plays = models.PositiveIntegerField(default=0, help_text="Plays of approved songs")
+    downloads = models.PositiveIntegerField(default=0, help_text="Downloads of approved songs")
+    followers = models.PositiveIntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0, help_text="Likes on approved songs")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'artists'
+        verbose_name_plural = 'Artist stats'
+
+    def __str__(self):
+        return f"Stats for {self.artist.name}"
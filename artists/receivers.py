@@ -0,0 +1,79 @@
+# artists/receivers.py
+"""Keep ArtistStats current; wired up in ArtistsConfig.ready()."""
+import logging
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from music.counters import counters_flushed
+
+from . import stats
+from .models import Follow
+
+logger = logging.getLogger(__name__)
+
+# Song saves that can change an artist's totals
+SONG_STAT_FIELDS = {'is_approved', 'artist'}
+
+
+@receiver(counters_flushed)
+def add_flushed_counters(sender, deltas, **kwargs):
+    try:
+        stats.add_counter_deltas(deltas)
+    except Exception:
+        # Song counters are already written; `manage.py reconcile_artist_stats` repairs the totals
+        logger.exception("Artist stats update failed for %d songs", len(deltas))
+
+
+@receiver(post_save, sender=Follow)
+def follow_added(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust({instance.artist_id: {'followers': 1}})
+
+
+@receiver(post_delete, sender=Follow)
+def follow_removed(sender, instance, **kwargs):
+    stats.adjust({instance.artist_id: {'followers': -1}})
+
+
+def _like_changed(like, delta):
+    from music.models import Song
+
+    song = Song.objects.filter(pk=like.song_id, is_approved=True).values('artist_id').first()
+    if song:
+        stats.adjust({song['artist_id']: {'likes': delta}})
+
+
+@receiver(post_save, sender='library.Like')
+def like_added(sender, instance, created, **kwargs):
+    if created:
+        _like_changed(instance, 1)
+
+
+@receiver(post_delete, sender='library.Like')
+def like_removed(sender, instance, **kwargs):
+    _like_changed(instance, -1)
+
+
+@receiver(pre_save, sender='music.Song')
+def remember_song_artist(sender, instance, update_fields=None, **kwargs):
+    """Note the stored artist, so a reassignment recounts the artist the song left too"""
+    instance._old_artist_id = None
+    if instance.pk is None or (update_fields is not None and 'artist' not in update_fields):
+        return
+    instance._old_artist_id = sender.objects.filter(pk=instance.pk).values_list('artist_id', flat=True).first()
+
+
+@receiver(post_save, sender='music.Song')
+def song_saved(sender, instance, update_fields=None, **kwargs):
+    """Approval, upload or reassignment: recount the artists involved"""
+    if update_fields is not None and not SONG_STAT_FIELDS & set(update_fields):
+        return
+    artist_ids = {instance.artist_id, getattr(instance, '_old_artist_id', None)} - {None}
+    stats.refresh(sorted(artist_ids))
+
+
+@receiver(post_delete, sender='music.Song')
+def song_deleted(sender, instance, **kwargs):
+    # Never create rows here: the artist itself may be mid-delete
+    stats.refresh([instance.artist_id], create=False)
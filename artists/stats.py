@@ -0,0 +1,139 @@
+# artists/stats.py
+"""
+``ArtistStats``: per-artist totals (approved songs, their plays, downloads
+and likes, followers) so listing pages read them through a one-row join
+instead of aggregating every song, follow and like on each request.
+
+Rows are adjusted incrementally from the counter flush and the follow/like
+signals (see artists/receivers.py); ``refresh`` recomputes them from the
+source tables and ``manage.py reconcile_artist_stats`` runs it periodically
+to repair any drift.
+"""
+import logging
+
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Artist, ArtistStats, Follow
+
+logger = logging.getLogger(__name__)
+
+STAT_FIELDS = ('songs', 'plays', 'downloads', 'followers', 'likes')
+
+# Largest number of artists written by one UPDATE statement
+BATCH_SIZE = 500
+
+
+def _count(queryset, group_by, aggregate):
+    """Correlated subquery aggregating ``queryset`` for the outer ArtistStats row"""
+    return Coalesce(
+        Subquery(
+            queryset.values(group_by).annotate(total=aggregate).values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def stat_expressions():
+    """``{field: expression}`` recomputing each stat from the source tables"""
+    from library.models import Like
+    from music.models import Song
+
+    songs = Song.objects.filter(artist=OuterRef('pk'), is_approved=True)
+    likes = Like.objects.filter(song__artist=OuterRef('pk'), song__is_approved=True)
+    return {
+        'songs': _count(songs, 'artist', Count('pk')),
+        'plays': _count(songs, 'artist', Sum('plays')),
+        'downloads': _count(songs, 'artist', Sum('downloads')),
+        'followers': _count(Follow.objects.filter(artist=OuterRef('pk')), 'artist', Count('pk')),
+        'likes': _count(likes, 'song__artist', Count('pk')),
+    }
+
+
+def refresh(artist_ids=None, create=True):
+    """
+    Recompute the stats of ``artist_ids`` (every artist when None) in one
+    UPDATE. With ``create`` missing rows are added first. Returns rows updated.
+    """
+    if create:
+        artists = Artist.objects.filter(stats__isnull=True)
+        if artist_ids is not None:
+            artists = artists.filter(pk__in=artist_ids)
+        ArtistStats.objects.bulk_create(
+            [ArtistStats(artist_id=pk) for pk in artists.values_list('pk', flat=True)],
+            ignore_conflicts=True,
+        )
+
+    rows = ArtistStats.objects.all()
+    if artist_ids is not None:
+        rows = rows.filter(pk__in=artist_ids)
+    return rows.update(updated_at=timezone.now(), **stat_expressions())
+
+
+def adjust(deltas):
+    """
+    Apply ``{artist_id: {field: delta}}`` to the stored totals. Artists
+    without a row yet get one computed by ``refresh`` instead, unless every
+    delta is a decrement (e.g. a like removed while its artist is deleted).
+    """
+    deltas = {pk: counts for pk, counts in deltas.items() if any(counts.values())}
+    if not deltas:
+        return
+
+    existing = set(ArtistStats.objects.filter(pk__in=deltas).values_list('pk', flat=True))
+    missing = [pk for pk in deltas if pk not in existing and any(n > 0 for n in deltas[pk].values())]
+    if missing:
+        refresh(missing)
+
+    artist_ids = sorted(existing)
+    for start in range(0, len(artist_ids), BATCH_SIZE):
+        batch = artist_ids[start:start + BATCH_SIZE]
+        updates = {}
+        for field in STAT_FIELDS:
+            whens = [
+                When(pk=pk, then=Value(deltas[pk][field]))
+                for pk in batch if deltas[pk].get(field)
+            ]
+            if whens:
+                # Never below zero, even if a decrement races a refresh
+                updates[field] = Greatest(
+                    F(field) + Case(*whens, default=Value(0), output_field=IntegerField()),
+                    Value(0),
+                )
+        if updates:
+            ArtistStats.objects.filter(pk__in=batch).update(updated_at=timezone.now(), **updates)
+
+
+def add_counter_deltas(song_deltas):
+    """Fold a counter flush (``{song_id: {'plays', 'downloads'}}``) into the artists' totals"""
+    from music.models import Song
+
+    deltas = {}
+    songs = Song.objects.filter(pk__in=song_deltas, is_approved=True).values_list('pk', 'artist_id')
+    for song_id, artist_id in songs:
+        totals = deltas.setdefault(artist_id, {'plays': 0, 'downloads': 0})
+        totals['plays'] += song_deltas[song_id].get('plays', 0)
+        totals['downloads'] += song_deltas[song_id].get('downloads', 0)
+    adjust(deltas)
+
+
+def stat_annotations(**aliases):
+    """
+    Queryset annotations reading the stored totals, e.g.
+    ``Artist.objects.annotate(**stat_annotations(followers_count='followers'))``
+    """
+    unknown = set(aliases.values()) - set(STAT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown artist stat: {', '.join(sorted(unknown))}")
+    return {alias: Coalesce(F(f'stats__{field}'), Value(0)) for alias, field in aliases.items()}
+
+
+def for_artist(artist):
+    """The artist's ArtistStats row, computing it on first use"""
+    try:
+        return ArtistStats.objects.get(pk=artist.pk)
+    except ArtistStats.DoesNotExist:
+        refresh([artist.pk])
+        return ArtistStats.objects.get(pk=artist.pk)
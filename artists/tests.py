@@ -1,3 +1,45 @@
-from django.test import TestCase
+import importlib
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from library.models import Like
+from music.models import Song
+
+from . import stats
+from .models import Artist, ArtistStats, Follow
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_artist(name):
+    return Artist.objects.create(user=User.objects.create_user(name.lower(), password='x'), name=name)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MEDIA_PROCESSING_ON_UPLOAD=False)
+class ArtistStatsTests(TestCase):
+    def setUp(self):
+        self.first = make_artist('First')
+        self.second = make_artist('Second')
+        self.song = Song.objects.create(title='Moving', artist=self.first, audio_file='songs/moving.mp3',
+                                        is_approved=True, plays=7, downloads=2)
+
+    def test_reassigned_song_recounts_both_artists(self):
+        self.assertEqual(stats.for_artist(self.first).songs, 1)
+        self.song.artist = self.second
+        self.song.save()
+        self.assertEqual((stats.for_artist(self.first).songs, stats.for_artist(self.first).plays), (0, 0))
+        self.assertEqual((stats.for_artist(self.second).songs, stats.for_artist(self.second).plays), (1, 7))
+
+    def test_migration_backfills_existing_artists(self):
+        Follow.objects.create(follower=User.objects.create_user('fan', password='x'), artist=self.first)
+        Like.objects.create(user=User.objects.get(username='fan'), song=self.song)
+        ArtistStats.objects.all().delete()
+
+        migration = importlib.import_module('artists.migrations.0004_backfill_artiststats')
+        migration.backfill_artist_stats(apps, None)
+
+        row = ArtistStats.objects.get(pk=self.first.pk)
+        self.assertEqual((row.songs, row.plays, row.downloads, row.followers, row.likes), (1, 7, 2, 1, 1))
+        self.assertEqual(ArtistStats.objects.get(pk=self.second.pk).songs, 0)
@@ -5,15 +5,19 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.db.models import Q, Count, Sum, Case, When, IntegerField
-from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import timedelta
 import json
 
 from .models import Artist, Follow
-from music.models import Song, Genre, SongPlay, SongDownload
+from . import stats
+from music.models import Song, Genre, SongPlay
 from music.forms import SongUploadForm
 from library.models import Like
+from music import ingest, leaderboards, streaming, trending
+from music.processing import preview
+from analytics import rollups
+from analytics.models import ArtistRollup
 
 # Earnings rates
 STREAM_RATE = 0.001  # $0.001 per play
@@ -38,22 +42,26 @@ def play_song(request, song_id):
     if not song.can_be_accessed_by(request.user):
         return JsonResponse({
             'error': 'Premium content requires subscription',
-            'can_preview': getattr(song, 'preview_duration', 0) > 0,
-            'preview_duration': getattr(song, 'preview_duration', 0)
+            'can_preview': song.preview_url is not None,
+            'preview_duration': preview.clip_seconds(song),
+            'preview_url': song.preview_url
         }, status=403)
     
+    # Stream the best rendition the user's plan allows; the original until it is transcoded
+    rendition = song.rendition_for(request.user)
+    audio_quality = rendition.quality if rendition else song.audio_quality
+    
     # Increment play count
-    song.plays += 1
-    song.save()
+    song.increment_plays()
     
-    # Record play in SongPlay model
-    play = SongPlay.objects.create(
-        song=song,
+    # Queue play for the SongPlay table
+    play_token = ingest.record_play(
+        song,
         user=request.user,
         ip_address=get_client_ip(request),
         duration_played=0,
         user_agent=request.META.get('HTTP_USER_AGENT', ''),
-        audio_quality='high' if hasattr(request.user, 'userprofile') and request.user.userprofile.is_premium else 'standard'
+        audio_quality=audio_quality
     )
     
     return JsonResponse({
@@ -63,11 +71,16 @@ def play_song(request, song_id):
         'artist': song.artist.name,
         'artist_id': song.artist.id,
         'cover': song.cover_image.url if song.cover_image else '/static/images/default-cover.jpg',
-        'audio': song.audio_file.url,
-        'duration': getattr(song, 'duration', '3:45'),
-        'plays': song.plays,
+        'audio': streaming.stream_url(song, request.user, rendition.quality if rendition else ''),
+        'audio_quality': audio_quality,
+        'hls': streaming.hls_url(song, request.user),
+        'waveform': song.waveform_url,
+        'replay_gain': song.replay_gain,
+        'duration': song.duration,
+        'formatted_duration': song.formatted_duration,
+        'plays': song.current_plays,
         'is_premium': getattr(song, 'is_premium_only', False),
-        'play_id': play.id
+        'play_id': play_token
     })
 
 @require_POST
@@ -103,11 +116,10 @@ def download_song(request, song_id):
             'error': 'Premium content requires subscription'
         }, status=403)
     
-    song.downloads += 1
-    song.save()
+    song.increment_downloads()
     
-    SongDownload.objects.create(
-        song=song,
+    ingest.record_download(
+        song,
         user=request.user,
         ip_address=get_client_ip(request),
         file_size=song.audio_file.size
@@ -129,9 +141,8 @@ def update_play_duration(request, song_id):
         play_id = data.get('play_id')
         
         if play_id:
-            play = SongPlay.objects.get(id=play_id, user=request.user)
-            play.duration_played = duration_played
-            play.save()
+            if not ingest.update_play_duration(play_id, duration_played, user=request.user):
+                raise SongPlay.DoesNotExist
         else:
             play = SongPlay.objects.filter(
                 song_id=song_id,
@@ -140,7 +151,7 @@ def update_play_duration(request, song_id):
             
             if play:
                 play.duration_played = duration_played
-                play.save()
+                play.save(update_fields=['duration_played'])
                 
         return JsonResponse({'success': True})
         
@@ -200,23 +211,22 @@ def increment_play_count(request, song_id):
     """API endpoint to increment play count"""
     if request.method == 'POST':
         song = get_object_or_404(Song, id=song_id)
-        song.plays += 1
-        song.save()
+        song.increment_plays()
         
         return JsonResponse({
             'success': True,
-            'new_play_count': song.plays
+            'new_play_count': song.current_plays
         })
     
     return JsonResponse({'success': False})
 
 def artists(request):
     """All artists page with trending and new sections"""
-    artists_list = Artist.objects.verified().annotate(
-        total_songs_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays_count=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        followers_count=Count('followers')
-    ).order_by('-created_at')
+    artists_list = Artist.objects.verified().annotate(**stats.stat_annotations(
+        total_songs_count='songs',
+        total_plays_count='plays',
+        followers_count='followers',
+    )).order_by('-created_at')
     
     thirty_days_ago = timezone.now() - timedelta(days=30)
     new_artists = artists_list.filter(created_at__gte=thirty_days_ago)[:8]
@@ -227,8 +237,7 @@ def artists(request):
             'followers', 
             filter=Q(followers__followed_at__gte=seven_days_ago)
         ),
-        total_followers_count=Count('followers'),
-        total_songs_count=Count('songs', filter=Q(songs__is_approved=True))
+        **stats.stat_annotations(total_followers_count='followers', total_songs_count='songs')
     ).filter(recent_followers__gt=0).order_by('-recent_followers', '-total_followers_count')[:8]
     
     context = {
@@ -241,20 +250,9 @@ def artists(request):
 
 def trending_artists(request):
     """Trending artists page with enhanced metrics"""
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    
-    trending_artists_list = Artist.objects.verified().annotate(
-        weekly_plays=Coalesce(Sum(
-            'songs__plays',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0),
-        weekly_followers=Count(
-            'followers',
-            filter=Q(followers__followed_at__gte=seven_days_ago)
-        ),
-        total_followers_count=Count('followers'),
-        total_songs_count=Count('songs', filter=Q(songs__is_approved=True))
-    ).filter(Q(weekly_plays__gt=0) | Q(weekly_followers__gt=0)).order_by('-weekly_plays', '-weekly_followers')
+    trending_artists_list = trending.top_artists('7d', 50, queryset=Artist.objects.verified().annotate(
+        **stats.stat_annotations(total_followers_count='followers', total_songs_count='songs')
+    ))
     
     context = {
         'artists': trending_artists_list,
@@ -280,20 +278,17 @@ def artist_detail(request, artist_id):
     if request.user.is_authenticated:
         is_following = Follow.objects.filter(follower=request.user, artist=artist).exists()
     
-    approved_songs = songs.filter(is_approved=True)
-    total_plays = approved_songs.aggregate(total=Sum('plays'))['total'] or 0
-    total_downloads = approved_songs.aggregate(total=Sum('downloads'))['total'] or 0
-    total_likes = Like.objects.filter(song__in=approved_songs).count()
+    artist_stats = stats.for_artist(artist)
     
     context = {
         'artist': artist,
         'songs': songs,
         'is_following': is_following,
-        'songs_count': approved_songs.count(),
-        'total_plays': total_plays,
-        'total_downloads': total_downloads,
-        'total_likes': total_likes,
-        'followers_count': artist.followers.count(),
+        'songs_count': artist_stats.songs,
+        'total_plays': artist_stats.plays,
+        'total_downloads': artist_stats.downloads,
+        'total_likes': artist_stats.likes,
+        'followers_count': artist_stats.followers,
     }
     return render(request, 'artists/artist_detail.html', context)
 
@@ -321,9 +316,9 @@ def artist_dashboard(request):
 
     # Get recent activity
     seven_days_ago = timezone.now() - timedelta(days=7)
-    recent_plays = approved_songs.aggregate(
-        recent=Sum('plays', filter=Q(upload_date__gte=seven_days_ago))
-    )['recent'] or 0
+    recent_plays = ArtistRollup.objects.filter(
+        artist=artist, period='day', bucket__gte=rollups.since(7)
+    ).aggregate(recent=Sum('plays'))['recent'] or 0
     
     recent_followers = Follow.objects.filter(
         artist=artist, 
@@ -332,7 +327,7 @@ def artist_dashboard(request):
 
     # Get songs with earnings calculation
     recent_songs = artist.songs.all().order_by('-upload_date')[:6]
-    top_songs = approved_songs.order_by('-plays')[:5]
+    top_songs = leaderboards.top_songs('plays', 5, artist=artist)
 
     # Calculate earnings for each song
     for song in recent_songs:
@@ -2,6 +2,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import Genre, Song, SongPlay, SongDownload, NewsArticle, Chart, ChartEntry, YouTubeVideo   
+from django.utils import timezone
+from .models import SongRendition, DuplicateCandidate
 
 
 @admin.register(Genre)
@@ -25,6 +27,28 @@ class GenreAdmin(admin.ModelAdmin):
         return obj.songs.count()
     song_count_display.short_description = 'Number of Songs'
 
+class SongRenditionInline(admin.TabularInline):
+    model = SongRendition
+    extra = 0
+    can_delete = False
+    fields = ['quality', 'codec', 'bitrate', 'file_size', 'file', 'created_at']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
+class DuplicateCandidateInline(admin.TabularInline):
+    model = DuplicateCandidate
+    fk_name = 'song'
+    extra = 0
+    can_delete = False
+    fields = ['original', 'score', 'matches', 'status', 'created_at']
+    readonly_fields = fields
+    verbose_name_plural = 'Possible duplicates'
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
     list_display = [
@@ -36,27 +60,28 @@ class SongAdmin(admin.ModelAdmin):
         'upload_date', 'audio_quality'
     ]
     search_fields = ['title', 'artist__name', 'genre__name', 'lyrics']
-    readonly_fields = ['plays', 'downloads', 'upload_date', 'popularity_score_display']
+    readonly_fields = ['plays', 'downloads', 'hot_score', 'upload_date', 'popularity_score_display', 'bitrate', 'sample_rate', 'loudness', 'replay_gain', 'embedded_tags']
     list_editable = ['is_approved', 'is_featured']
     list_per_page = 25
     date_hierarchy = 'upload_date'
+    inlines = [DuplicateCandidateInline, SongRenditionInline]
     
     fieldsets = (
         ('Basic Information', {
             'fields': ('title', 'artist', 'genre', 'duration', 'lyrics')
         }),
         ('Media Files', {
-            'fields': ('audio_file', 'cover_image')
+            'fields': ('audio_file', 'cover_image', 'preview_file')
         }),
         ('Content Settings', {
             'fields': ('is_approved', 'is_featured', 'is_premium_only', 'preview_duration', 'audio_quality')
         }),
         ('Additional Info', {
-            'fields': ('bpm', 'release_year'),
+            'fields': ('bpm', 'release_year', 'bitrate', 'sample_rate', 'loudness', 'replay_gain', 'embedded_tags'),
             'classes': ('collapse',)
         }),
         ('Statistics', {
-            'fields': ('plays', 'downloads', 'upload_date', 'popularity_score_display'),
+            'fields': ('plays', 'downloads', 'hot_score', 'upload_date', 'popularity_score_display'),
             'classes': ('collapse',)
         }),
     )
@@ -71,6 +96,51 @@ class SongAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('artist', 'genre')
+    
+    def save_model(self, request, obj, form, change):
+        # A tempo typed in here is no longer an estimate the analysis may redo
+        if 'bpm' in form.changed_data:
+            obj.bpm_estimated = False
+        super().save_model(request, obj, form, change)
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    list_display = ['song', 'original', 'score_display', 'matches', 'status', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['song__title', 'original__title', 'song__artist__name']
+    readonly_fields = ['song', 'original', 'matches', 'score', 'created_at', 'reviewed_at']
+    actions = ['confirm_duplicates', 'dismiss_duplicates']
+    list_per_page = 25
+    
+    def score_display(self, obj):
+        return f"{obj.score:.0%}"
+    score_display.short_description = 'Score'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('song__artist', 'original__artist')
+    
+    def confirm_duplicates(self, request, queryset):
+        """Keep the copies out of the catalog"""
+        song_ids = list(queryset.values_list('song_id', flat=True))
+        updated = queryset.update(status='confirmed', reviewed_at=timezone.now())
+        # Saved one by one so the post_save handlers take the copies out of
+        # search, leaderboards and the artist/genre stats
+        for song in Song.objects.filter(pk__in=song_ids, is_approved=True):
+            song.is_approved = False
+            song.save(update_fields=['is_approved'])
+        self.message_user(request, f'{updated} duplicate(s) confirmed and unapproved.')
+    confirm_duplicates.short_description = 'Confirm duplicate (unapprove the copy)'
+    
+    def dismiss_duplicates(self, request, queryset):
+        """Not duplicates after all: let the held-back processing run"""
+        from .processing import schedule
+        
+        song_ids = set(queryset.values_list('song_id', flat=True))
+        updated = queryset.update(status='dismissed', reviewed_at=timezone.now())
+        for song_id in song_ids:
+            schedule(song_id)
+        self.message_user(request, f'{updated} candidate(s) dismissed.')
+    dismiss_duplicates.short_description = 'Not a duplicate'
 
 @admin.register(SongPlay)
 class SongPlayAdmin(admin.ModelAdmin):
@@ -124,6 +194,15 @@ class ChartAdmin(admin.ModelAdmin):
     list_display = ['title', 'chart_type', 'is_active', 'updated_at']
     list_filter = ['chart_type', 'is_active']
     search_fields = ['title', 'description']
+    actions = ['rebuild_charts']
+    
+    def rebuild_charts(self, request, queryset):
+        from .charts import build_charts
+        
+        results = build_charts(queryset)
+        built = sum(1 for written in results.values() if written not in (None, False))
+        self.message_user(request, f'{built} of {len(results)} chart(s) rebuilt.')
+    rebuild_charts.short_description = 'Rebuild selected charts now'
 
 class ChartEntryInline(admin.TabularInline):
     model = ChartEntry
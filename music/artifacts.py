@@ -0,0 +1,212 @@
+# music/artifacts.py
+"""
+On-disk cache of branded download files.
+
+Each artifact lives at ``<root>/<song_id>/<key>.mp3``, where ``key`` hashes
+everything that goes into the branded file: the song id, the audio and
+cover files (path, size, mtime), title, artist and genre. Editing any of
+those changes the key, so a stale file can never be served. Song saves
+delete the song's superseded files; renaming an artist or genre changes
+the key of all their songs at once, and the old files go when each song
+is next built or when they reach the end of the LRU.
+
+Hits only update the file's access time, which drives LRU eviction once the
+cache grows past ``BRANDED_CACHE_MAX_BYTES``. The modification time is left
+alone so the ETag stays stable for resumed downloads.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .branding import BRANDING_VERSION, BrandingSpec, build_branded_file
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_SUFFIX = '.mp3'
+
+
+def _file_signature(path):
+    if not path:
+        return ''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+    return f'{path}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def artifact_key(spec):
+    """
+    Hash of a BrandingSpec. The audio and cover files enter by path, size and
+    mtime, not by their contents, so a file rewritten in place with the same
+    size and mtime keeps its key.
+    """
+    parts = [
+        f'v{BRANDING_VERSION}',
+        str(spec.song_id),
+        _file_signature(spec.audio_path),
+        spec.title,
+        spec.artist,
+        spec.genre,
+        _file_signature(spec.cover_path),
+    ]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ArtifactStore:
+    """Size-bounded LRU store of branded files."""
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+
+    def song_dir(self, song_id):
+        return os.path.join(self.root, str(song_id))
+
+    def path_for(self, spec):
+        return os.path.join(self.song_dir(spec.song_id), artifact_key(spec) + ARTIFACT_SUFFIX)
+
+    def get(self, spec):
+        """Path of the cached artifact for ``spec``, or None on a miss."""
+        path = self.path_for(spec)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        try:
+            # Record the hit for LRU without changing mtime (and so the ETag)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+        return path
+
+    def get_or_build(self, spec, builder=build_branded_file):
+        """Return the artifact path for ``spec``, building it on a miss."""
+        path = self.get(spec)
+        if path is not None:
+            return path
+
+        path = self.path_for(spec)
+        song_dir = os.path.dirname(path)
+        os.makedirs(song_dir, exist_ok=True)
+        # Build in a private temp dir and swap in, so concurrent downloads never see a partial file
+        with tempfile.TemporaryDirectory(dir=song_dir, prefix='.build-') as temp_dir:
+            temp_output = os.path.join(temp_dir, os.path.basename(path))
+            builder(spec, temp_output)
+            os.replace(temp_output, path)
+
+        self.discard_stale(spec.song_id, keep=os.path.basename(path))
+        self.evict(keep=path)
+        return path
+
+    def discard_stale(self, song_id, keep=None):
+        """Delete a song's artifacts other than ``keep``. Returns files removed."""
+        removed = 0
+        try:
+            names = os.listdir(self.song_dir(song_id))
+        except OSError:
+            return 0
+        for name in names:
+            if name == keep or not name.endswith(ARTIFACT_SUFFIX):
+                continue
+            try:
+                os.remove(os.path.join(self.song_dir(song_id), name))
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def invalidate(self, song_id):
+        """Delete every artifact for a song."""
+        shutil.rmtree(self.song_dir(song_id), ignore_errors=True)
+
+    def _entries(self):
+        entries = []
+        try:
+            song_dirs = os.listdir(self.root)
+        except OSError:
+            return entries
+        for song_dir in song_dirs:
+            directory = os.path.join(self.root, song_dir)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(ARTIFACT_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_atime_ns, stat.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used artifacts until under ``max_bytes``."""
+        if not self.max_bytes:
+            return 0
+        with self._evict_lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            if removed:
+                logger.info("Evicted %d branded artifacts; cache now %d bytes", removed, total)
+            return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore(
+                    root=getattr(settings, 'BRANDED_DOWNLOAD_ROOT', os.path.join(settings.BASE_DIR, 'var', 'branded')),
+                    max_bytes=getattr(settings, 'BRANDED_CACHE_MAX_BYTES', 2 * 1024 ** 3),
+                )
+    return _store
+
+
+def branded_file_for(song):
+    """Path of the branded download for ``song``, building it if needed."""
+    return get_store().get_or_build(BrandingSpec.for_song(song))
+
+
+def refresh_song(song):
+    """Drop artifacts that no longer match ``song``'s current fields."""
+    store = get_store()
+    if not song.audio_file:
+        store.invalidate(song.pk)
+        return
+    try:
+        spec = BrandingSpec.for_song(song)
+    except (NotImplementedError, ValueError):
+        store.invalidate(song.pk)
+        return
+    store.discard_stale(song.pk, keep=os.path.basename(store.path_for(spec)))
@@ -0,0 +1,405 @@
+# music/branding.py
+"""
+Sangabiz branding for downloaded MP3s: a rendered cover and ID3 metadata.
+Other formats (WAV, M4A, OGG, FLAC) have no ID3 tag to splice and are
+served unchanged.
+
+Everything here works from a ``BrandingSpec`` rather than a Song instance,
+so branded files can be built outside the request (in a worker process or a
+management command) without touching the ORM.
+"""
+import functools
+import hashlib
+import io
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from . import id3splice
+
+# Import for image and audio processing
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+    print("Pillow not installed - cover art branding disabled")
+
+try:
+    import mutagen
+    from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, APIC, COMM
+    from mutagen.mp3 import MP3
+    HAS_MUTAGEN = True
+except ImportError:
+    HAS_MUTAGEN = False
+    print("Mutagen not installed - metadata branding disabled")
+
+# Bump when the cover layout or tag set changes so cached artifacts are rebuilt
+BRANDING_VERSION = 4
+
+
+@dataclass(frozen=True)
+class BrandingSpec:
+    """Everything that goes into a branded download of one song."""
+    song_id: int
+    title: str
+    artist: str
+    genre: str
+    audio_path: str
+    cover_path: str = ''
+
+    @classmethod
+    def for_song(cls, song):
+        cover_path = ''
+        if song.cover_image:
+            try:
+                cover_path = song.cover_image.path
+            except (NotImplementedError, ValueError):
+                cover_path = ''
+        return cls(
+            song_id=song.pk,
+            title=song.title,
+            artist=song.artist.name,
+            genre=song.genre.name if song.genre_id else '',
+            audio_path=song.audio_file.path,
+            cover_path=cover_path,
+        )
+
+    @property
+    def has_cover(self):
+        return bool(self.cover_path) and os.path.exists(self.cover_path)
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.audio_path)[1].lower() or '.mp3'
+
+    @property
+    def download_filename(self):
+        return f"Sangabiz - {self.title} - {self.artist}{self.extension}"
+
+    @property
+    def content_type(self):
+        if self.extension == '.mp3':
+            return 'audio/mpeg'
+        return mimetypes.guess_type('audio' + self.extension)[0] or 'application/octet-stream'
+
+    @property
+    def is_mp3(self):
+        """True when the source is an MP3 stream that takes an ID3v2 tag"""
+        if self.extension != '.mp3':
+            return False
+        if not HAS_MUTAGEN:
+            return True
+        try:
+            stat = os.stat(self.audio_path)
+        except OSError:
+            return False
+        return _is_mp3(self.audio_path, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _fonts():
+    """(large, small) fonts, loaded once per process"""
+    # Use default font (works on all systems)
+    return ImageFont.load_default(), ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_digest(path, size, mtime_ns):
+    """sha256 of a file's contents; size/mtime are part of the cache key"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_mp3(path, size, mtime_ns):
+    """Whether mutagen reads ``path`` as MP3; size/mtime are part of the cache key"""
+    try:
+        return isinstance(mutagen.File(path), MP3)
+    except Exception:
+        return False
+
+
+def cover_render_key(spec):
+    """Hash of everything that shows up on a branded cover"""
+    cover_digest = ''
+    if spec.has_cover:
+        stat = os.stat(spec.cover_path)
+        cover_digest = _file_digest(spec.cover_path, stat.st_size, stat.st_mtime_ns)
+    parts = [f'v{BRANDING_VERSION}', cover_digest, spec.title, spec.artist]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _cover_cache_root():
+    return str(getattr(settings, 'BRANDED_COVER_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'var', 'covers')))
+
+
+_cover_evict_lock = threading.Lock()
+
+
+def _cover_entries(root):
+    entries = []
+    try:
+        prefixes = os.listdir(root)
+    except OSError:
+        return entries
+    for prefix in prefixes:
+        directory = os.path.join(root, prefix)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith('.jpg'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime_ns, stat.st_size, path))
+    return entries
+
+
+def evict_covers(keep=None):
+    """Remove least recently used renders until under ``BRANDED_COVER_CACHE_MAX_BYTES``."""
+    max_bytes = getattr(settings, 'BRANDED_COVER_CACHE_MAX_BYTES', 256 * 1024 ** 2)
+    if not max_bytes:
+        return 0
+    with _cover_evict_lock:
+        entries = _cover_entries(_cover_cache_root())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def _render_cover(spec, output_path):
+    """Create branded cover art with Sangabiz branding"""
+    try:
+        if not HAS_PIL:
+            # Fallback without PIL
+            if spec.has_cover:
+                shutil.copy2(spec.cover_path, output_path)
+            return
+
+        # Create a new cover image
+        width, height = 500, 500
+
+        # Use original cover if available, otherwise create new
+        if spec.has_cover:
+            with Image.open(spec.cover_path) as source:
+                # Let the JPEG decoder downscale before the LANCZOS pass
+                source.draft('RGB', (width, height))
+                image = source.convert('RGB').resize((width, height), Image.LANCZOS)
+        else:
+            # Create default background
+            image = Image.new('RGB', (width, height), '#1DB954')  # Sangabiz green
+
+        draw = ImageDraw.Draw(image)
+
+        # Add text branding
+        try:
+            font_large, font_small = _fonts()
+
+            # Song title
+            title = spec.title
+            title_bbox = draw.textbbox((0, 0), title, font=font_large)
+            title_width = title_bbox[2] - title_bbox[0]
+            title_x = (width - title_width) // 2
+            draw.text((title_x, height//2 - 30), title, fill='white', font=font_large)
+
+            # Artist name
+            artist = f"by {spec.artist}"
+            artist_bbox = draw.textbbox((0, 0), artist, font=font_small)
+            artist_width = artist_bbox[2] - artist_bbox[0]
+            artist_x = (width - artist_width) // 2
+            draw.text((artist_x, height//2), artist, fill='#333333', font=font_small)
+
+            # Sangabiz branding
+            branding = "Downloaded from Sangabiz"
+            branding_bbox = draw.textbbox((0, 0), branding, font=font_small)
+            branding_width = branding_bbox[2] - branding_bbox[0]
+            branding_x = (width - branding_width) // 2
+            draw.text((branding_x, height - 40), branding, fill='#666666', font=font_small)
+
+        except Exception as e:
+            print(f"Text rendering error: {e}")
+
+        # Save the branded cover
+        image.save(output_path, 'JPEG', quality=90)
+
+    except Exception as e:
+        print(f"Cover creation error: {e}")
+        # Final fallback
+        if spec.has_cover:
+            shutil.copy2(spec.cover_path, output_path)
+
+
+def branded_cover_path(spec):
+    """
+    Path of the rendered branded cover for ``spec``, or None if there is
+    nothing to embed. Renders are cached on disk by ``cover_render_key``, so
+    every download of a song shares one render; the least recently used are
+    evicted once the cache passes ``BRANDED_COVER_CACHE_MAX_BYTES``.
+    """
+    key = cover_render_key(spec)
+    path = os.path.join(_cover_cache_root(), key[:2], key + '.jpg')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        pass
+    else:
+        try:
+            # Record the hit for LRU eviction
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Render beside the target and swap in, so readers never see half a JPEG
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        _render_cover(spec, temp_path)
+        if not os.path.getsize(temp_path):
+            return None
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    evict_covers(keep=path)
+    return path
+
+
+def create_branded_cover(spec, output_path):
+    """Write the branded cover for ``spec`` to ``output_path``"""
+    cover_path = branded_cover_path(spec)
+    if cover_path:
+        shutil.copyfile(cover_path, output_path)
+
+
+def _apply_branding(tags, spec, cover_path=None):
+    """Set the Sangabiz frames on a mutagen ID3 tag"""
+    # Set basic metadata
+    tags.add(TIT2(encoding=3, text=spec.title))
+    tags.add(TPE1(encoding=3, text=spec.artist))
+    tags.add(TALB(encoding=3, text="Sangabiz Music"))
+
+    if spec.genre:
+        tags.add(TCON(encoding=3, text=spec.genre))
+
+    # Add comment with branding
+    comment_text = "Downloaded from Sangabiz - Your Favorite Music Platform"
+    tags.add(COMM(encoding=3, text=comment_text))
+
+    # Add cover art if available
+    if cover_path and os.path.exists(cover_path):
+        try:
+            with open(cover_path, 'rb') as cover_file:
+                cover_data = cover_file.read()
+
+            tags.add(
+                APIC(
+                    encoding=3,
+                    mime='image/jpeg',
+                    type=3,  # Cover (front)
+                    desc='Cover',
+                    data=cover_data
+                )
+            )
+        except Exception as e:
+            print(f"Cover art embedding error: {e}")
+
+
+def add_branded_metadata(audio_path, spec, cover_path=None):
+    """Add Sangabiz branding to audio file metadata"""
+    try:
+        if not HAS_MUTAGEN:
+            return
+
+        # Load the audio file
+        audio = MP3(audio_path, ID3=ID3)
+
+        # Ensure ID3 tag exists
+        try:
+            audio.add_tags()
+        except mutagen.id3.error:
+            pass  # Tags already exist
+
+        _apply_branding(audio.tags, spec, cover_path)
+
+        # Save metadata
+        audio.save()
+
+    except Exception as e:
+        print(f"Metadata error: {e}")
+
+
+def branded_tag(spec, cover_path=None):
+    """
+    Serialized ID3v2 tag for a branded download: the original file's frames
+    with the Sangabiz ones set on top, ready to splice in front of the audio.
+    """
+    try:
+        tags = ID3(spec.audio_path)
+    except mutagen.id3.ID3NoHeaderError:
+        tags = ID3()
+    _apply_branding(tags, spec, cover_path)
+    output = io.BytesIO()
+    tags.save(output, v1=0)
+    return output.getvalue()
+
+
+def build_branded_file(spec, output_path):
+    """Write a branded copy of ``spec.audio_path`` to ``output_path``."""
+    if not spec.is_mp3:
+        shutil.copyfile(spec.audio_path, output_path)
+        return
+    cover_path = branded_cover_path(spec)
+    if HAS_MUTAGEN:
+        try:
+            # New tag + the original frames; the audio is copied in the kernel, never re-read by mutagen
+            tag = branded_tag(spec, cover_path)
+            id3splice.write_spliced(tag, spec.audio_path, output_path)
+            return
+        except Exception as e:
+            print(f"Tag splicing error, rewriting a full copy instead: {e}")
+    shutil.copy2(spec.audio_path, output_path)
+    add_branded_metadata(output_path, spec, cover_path)
+
+
+def open_branded_stream(spec, chunk_size=64 * 1024):
+    """
+    ``(iterator, length)`` of a branded download built on the fly, for when
+    the artifact cache is turned off. Requires mutagen.
+    """
+    if spec.is_mp3:
+        tag = branded_tag(spec, branded_cover_path(spec))
+        bounds = id3splice.audio_bounds(spec.audio_path)
+    else:
+        tag, bounds = b'', (0, os.path.getsize(spec.audio_path))
+    return (
+        id3splice.iter_spliced(tag, spec.audio_path, bounds=bounds, chunk_size=chunk_size),
+        id3splice.spliced_size(tag, *bounds),
+    )
@@ -0,0 +1,116 @@
+# music/cachelock.py
+"""
+Cross-process primitives on top of the default cache.
+
+With Redis behind the cache they use native commands (``SET NX`` plus a
+compare-and-delete script, Redis sets). On other cache backends they fall
+back to the plain cache API, which is only safe within one process or
+with a single worker; production runs on Redis.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+
+# Delete the lock only if it still holds our token
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def redis_client():
+    """The redis-py client behind the default cache, or None when it is not Redis."""
+    backend = getattr(cache, '_cache', None)
+    if backend is None or not hasattr(backend, 'get_client'):
+        return None
+    return backend.get_client(write=True)
+
+
+class CacheLock:
+    """
+    Lock shared by every worker. Each holder gets its own token, and only
+    that token releases the lock, so a holder that outlived ``timeout``
+    cannot release a lock another worker has taken since.
+    """
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        self.token = None
+
+    def acquire(self, wait=0, interval=0.05):
+        """Try to take the lock, retrying for up to ``wait`` seconds. Returns True if held."""
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        client = redis_client()
+        while True:
+            if client is not None:
+                taken = client.set(cache.make_key(self.key), token, nx=True, ex=self.timeout)
+            else:
+                taken = cache.add(self.key, token, timeout=self.timeout)
+            if taken:
+                self.token = token
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def release(self):
+        if self.token is None:
+            return
+        client = redis_client()
+        if client is not None:
+            client.eval(_RELEASE_SCRIPT, 1, cache.make_key(self.key), self.token)
+        elif cache.get(self.key) == self.token:
+            cache.delete(self.key)
+        self.token = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"Lock {self.key} is held elsewhere")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SharedSet:
+    """A set of integers visible to every worker (a Redis set when available)."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def _update(self, change):
+        # Non-Redis fallback: read-modify-write under a lock
+        lock = CacheLock(f'{self.key}:lock', timeout=10)
+        if not lock.acquire(wait=5, interval=0.01):
+            raise RuntimeError(f"Could not lock shared set {self.key}")
+        try:
+            members = set(cache.get(self.key) or ())
+            change(members)
+            cache.set(self.key, members, timeout=None)
+        finally:
+            lock.release()
+
+    def add(self, member):
+        client = redis_client()
+        if client is not None:
+            client.sadd(cache.make_key(self.key), member)
+        else:
+            self._update(lambda members: members.add(member))
+
+    def discard(self, member):
+        client = redis_client()
+        if client is not None:
+            client.srem(cache.make_key(self.key), member)
+        else:
+            self._update(lambda members: members.discard(member))
+
+    def members(self):
+        client = redis_client()
+        if client is not None:
+            return {int(member) for member in client.smembers(cache.make_key(self.key))}
+        return set(cache.get(self.key) or ())
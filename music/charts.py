@@ -0,0 +1,163 @@
+# music/charts.py
+"""
+Chart builder: ranks songs for each ``Chart.CHART_TYPE_CHOICES`` type from
+the play/download rollups, then brings ``ChartEntry`` in line with the new
+ranking and records the week in ``ChartSnapshot``.
+
+Only entries whose song, movement or weeks on chart changed are rewritten,
+all in one transaction, so readers never see a half-built chart. Run it
+from cron (``manage.py build_charts``); pages only read ChartEntry.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from analytics import rollups
+from analytics.models import SongRollup
+
+from .models import Chart, ChartEntry, ChartSnapshot
+
+logger = logging.getLogger(__name__)
+
+# A download counts like two plays, as in Song.popularity_score
+DOWNLOAD_WEIGHT = 2
+
+
+def chart_week(moment=None):
+    """Monday of the (UTC) chart week containing ``moment``."""
+    day = rollups.bucket_start(moment or timezone.now(), 'day').date()
+    return day - timedelta(days=day.weekday())
+
+
+def _ranking(period, start, size, **song_filters):
+    """``[(song_id, plays, downloads), ...]`` for approved songs, best first."""
+    filters = {f'song__{key}': value for key, value in song_filters.items()}
+    rows = (
+        SongRollup.objects
+        .filter(period=period, bucket__gte=start, song__is_approved=True, **filters)
+        .values('song_id')
+        .annotate(total_plays=Sum('plays'), total_downloads=Sum('downloads'))
+        .annotate(score=F('total_plays') + F('total_downloads') * DOWNLOAD_WEIGHT)
+        .filter(score__gt=0)
+        .order_by('-score', '-total_plays', 'song_id')
+        .values_list('song_id', 'total_plays', 'total_downloads')
+    )
+    return list(rows[:size])
+
+
+def rank_top_songs(size):
+    """Most played and downloaded over the last 7 days."""
+    return _ranking('day', rollups.since(7), size)
+
+
+def rank_trending(size):
+    """Most played and downloaded over the last 24 hours."""
+    start = rollups.bucket_start(timezone.now(), 'hour') - timedelta(hours=23)
+    return _ranking('hour', start, size)
+
+
+def rank_new_releases(size):
+    """Best of the last 7 days among songs uploaded in the last CHART_NEW_RELEASE_DAYS."""
+    uploaded_since = timezone.now() - timedelta(days=getattr(settings, 'CHART_NEW_RELEASE_DAYS', 30))
+    return _ranking('day', rollups.since(7), size, upload_date__gte=uploaded_since)
+
+
+def rank_local_charts(size):
+    """Best of the last 7 days in the LOCAL_CHART_GENRES genres."""
+    genres = getattr(settings, 'LOCAL_CHART_GENRES', [])
+    if not genres:
+        return None
+    return _ranking('day', rollups.since(7), size, genre__name__in=genres)
+
+
+RANKERS = {
+    'top_songs': rank_top_songs,
+    'trending': rank_trending,
+    'new_releases': rank_new_releases,
+    'local_charts': rank_local_charts,
+}
+
+
+def build_chart(chart, size=None, week=None):
+    """
+    Rebuild ``chart`` for ``week`` (default: this week). Returns the number
+    of entries written, or None when its type has nothing to rank by.
+    """
+    ranker = RANKERS.get(chart.chart_type)
+    if ranker is None:
+        return None
+    ranking = ranker(size or getattr(settings, 'CHART_SIZE', 50))
+    if ranking is None:
+        return None
+    week = week or chart_week()
+
+    # Movement is measured against last week's published chart
+    previous = chart.snapshots.filter(week__lt=week).order_by('-week').first()
+    last_week = {item['song_id']: item for item in previous.entries} if previous else {}
+
+    entries = []
+    for position, (song_id, plays, downloads) in enumerate(ranking, start=1):
+        before = last_week.get(song_id)
+        entries.append({
+            'song_id': song_id,
+            'position': position,
+            'previous_position': before['position'] if before else None,
+            'weeks_on_chart': before['weeks_on_chart'] + 1 if before else 1,
+            'plays': plays,
+            'downloads': downloads,
+        })
+
+    wanted = {
+        item['position']: (item['song_id'], item['previous_position'], item['weeks_on_chart'])
+        for item in entries
+    }
+    with transaction.atomic():
+        current = {
+            entry.position: entry
+            for entry in ChartEntry.objects.select_for_update().filter(chart=chart)
+        }
+        stale = [
+            entry.pk for position, entry in current.items()
+            if wanted.get(position) != (entry.song_id, entry.previous_position, entry.weeks_on_chart)
+        ]
+        # Delete before inserting so reused positions never clash on (chart, position)
+        ChartEntry.objects.filter(pk__in=stale).delete()
+        changed = [
+            ChartEntry(chart=chart, song_id=song_id, position=position,
+                       previous_position=previous_position, weeks_on_chart=weeks_on_chart)
+            for position, (song_id, previous_position, weeks_on_chart) in wanted.items()
+            if position not in current or current[position].pk in stale
+        ]
+        ChartEntry.objects.bulk_create(changed)
+        ChartSnapshot.objects.update_or_create(chart=chart, week=week, defaults={'entries': entries})
+        Chart.objects.filter(pk=chart.pk).update(updated_at=timezone.now())
+
+    logger.info("Chart %s: %d entries, %d written, %d replaced or dropped",
+                chart.pk, len(entries), len(changed), len(stale))
+    return len(changed)
+
+
+def build_charts(charts=None, size=None):
+    """Rebuild every active chart (or ``charts``). Returns ``{chart: entries written or None}``."""
+    if charts is None:
+        charts = Chart.objects.filter(is_active=True)
+    results = {}
+    for chart in charts:
+        try:
+            results[chart] = build_chart(chart, size=size)
+        except Exception:
+            logger.exception("Building chart %s failed", chart.pk)
+            results[chart] = False
+    return results
+
+
+def snapshot_entries(snapshot):
+    """A stored week as ``[(entry dict, Song), ...]``, skipping songs deleted since."""
+    from .models import Song
+
+    songs = Song.objects.select_related('artist').in_bulk([item['song_id'] for item in snapshot.entries])
+    return [(item, songs[item['song_id']]) for item in snapshot.entries if item['song_id'] in songs]
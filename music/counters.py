@@ -0,0 +1,258 @@
+# music/counters.py
+"""
+Write-behind buffer for Song play/download counters.
+
+Views call ``increment_plays`` / ``increment_downloads`` instead of
+``song.plays += 1; song.save()``. Increments are collected in memory (or in
+the shared cache) and written periodically as a single batched ``F()``
+UPDATE, so a hot song costs one row update per flush instead of one
+full-row save per play, and concurrent increments are never lost.
+"""
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When
+from django.dispatch import Signal
+
+from .cachelock import SharedSet
+from .flushing import PeriodicFlusher
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('plays', 'downloads')
+
+# Sent after pending deltas have been written to the database.
+# ``deltas`` is a dict of {song_id: {'plays': n, 'downloads': m}}.
+counters_flushed = Signal()
+
+# Largest number of songs written by one UPDATE statement
+FLUSH_BATCH_SIZE = 500
+
+
+class MemoryCounterBackend:
+    """Pending deltas kept in this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+        self._size = 0
+
+    def add(self, song_id, field, amount):
+        with self._lock:
+            self._pending[song_id][field] += amount
+            self._size += amount
+            return self._size
+
+    def pending(self, song_id):
+        with self._lock:
+            if song_id in self._pending:
+                return dict(self._pending[song_id])
+        return dict.fromkeys(COUNTER_FIELDS, 0)
+
+    def drain(self):
+        with self._lock:
+            deltas = {song_id: dict(counts) for song_id, counts in self._pending.items()}
+            self._pending.clear()
+            self._size = 0
+        return deltas
+
+    def restore(self, deltas):
+        with self._lock:
+            for song_id, counts in deltas.items():
+                for field, amount in counts.items():
+                    if amount:
+                        self._pending[song_id][field] += amount
+            # Recounted rather than added to, so restored deltas aren't counted twice
+            self._size = sum(sum(counts.values()) for counts in self._pending.values())
+
+
+class CacheCounterBackend:
+    """
+    Pending deltas kept in the shared cache so every worker reads the same
+    totals. The ids of songs with pending deltas are a shared set too, so
+    any worker's flusher drains them, including deltas left behind by a
+    worker that died before its flush. Draining subtracts what it claims,
+    so concurrent increments survive and two flushers never write the same
+    delta twice.
+    """
+
+    key_prefix = 'songcounter'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = SharedSet(f'{self.key_prefix}:dirty')
+        # Increments made by this process since its last drain; only used
+        # to wake the flusher early
+        self._size = 0
+
+    def _key(self, song_id, field):
+        return f'{self.key_prefix}:{field}:{song_id}'
+
+    def _incr(self, song_id, field, amount):
+        key = self._key(song_id, field)
+        try:
+            total = cache.incr(key, amount)
+        except ValueError:
+            # Key does not exist yet; another worker may create it first
+            if cache.add(key, amount, timeout=None):
+                total = amount
+            else:
+                total = cache.incr(key, amount)
+        if total == amount:
+            # First delta since the song was last drained
+            self._dirty.add(song_id)
+
+    def add(self, song_id, field, amount):
+        self._incr(song_id, field, amount)
+        with self._lock:
+            self._size += amount
+            return self._size
+
+    def pending(self, song_id):
+        keys = {self._key(song_id, field): field for field in COUNTER_FIELDS}
+        values = cache.get_many(list(keys))
+        return {field: max(values.get(key, 0), 0) for key, field in keys.items()}
+
+    def _claim(self, key, amount):
+        """Subtract up to ``amount`` from ``key``; returns what was taken and what is left."""
+        left = cache.decr(key, amount)
+        if left < 0:
+            # Another flusher took part of it first; give that part back
+            cache.incr(key, -left)
+            return amount + left, 0
+        return amount, left
+
+    def drain(self):
+        with self._lock:
+            self._size = 0
+
+        deltas = {}
+        for song_id in self._dirty.members():
+            # Unregister before claiming: an increment landing after the
+            # claim re-registers the song, one landing before is claimed
+            self._dirty.discard(song_id)
+            counts = dict.fromkeys(COUNTER_FIELDS, 0)
+            remaining = False
+            for field, amount in self.pending(song_id).items():
+                if amount:
+                    counts[field], left = self._claim(self._key(song_id, field), amount)
+                    remaining = remaining or left > 0
+            if remaining:
+                self._dirty.add(song_id)
+            if any(counts.values()):
+                deltas[song_id] = counts
+        return deltas
+
+    def restore(self, deltas):
+        # Not new increments: they go back to the shared keys without
+        # counting towards this process's early-flush threshold again
+        for song_id, counts in deltas.items():
+            for field, amount in counts.items():
+                if amount:
+                    self._incr(song_id, field, amount)
+
+
+BACKENDS = {
+    'memory': MemoryCounterBackend,
+    'cache': CacheCounterBackend,
+}
+
+
+class CounterBuffer:
+    """Collects counter increments and flushes them on a background timer."""
+
+    def __init__(self, backend, flush_interval, max_pending):
+        self.backend = backend
+        self.max_pending = max_pending
+        self._flush_lock = threading.Lock()
+        self._flusher = PeriodicFlusher(self.flush, flush_interval, 'song-counter-flusher')
+
+    def add(self, song_id, field, amount=1):
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"Unknown counter field: {field}")
+        size = self.backend.add(song_id, field, amount)
+        self._flusher.start()
+        if size >= self.max_pending:
+            self._flusher.wake()
+
+    def pending(self, song_id):
+        return self.backend.pending(song_id)
+
+    def flush(self):
+        """Write all pending deltas to the database. Returns songs updated."""
+        from .models import Song
+
+        with self._flush_lock:
+            deltas = self.backend.drain()
+            if not deltas:
+                return 0
+            try:
+                song_ids = list(deltas)
+                for start in range(0, len(song_ids), FLUSH_BATCH_SIZE):
+                    batch = song_ids[start:start + FLUSH_BATCH_SIZE]
+                    updates = {}
+                    for field in COUNTER_FIELDS:
+                        whens = [
+                            When(pk=song_id, then=Value(deltas[song_id][field]))
+                            for song_id in batch if deltas[song_id][field]
+                        ]
+                        if whens:
+                            updates[field] = F(field) + Case(
+                                *whens, default=Value(0), output_field=IntegerField()
+                            )
+                    Song.objects.filter(pk__in=batch).update(**updates)
+            except Exception:
+                logger.exception("Song counter flush failed; keeping %d pending songs", len(deltas))
+                self.backend.restore(deltas)
+                return 0
+
+        counters_flushed.send(sender=Song, deltas=deltas)
+        return len(deltas)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                backend_name = getattr(settings, 'SONG_COUNTER_BACKEND', 'cache')
+                try:
+                    backend = BACKENDS[backend_name]()
+                except KeyError:
+                    raise ValueError(f"Unknown SONG_COUNTER_BACKEND: {backend_name}")
+                _buffer = CounterBuffer(
+                    backend,
+                    flush_interval=getattr(settings, 'SONG_COUNTER_FLUSH_INTERVAL', 5),
+                    max_pending=getattr(settings, 'SONG_COUNTER_MAX_PENDING', 1000),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def _song_id(song):
+    return getattr(song, 'pk', song)
+
+
+def increment_plays(song, amount=1):
+    get_buffer().add(_song_id(song), 'plays', amount)
+
+
+def increment_downloads(song, amount=1):
+    get_buffer().add(_song_id(song), 'downloads', amount)
+
+
+def pending_counts(song):
+    """Deltas for ``song`` that have not been written to the database yet."""
+    return get_buffer().pending(_song_id(song))
+
+
+def flush():
+    return get_buffer().flush()
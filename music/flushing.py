@@ -0,0 +1,47 @@
+# music/flushing.py
+"""Background thread shared by the write-behind buffers in this app."""
+import logging
+import threading
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """
+    Calls ``flush`` on a daemon thread every ``interval`` seconds, or sooner
+    when ``wake()`` is called. The thread is started lazily on first use so
+    management commands and migrations never spawn it.
+    """
+
+    def __init__(self, flush, interval, name):
+        self.flush = flush
+        self.interval = interval
+        self.name = name
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("%s flush failed", self.name)
+            finally:
+                # The flusher thread owns its own connection; don't leak it
+                connection.close()
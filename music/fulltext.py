@@ -0,0 +1,262 @@
+# music/fulltext.py
+"""
+Full-text search over songs (title, artist, genre, lyrics), artists (name,
+genre, bio) and genres (name, description).
+
+Every searchable object has one document in ``music_search_index``: an
+FTS5 virtual table on SQLite, a ``tsvector`` column with a GIN index on
+PostgreSQL (both created by migration 0017). Documents have three fields
+weighted from most to least important: the name, its context (artist and
+genre), and long text (lyrics, bio, description). ``ids`` returns matches
+ranked by BM25 / ``ts_rank_cd``, treating each query word as a prefix.
+
+Documents are kept current by the signal handlers in ``music.signals``;
+``manage.py rebuild_search_index`` (and migration 0020) rewrites them all
+and then writes a marker row. On other databases, if the index table is
+missing, or until the marker exists, searches fall back to ``icontains``.
+"""
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'music_search_index'
+
+KINDS = {'song': 1, 'artist': 2, 'genre': 3}
+
+# Words of a query that are searched; the rest are ignored
+MAX_QUERY_TERMS = 8
+
+# SQLite rowid = object id * ROWID_STRIDE + kind
+ROWID_STRIDE = 4
+
+# bm25() column weights: name, context, long text
+SQLITE_WEIGHTS = (10.0, 4.0, 1.0)
+
+# Seconds before a process looks again for the marker of a finished rebuild
+BUILT_RECHECK_SECONDS = 60
+
+_available = {}
+# alias: True once the marker was seen, else when it was last looked for
+_built = {}
+
+
+def index_backend():
+    """'sqlite' or 'postgresql' when the database has the index table, else None"""
+    alias = connection.alias
+    if alias not in _available:
+        vendor = connection.vendor
+        if vendor in ('sqlite', 'postgresql') and TABLE in connection.introspection.table_names():
+            _available[alias] = vendor
+        else:
+            _available[alias] = None
+            logger.warning("Full-text index unavailable on %s; searching with icontains", vendor)
+    return _available[alias]
+
+
+def _marker_sql():
+    if index_backend() == 'sqlite':
+        return f"SELECT 1 FROM {TABLE} WHERE rowid = 0"
+    return f"SELECT 1 FROM {TABLE} WHERE kind = 0 AND object_id = 0"
+
+
+def _is_built():
+    alias = connection.alias
+    checked = _built.get(alias)
+    if checked is True:
+        return True
+    if checked is not None and time.monotonic() - checked < BUILT_RECHECK_SECONDS:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(_marker_sql())
+        built = cursor.fetchone() is not None
+    if not built:
+        logger.warning("Full-text index not built yet; searching with icontains until "
+                       "`manage.py rebuild_search_index` has run")
+    _built[alias] = True if built else time.monotonic()
+    return built
+
+
+def backend():
+    """
+    'sqlite', 'postgresql' or None when only the ``icontains`` fallback
+    works (no index table, or no rebuild has filled it yet)
+    """
+    vendor = index_backend()
+    return vendor if vendor and _is_built() else None
+
+
+def _model(kind):
+    from artists.models import Artist
+    from .models import Genre, Song
+
+    return {'song': Song, 'artist': Artist, 'genre': Genre}[kind]
+
+
+def indexable(kind):
+    """Queryset of the objects of ``kind`` that belong in the index"""
+    if kind == 'song':
+        return _model('song').objects.filter(is_approved=True).select_related('artist', 'genre')
+    if kind == 'artist':
+        return _model('artist').objects.select_related('genre')
+    return _model('genre').objects.all()
+
+
+def _document(kind, obj):
+    """``(name, context, long text)`` for ``obj``"""
+    if kind == 'song':
+        context = ' '.join(filter(None, [obj.artist.name, obj.genre.name if obj.genre else None]))
+        return obj.title, context, obj.lyrics or ''
+    if kind == 'artist':
+        return obj.name, obj.genre.name if obj.genre else '', obj.bio or ''
+    return obj.name, '', obj.description or ''
+
+
+def remove(kind, object_ids):
+    object_ids = list(object_ids)
+    if not object_ids or not index_backend():
+        return
+    placeholders = ', '.join(['%s'] * len(object_ids))
+    with connection.cursor() as cursor:
+        if index_backend() == 'sqlite':
+            rowids = [pk * ROWID_STRIDE + KINDS[kind] for pk in object_ids]
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({placeholders})", rowids)
+        else:
+            cursor.execute(
+                f"DELETE FROM {TABLE} WHERE kind = %s AND object_id IN ({placeholders})",
+                [KINDS[kind], *object_ids],
+            )
+
+
+def index(kind, objects):
+    """Write (or rewrite) the documents of ``objects``, which must all be indexable"""
+    objects = list(objects)
+    if not objects or not index_backend():
+        return
+    if index_backend() == 'sqlite':
+        remove(kind, [obj.pk for obj in objects])
+        rows = [(obj.pk * ROWID_STRIDE + KINDS[kind], *_document(kind, obj)) for obj in objects]
+        sql = f"INSERT INTO {TABLE} (rowid, name, context, body) VALUES (%s, %s, %s, %s)"
+    else:
+        config = getattr(settings, 'SEARCH_POSTGRES_CONFIG', 'simple')
+        rows = []
+        for obj in objects:
+            name, context, body = _document(kind, obj)
+            rows.append((KINDS[kind], obj.pk, config, name, config, context, config, body))
+        sql = (
+            f"INSERT INTO {TABLE} (kind, object_id, document) VALUES (%s, %s, "
+            "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'B') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'C')) "
+            "ON CONFLICT (kind, object_id) DO UPDATE SET document = EXCLUDED.document"
+        )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def index_song(song):
+    """Index an approved song, drop an unapproved one"""
+    if song.is_approved:
+        index('song', indexable('song').filter(pk=song.pk))
+    else:
+        remove('song', [song.pk])
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_QUERY_TERMS]
+
+
+def _fallback(kind, query, limit):
+    words = terms(query)
+    if not words:
+        return []
+    if kind == 'song':
+        fields = ('title', 'artist__name', 'genre__name', 'lyrics')
+    elif kind == 'artist':
+        fields = ('name', 'bio')
+    else:
+        fields = ('name', 'description')
+    matches = indexable(kind)
+    for word in words:
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': word})
+        matches = matches.filter(condition)
+    return list(matches.values_list('pk', flat=True)[:limit])
+
+
+def ids(kind, query, limit=50):
+    """Ids of the objects of ``kind`` matching every word of ``query``, best match first"""
+    words = terms(query)
+    if not words:
+        return []
+    if not backend():
+        return _fallback(kind, query, limit)
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            match = ' '.join('"%s"*' % word for word in words)
+            weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+            cursor.execute(
+                f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid %% {ROWID_STRIDE} = %s "
+                f"ORDER BY bm25({TABLE}, {weights}) LIMIT %s",
+                [match, KINDS[kind], limit],
+            )
+            return [rowid // ROWID_STRIDE for rowid, in cursor.fetchall()]
+        cursor.execute(
+            f"SELECT object_id FROM {TABLE}, to_tsquery(%s::regconfig, %s) query "
+            "WHERE kind = %s AND document @@ query "
+            "ORDER BY ts_rank_cd(document, query) DESC, object_id LIMIT %s",
+            [getattr(settings, 'SEARCH_POSTGRES_CONFIG', 'simple'),
+             ' & '.join(f'{word}:*' for word in words), KINDS[kind], limit],
+        )
+        return [object_id for object_id, in cursor.fetchall()]
+
+
+def search(kind, query, limit=50, queryset=None):
+    """
+    Objects of ``kind`` (from ``queryset`` when given) matching ``query``,
+    best match first.
+    """
+    found = ids(kind, query, limit)
+    queryset = indexable(kind) if queryset is None else queryset
+    by_id = queryset.in_bulk(found)
+    return [by_id[pk] for pk in found if pk in by_id]
+
+
+def rebuild(batch_size=500):
+    """
+    Rewrite every document, then the marker that lets searches use the
+    index. Returns ``{kind: documents written}``.
+    """
+    vendor = index_backend()
+    if not vendor:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+    written = {}
+    for kind in KINDS:
+        written[kind] = 0
+        batch = []
+        for obj in indexable(kind).iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) == batch_size:
+                index(kind, batch)
+                written[kind] += len(batch)
+                batch = []
+        index(kind, batch)
+        written[kind] += len(batch)
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(f"INSERT INTO {TABLE} (rowid, name, context, body) VALUES (0, '', '', '')")
+        else:
+            cursor.execute(
+                f"INSERT INTO {TABLE} (kind, object_id, document) VALUES (0, 0, ''::tsvector) "
+                "ON CONFLICT (kind, object_id) DO NOTHING"
+            )
+    _built[connection.alias] = True
+    return written
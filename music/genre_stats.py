@@ -0,0 +1,148 @@
+# music/genre_stats.py
+"""
+``GenreStats``: song, play and download totals and the leading artists of
+each genre, so the genres page, the home genre block and ``genre_songs``
+stop aggregating the whole catalog on every request.
+
+Totals follow the counter flush incrementally; approvals recount the
+song's genre, and ``manage.py refresh_genre_stats`` recomputes everything
+from cron. Readers go through ``all_genres()``, a cached list of every
+genre with its stats attached. Recounts invalidate it; flushed plays and
+downloads show up when it expires (``GENRE_STATS_CACHE_TIMEOUT``), so a
+busy site does not rebuild it on every flush.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Genre, GenreStats, Song
+
+CACHE_KEY = 'genre_stats:all'
+
+# Artists kept per genre for genre_songs
+TOP_ARTISTS = 8
+
+
+def _total(aggregate):
+    songs = Song.objects.filter(genre=OuterRef('pk'), is_approved=True)
+    return Coalesce(
+        Subquery(songs.values('genre').annotate(total=aggregate).values('total'), output_field=IntegerField()),
+        Value(0),
+    )
+
+
+def _top_artists(genre_ids):
+    """``{genre_id: [artist totals, best first]}`` for ``genre_ids`` (every genre when None)"""
+    songs = Song.objects.filter(is_approved=True, genre__isnull=False)
+    if genre_ids is not None:
+        songs = songs.filter(genre_id__in=genre_ids)
+    rows = (
+        songs.values('genre_id', 'artist_id')
+        .annotate(songs=Count('pk'), plays=Sum('plays'), downloads=Sum('downloads'))
+        .order_by('genre_id', '-plays', '-downloads', 'artist_id')
+    )
+    top = {}
+    for row in rows.iterator():
+        artists = top.setdefault(row.pop('genre_id'), [])
+        if len(artists) < TOP_ARTISTS:
+            artists.append(row)
+    return top
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
+
+
+def refresh(genre_ids=None, create=True):
+    """
+    Recompute the stats of ``genre_ids`` (every genre when None). With
+    ``create`` missing rows are added first. Returns rows updated.
+    """
+    if create:
+        genres = Genre.objects.filter(stats__isnull=True)
+        if genre_ids is not None:
+            genres = genres.filter(pk__in=genre_ids)
+        GenreStats.objects.bulk_create(
+            [GenreStats(genre_id=pk) for pk in genres.values_list('pk', flat=True)],
+            ignore_conflicts=True,
+        )
+
+    rows = GenreStats.objects.all()
+    if genre_ids is not None:
+        rows = rows.filter(pk__in=genre_ids)
+    updated = rows.update(
+        songs=_total(Count('pk')),
+        plays=_total(Sum('plays')),
+        downloads=_total(Sum('downloads')),
+        updated_at=timezone.now(),
+    )
+
+    top = _top_artists(genre_ids)
+    stats = list(rows.only('pk', 'top_artists'))
+    for row in stats:
+        row.top_artists = top.get(row.pk, [])
+    GenreStats.objects.bulk_update(stats, ['top_artists'])
+
+    invalidate()
+    return updated
+
+
+def add_counter_deltas(song_deltas):
+    """Fold a counter flush (``{song_id: {'plays', 'downloads'}}``) into the genre totals"""
+    deltas = {}
+    songs = (
+        Song.objects.filter(pk__in=song_deltas, is_approved=True, genre__isnull=False)
+        .values_list('pk', 'genre_id')
+    )
+    for song_id, genre_id in songs:
+        totals = deltas.setdefault(genre_id, {'plays': 0, 'downloads': 0})
+        totals['plays'] += song_deltas[song_id].get('plays', 0)
+        totals['downloads'] += song_deltas[song_id].get('downloads', 0)
+    if not deltas:
+        return
+
+    updates = {}
+    for field in ('plays', 'downloads'):
+        whens = [When(pk=pk, then=Value(counts[field])) for pk, counts in deltas.items() if counts[field]]
+        if whens:
+            updates[field] = Greatest(
+                F(field) + Case(*whens, default=Value(0), output_field=IntegerField()),
+                Value(0),
+            )
+    if updates:
+        GenreStats.objects.filter(pk__in=deltas).update(updated_at=timezone.now(), **updates)
+
+
+def all_genres():
+    """
+    Every genre ordered by name, with ``song_count``, ``total_plays``,
+    ``total_downloads`` and ``top_artists`` attached. Served from cache.
+    """
+    genres = cache.get(CACHE_KEY)
+    if genres is None:
+        genres = list(Genre.objects.select_related('stats'))
+        missing = [genre.pk for genre in genres if not hasattr(genre, 'stats')]
+        if missing:
+            # New genres (or a fresh deploy) get their row on first read
+            refresh(missing)
+            genres = list(Genre.objects.select_related('stats'))
+        for genre in genres:
+            stats = genre.stats
+            genre.song_count = stats.songs
+            genre.total_plays = stats.plays
+            genre.total_downloads = stats.downloads
+            genre.top_artists = stats.top_artists
+            # Keep the cached objects small
+            genre._state.fields_cache.pop('stats', None)
+        cache.set(CACHE_KEY, genres, getattr(settings, 'GENRE_STATS_CACHE_TIMEOUT', 300))
+    return genres
+
+
+def for_genre(genre_id):
+    """The ``all_genres()`` entry for ``genre_id``, or None"""
+    for genre in all_genres():
+        if genre.pk == genre_id:
+            return genre
+    return None
@@ -0,0 +1,62 @@
+# music/hotness.py
+"""
+``Song.hot_score``: plays and downloads from the daily rollups, each day
+weighted by ``0.5 ** (age / HOT_SCORE_HALF_LIFE_DAYS)`` so last week's
+activity outranks an old hit's lifetime totals.
+
+The decay weights are computed here for each day in the window and passed
+to the database as a CASE, so the whole catalog is rescored by a single
+portable ``UPDATE ... SET hot_score = (SELECT SUM(...))``.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from analytics import rollups
+from analytics.models import SongRollup
+
+from .models import Song
+
+logger = logging.getLogger(__name__)
+
+# A download counts like two plays, as in Song.popularity_score
+DOWNLOAD_WEIGHT = 2
+
+
+def decay_weights(days=None, half_life=None):
+    """``{daily bucket: weight}`` for the scoring window, today = 1.0."""
+    days = days or getattr(settings, 'HOT_SCORE_WINDOW_DAYS', 30)
+    half_life = half_life or getattr(settings, 'HOT_SCORE_HALF_LIFE_DAYS', 3)
+    today = rollups.since(1)
+    return {today - timedelta(days=age): 0.5 ** (age / half_life) for age in range(days)}
+
+
+def hot_score_expression(weights):
+    """Correlated subquery scoring the outer Song from its daily rollups."""
+    weight = Case(
+        *[When(bucket=bucket, then=Value(value)) for bucket, value in weights.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    scores = (
+        SongRollup.objects
+        .filter(song=OuterRef('pk'), period='day', bucket__gte=min(weights))
+        .values('song')
+        .annotate(score=Sum((F('plays') + F('downloads') * DOWNLOAD_WEIGHT) * weight, output_field=FloatField()))
+        .values('score')
+    )
+    return Coalesce(Subquery(scores, output_field=FloatField()), Value(0.0))
+
+
+def update_hot_scores(days=None, half_life=None):
+    """Rescore every song that has recent activity or a stale non-zero score. Returns rows updated."""
+    weights = decay_weights(days, half_life)
+    active = SongRollup.objects.filter(period='day', bucket__gte=min(weights)).values('song_id')
+    updated = Song.objects.filter(Q(pk__in=active) | Q(hot_score__gt=0)).update(
+        hot_score=hot_score_expression(weights)
+    )
+    logger.info("Updated hot_score for %d songs", updated)
+    return updated
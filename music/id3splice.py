@@ -0,0 +1,130 @@
+# music/id3splice.py
+"""
+Re-tag an MP3 without rewriting it.
+
+An MP3 is ``[ID3v2 tag(s)] [audio frames] [ID3v1 tag]``. To brand a file we
+only need a new ID3v2 tag in front of the original frames, so instead of
+copying the whole file and letting mutagen rewrite it, ``audio_bounds``
+finds where the frames start and end and the new tag is spliced in front of
+them:
+
+* ``write_spliced`` writes tag + frames to a file, copying the frames in the
+  kernel (``copy_file_range`` / ``sendfile``);
+* ``iter_spliced`` yields tag + frames for a streaming response, reading
+  the frames into one reused buffer.
+
+The old ID3v1 tag is dropped rather than kept stale; players read ID3v2.
+"""
+import os
+import shutil
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+# ID3v2 header flag: a 10 byte footer follows the tag
+FOOTER_FLAG = 0x10
+
+# Largest chunk handed to a single copy syscall
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _syncsafe(data):
+    """Decode a 4 byte syncsafe integer (7 bits per byte)."""
+    value = 0
+    for byte in data:
+        if byte & 0x80:
+            raise ValueError("Invalid syncsafe integer")
+        value = (value << 7) | byte
+    return value
+
+
+def audio_bounds(path):
+    """
+    Return ``(start, end)`` byte offsets of the audio frames in ``path``:
+    after any leading ID3v2 tags and before a trailing ID3v1 tag.
+    """
+    size = os.path.getsize(path)
+    start = 0
+    with open(path, 'rb') as audio:
+        # Some encoders stack several tags; skip all of them
+        while start + ID3V2_HEADER_SIZE <= size:
+            audio.seek(start)
+            header = audio.read(ID3V2_HEADER_SIZE)
+            if header[:3] != b'ID3':
+                break
+            try:
+                tag_size = _syncsafe(header[6:10])
+            except ValueError:
+                break
+            start += ID3V2_HEADER_SIZE + tag_size
+            if header[5] & FOOTER_FLAG:
+                start += ID3V2_HEADER_SIZE
+        start = min(start, size)
+
+        end = size
+        if end - start >= ID3V1_SIZE:
+            audio.seek(end - ID3V1_SIZE)
+            if audio.read(3) == b'TAG':
+                end -= ID3V1_SIZE
+    return start, end
+
+
+def spliced_size(tag, start, end):
+    return len(tag) + (end - start)
+
+
+def _copy_range(src, dst, offset, count):
+    """Copy ``count`` bytes from ``src`` at ``offset`` to ``dst``'s position, in the kernel if possible."""
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    try:
+        while count > 0:
+            chunk = min(count, COPY_CHUNK_SIZE)
+            if copy_file_range is not None:
+                sent = copy_file_range(src_fd, dst_fd, chunk, offset)
+            else:
+                sent = os.sendfile(dst_fd, src_fd, offset, chunk)
+            if sent == 0:
+                raise EOFError("Source file ended early")
+            offset += sent
+            count -= sent
+    except (AttributeError, OSError):
+        # Filesystem or platform without in-kernel copies: finish in userspace
+        src.seek(offset)
+        dst.seek(0, os.SEEK_END)
+        remaining = count
+        while remaining > 0:
+            data = src.read(min(remaining, COPY_CHUNK_SIZE))
+            if not data:
+                raise EOFError("Source file ended early")
+            dst.write(data)
+            remaining -= len(data)
+
+
+def write_spliced(tag, src_path, dst_path, bounds=None):
+    """Write ``tag`` followed by the audio frames of ``src_path`` to ``dst_path``."""
+    start, end = bounds or audio_bounds(src_path)
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        dst.write(tag)
+        dst.flush()
+        _copy_range(src, dst, start, end - start)
+    try:
+        shutil.copystat(src_path, dst_path)
+    except OSError:
+        pass
+
+
+def iter_spliced(tag, src_path, bounds=None, chunk_size=64 * 1024):
+    """Yield ``tag`` followed by the audio frames of ``src_path``."""
+    start, end = bounds or audio_bounds(src_path)
+    yield tag
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    remaining = end - start
+    with open(src_path, 'rb') as src:
+        src.seek(start)
+        while remaining > 0:
+            read = src.readinto(view[:min(chunk_size, remaining)])
+            if not read:
+                break
+            remaining -= read
+            yield bytes(view[:read])
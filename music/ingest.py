@@ -0,0 +1,401 @@
+# music/ingest.py
+"""
+Batched ingestion of SongPlay / SongDownload events.
+
+Play and download endpoints call ``record_play`` / ``record_download``,
+which append the event to a per-process queue and to a spool file, then
+return immediately. A background thread writes the queue with
+``bulk_create`` once it reaches ``EVENT_INGEST_BATCH_SIZE`` events or every
+``EVENT_INGEST_FLUSH_INTERVAL`` seconds.
+
+The spool file makes the queue survive worker restarts: before each flush
+the live spool is fsynced and rotated to a ``.flushing`` file that is only
+deleted after its events are committed, and spool files left behind by dead
+processes are claimed and replayed by the next flush. Delivery is
+at-least-once. Between flushes events are only written to the OS, not
+fsynced, so a worker crash loses nothing but a machine crash can lose the
+events of the last flush interval.
+
+Spool files are named after a random id per process, not the PID, which a
+restarted worker may reuse. Each process keeps a lease file for its id
+fresh while it runs; files whose lease is older than ``EVENT_SPOOL_LEASE``
+seconds belong to a dead process and are claimed.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .flushing import PeriodicFlusher
+
+logger = logging.getLogger(__name__)
+
+# Sent after a batch of events has been committed, with the saved
+# ``plays`` and ``downloads`` lists of SongPlay / SongDownload instances.
+events_flushed = Signal()
+
+PLAY_FIELDS = (
+    'song_id', 'user_id', 'played_at', 'ip_address', 'duration_played',
+    'user_agent', 'session_id', 'audio_quality', 'play_token',
+)
+DOWNLOAD_FIELDS = (
+    'song_id', 'user_id', 'downloaded_at', 'ip_address', 'is_offline_download',
+    'audio_quality', 'file_size',
+)
+TIMESTAMP_FIELDS = ('played_at', 'downloaded_at')
+
+
+class EventQueue:
+    """Per-process queue of pending play/download events."""
+
+    def __init__(self, spool_dir, batch_size, flush_interval, lease=120):
+        self.spool_dir = str(spool_dir)
+        self.batch_size = batch_size
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._queued = 0
+        self._pending_plays = {}  # play_token -> queued play event
+        self._flushing_plays = {}  # play_token -> play event being written
+        self._spool = None
+        self._spool_pid = None
+        self._owner = None
+        self._owner_pid = None
+        self._lease_renewed = 0
+        self._sequence = 0
+        self._flusher = PeriodicFlusher(self.flush, flush_interval, 'song-event-flusher')
+
+    # Spool files ---------------------------------------------------------
+
+    @property
+    def owner(self):
+        """Random id naming this process's spool files; a forked child gets its own"""
+        if self._owner_pid != os.getpid():
+            self._owner = uuid.uuid4().hex
+            self._owner_pid = os.getpid()
+            self._lease_renewed = 0
+        return self._owner
+
+    def _lease_path(self, owner):
+        return os.path.join(self.spool_dir, f'lease-{owner}')
+
+    def _renew_lease(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._lease_renewed < self.lease / 4:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(self._lease_path(self.owner), 'a'):
+            pass
+        os.utime(self._lease_path(self.owner))
+        self._lease_renewed = now
+
+    def _lease_expired(self, owner):
+        try:
+            return time.time() - os.path.getmtime(self._lease_path(owner)) > self.lease
+        except OSError:
+            return True
+
+    def _spool_path(self, suffix):
+        return os.path.join(self.spool_dir, f'events-{self.owner}-{self._sequence}.{suffix}')
+
+    def _open_spool(self):
+        # Re-open after fork so child processes never share a parent's file
+        if self._spool is None or self._spool_pid != os.getpid():
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._spool_pid = os.getpid()
+            self._renew_lease(force=True)
+            self._spool = open(self._spool_path('spool'), 'a', encoding='utf-8')
+        return self._spool
+
+    def _rotate_spool(self):
+        """Close the live spool and return its path renamed to ``.flushing``."""
+        if self._spool is None or self._spool_pid != os.getpid():
+            return None
+        self._spool.flush()
+        os.fsync(self._spool.fileno())
+        self._spool.close()
+        self._spool = None
+        live_path = self._spool_path('spool')
+        flushing_path = self._spool_path('flushing')
+        self._sequence += 1
+        if not os.path.exists(live_path):
+            return None
+        os.rename(live_path, flushing_path)
+        return flushing_path
+
+    def _claim_orphans(self):
+        """Take over spool files whose writer is gone, including our own failed flushes."""
+        claimed = []
+        expired = set()
+        for path in glob.glob(os.path.join(self.spool_dir, '*-*-*.*')):
+            name = os.path.basename(path)
+            prefix, _, rest = name.partition('-')
+            owner = rest.split('-')[0]
+            if prefix not in ('events', 'orphan') or not owner:
+                continue
+            if owner == self.owner:
+                if name.endswith('.flushing'):
+                    claimed.append(path)
+                continue
+            if not self._lease_expired(owner):
+                continue
+            expired.add(owner)
+            target = os.path.join(self.spool_dir, f'orphan-{self.owner}-{uuid.uuid4().hex}.flushing')
+            try:
+                os.rename(path, target)
+            except OSError:
+                continue  # Another process claimed it first
+            claimed.append(target)
+        for owner in expired:
+            try:
+                os.remove(self._lease_path(owner))
+            except OSError:
+                pass
+        return list(dict.fromkeys(claimed))
+
+    @staticmethod
+    def _replay_order(path):
+        """Oldest file first: by last write, then by the sequence in its name"""
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            modified = 0
+        sequence = os.path.basename(path).split('.')[0].rsplit('-', 1)[-1]
+        return modified, int(sequence) if sequence.isdigit() else 0
+
+    @staticmethod
+    def _read_spool(path):
+        events = []
+        with open(path, encoding='utf-8') as spool:
+            for line in spool:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    logger.warning("Skipping unreadable spool line in %s", path)
+        return events
+
+    # Queue ---------------------------------------------------------------
+
+    def put(self, event):
+        with self._lock:
+            spool = self._open_spool()
+            spool.write(json.dumps(event, default=str) + '\n')
+            spool.flush()
+            self._queued += 1
+            if event['kind'] == 'play' and event.get('play_token'):
+                self._pending_plays[event['play_token']] = event
+            size = self._queued
+            self._renew_lease()
+        self._flusher.start()
+        if size >= self.batch_size:
+            self._flusher.wake()
+
+    def update_pending_play(self, play_token, user_id=None, **fields):
+        """
+        Update a play that has not been written yet. Returns True if found.
+        A play caught in a running flush is waited for, so that on False the
+        caller finds it in the database.
+        """
+        for attempt in range(2):
+            with self._lock:
+                event = self._pending_plays.get(play_token)
+                if event is not None:
+                    if user_id is not None and event.get('user_id') != user_id:
+                        return False
+                    if fields.get('duration_played') and event.get('song_duration'):
+                        fields['duration_played'] = min(fields['duration_played'], event['song_duration'])
+                    event.update(fields)
+                    spool = self._open_spool()
+                    spool.write(json.dumps(dict(event, kind='play_update'), default=str) + '\n')
+                    spool.flush()
+                    return True
+                in_flight = play_token in self._flushing_plays
+            if not in_flight or attempt:
+                return False
+            # Wait for the flush: it either commits the play or hands it back
+            with self._flush_lock:
+                pass
+        return False
+
+    def flush(self):
+        """Write queued and orphaned events. Returns the number written."""
+        from .models import SongPlay, SongDownload
+
+        with self._flush_lock:
+            self._renew_lease(force=True)
+            spool_files = self._claim_orphans()
+            with self._lock:
+                flushing = self._rotate_spool()
+                self._queued = 0
+                self._flushing_plays = self._pending_plays
+                self._pending_plays = {}
+            if flushing:
+                spool_files.append(flushing)
+            if not spool_files:
+                self._flushing_plays = {}
+                return 0
+
+            events = []
+            for path in sorted(spool_files, key=self._replay_order):
+                events.extend(self._read_spool(path))
+
+            # Plays first, then later play_update records replace the play
+            # with the same token, whichever file each came from
+            plays, updates, downloads = {}, [], []
+            for event in events:
+                kind = event.pop('kind', None)
+                if kind == 'play':
+                    plays[event.get('play_token') or uuid.uuid4().hex] = event
+                elif kind == 'play_update':
+                    updates.append(event)
+                elif kind == 'download':
+                    downloads.append(event)
+            for event in updates:
+                if event.get('play_token') in plays:
+                    plays[event['play_token']] = event
+
+            # A replayed spool may hold plays that were committed before a crash
+            tokens = [event['play_token'] for event in plays.values() if event.get('play_token')]
+            written = set(
+                SongPlay.objects.filter(play_token__in=tokens).values_list('user_id', 'play_token')
+            ) if tokens else set()
+            play_objects = [
+                SongPlay(**self._clean(event, PLAY_FIELDS)) for event in plays.values()
+                if (event.get('user_id'), event.get('play_token')) not in written
+            ]
+            download_objects = [SongDownload(**self._clean(event, DOWNLOAD_FIELDS)) for event in downloads]
+
+            try:
+                with transaction.atomic():
+                    SongPlay.objects.bulk_create(play_objects, batch_size=500)
+                    SongDownload.objects.bulk_create(download_objects, batch_size=500)
+            except Exception:
+                # Spool files stay on disk and are retried on the next flush;
+                # their plays can still be updated until then
+                logger.exception("Event flush failed; %d spool files kept", len(spool_files))
+                with self._lock:
+                    self._pending_plays = {**self._flushing_plays, **self._pending_plays}
+                    self._flushing_plays = {}
+                return 0
+            self._flushing_plays = {}
+
+            for path in spool_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    logger.warning("Could not remove flushed spool file %s", path)
+
+        events_flushed.send(sender=SongPlay, plays=play_objects, downloads=download_objects)
+        return len(play_objects) + len(download_objects)
+
+    @staticmethod
+    def _clean(event, fields):
+        values = {field: event.get(field) for field in fields if event.get(field) is not None}
+        for field in TIMESTAMP_FIELDS:
+            if isinstance(values.get(field), str):
+                values[field] = parse_datetime(values[field])
+        return values
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = EventQueue(
+                    spool_dir=getattr(settings, 'EVENT_SPOOL_DIR', os.path.join(settings.BASE_DIR, 'var', 'event_spool')),
+                    batch_size=getattr(settings, 'EVENT_INGEST_BATCH_SIZE', 200),
+                    flush_interval=getattr(settings, 'EVENT_INGEST_FLUSH_INTERVAL', 2),
+                    lease=getattr(settings, 'EVENT_SPOOL_LEASE', 120),
+                )
+                atexit.register(_queue.flush)
+    return _queue
+
+
+def _user_id(user):
+    if user is not None and getattr(user, 'is_authenticated', False):
+        return user.pk
+    return None
+
+
+def record_play(song, user=None, ip_address=None, user_agent='', session_id=None,
+                audio_quality='standard', duration_played=0, played_at=None, play_token=None):
+    """
+    Queue a SongPlay and return its play token for later duration updates
+    (``play_token`` when the client chose one).
+    """
+    play_token = play_token or uuid.uuid4().hex
+    get_queue().put({
+        'kind': 'play',
+        'song_id': getattr(song, 'pk', song),
+        'user_id': _user_id(user),
+        'played_at': (played_at or timezone.now()).isoformat(),
+        'ip_address': ip_address,
+        'duration_played': duration_played or 0,
+        'user_agent': user_agent or '',
+        'session_id': session_id,
+        'audio_quality': audio_quality,
+        'play_token': play_token,
+        # Not stored; caps later duration updates
+        'song_duration': getattr(song, 'duration', None),
+    })
+    return play_token
+
+
+def record_download(song, user=None, ip_address=None, file_size=None,
+                    audio_quality='standard', is_offline_download=False, downloaded_at=None):
+    """Queue a SongDownload."""
+    get_queue().put({
+        'kind': 'download',
+        'song_id': getattr(song, 'pk', song),
+        'user_id': _user_id(user),
+        'downloaded_at': (downloaded_at or timezone.now()).isoformat(),
+        'ip_address': ip_address,
+        'file_size': file_size,
+        'audio_quality': audio_quality,
+        'is_offline_download': is_offline_download,
+    })
+
+
+def update_play_duration(play_id, duration_played, user=None):
+    """
+    Set ``duration_played`` for a play identified by its token (queued or
+    written) or by a legacy numeric SongPlay id. Returns True if a play matched.
+    """
+    from .models import SongPlay
+
+    play_id = str(play_id)
+    user_id = _user_id(user)
+    if get_queue().update_pending_play(play_id, user_id=user_id, duration_played=duration_played):
+        return True
+
+    plays = SongPlay.objects.all()
+    if user_id is not None:
+        plays = plays.filter(user_id=user_id)
+    if play_id.isdigit():
+        plays = plays.filter(id=int(play_id))
+    else:
+        plays = plays.filter(play_token=play_id)
+    return plays.update(duration_played=duration_played) > 0
+
+
+def flush():
+    return get_queue().flush()
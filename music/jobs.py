@@ -0,0 +1,134 @@
+# music/jobs.py
+"""
+Background preparation of branded downloads.
+
+``submit_branding`` hands the Pillow/mutagen work to a small local process
+pool so the web worker can answer straight away with a job id. The job id is
+the artifact key from ``music.artifacts``: asking again for the same song
+version joins the job already running instead of starting another one, and
+a job is finished as soon as its artifact exists on disk.
+
+Job state is kept in the cache so any web worker can answer status polls.
+Polls return at once; clients poll again after ``BRANDING_JOB_POLL_INTERVAL``
+seconds instead of holding a web worker while the build runs.
+"""
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .artifacts import ArtifactStore, artifact_key, get_store
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _job_cache_key(job_id):
+    return f'brandjob:{job_id}'
+
+
+def _job_ttl():
+    return getattr(settings, 'BRANDING_JOB_TTL', 60 * 60)
+
+
+def build_artifact(spec, root, max_bytes):
+    """Runs in a pool process: build (or find) the artifact and return its path."""
+    return ArtifactStore(root, max_bytes).get_or_build(spec)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: the web process runs flusher threads that must not be forked mid-lock
+                _executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=getattr(settings, 'BRANDING_WORKERS', 2),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                atexit.register(_executor.shutdown, wait=True)
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _set_state(job_id, **state):
+    cache.set(_job_cache_key(job_id), state, timeout=_job_ttl())
+
+
+def job_status(job_id, spec=None):
+    """
+    State dict for ``job_id``: ``{'status': ..., 'error': ...}``. With
+    ``spec`` the artifact itself is checked, which covers jobs finished by
+    another worker or a pre-branding run, and a job whose artifact has been
+    evicted since is submitted again.
+    """
+    if spec is not None and os.path.exists(get_store().path_for(spec)):
+        return {'status': READY}
+    state = cache.get(_job_cache_key(job_id))
+    if state is None:
+        return None
+    if state['status'] == READY and spec is not None:
+        # Built, then evicted from the artifact store
+        cache.delete(_job_cache_key(job_id))
+        submit_branding(spec)
+        return cache.get(_job_cache_key(job_id)) or {'status': PENDING}
+    if state['status'] == PENDING:
+        # The process that owned the job died; let the client submit again
+        timeout = getattr(settings, 'BRANDING_JOB_TIMEOUT', 5 * 60)
+        if time.time() - state.get('submitted_at', 0) > timeout:
+            return {'status': FAILED, 'error': 'Download preparation timed out'}
+    return state
+
+
+def poll_interval():
+    """Seconds a client should wait before polling a pending job again"""
+    return getattr(settings, 'BRANDING_JOB_POLL_INTERVAL', 1)
+
+
+def submit_branding(spec):
+    """Queue a branded build of ``spec`` unless one is ready or running. Returns the job id."""
+    job_id = artifact_key(spec)
+    state = job_status(job_id, spec)
+    if state is not None and state['status'] in (PENDING, READY):
+        return job_id
+
+    _set_state(job_id, status=PENDING, song_id=spec.song_id, submitted_at=time.time())
+    store = get_store()
+    try:
+        future = get_executor().submit(build_artifact, spec, store.root, store.max_bytes)
+    except concurrent.futures.process.BrokenProcessPool:
+        _reset_executor()
+        future = get_executor().submit(build_artifact, spec, store.root, store.max_bytes)
+
+    def finished(future):
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception("Branding job %s for song %s failed", job_id, spec.song_id)
+            if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                _reset_executor()
+            _set_state(job_id, status=FAILED, song_id=spec.song_id, error=str(e))
+            return
+        _set_state(job_id, status=READY, song_id=spec.song_id)
+
+    future.add_done_callback(finished)
+    return job_id
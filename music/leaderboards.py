@@ -0,0 +1,242 @@
+# music/leaderboards.py
+"""
+Top-N most played / most downloaded songs without ``ORDER BY -plays`` on
+every page.
+
+Each board (a metric plus a scope: everything, one genre or one artist)
+holds the best ``LEADERBOARD_SIZE`` songs with their current totals. A
+board is loaded from the database on first use, then kept current by
+``record`` after every counter flush, which writes the flushed songs'
+absolute totals; totals only grow, so a song that climbs back onto a
+trimmed board re-enters on its next flush.
+
+Two backends, picked by ``LEADERBOARD_BACKEND``:
+
+- ``'redis'``: sorted sets in the Redis behind the default cache, shared by
+  every worker. Needs ``django.core.cache.backends.redis.RedisCache``.
+- ``'memory'``: per-process dicts reloaded from the database every
+  ``LEADERBOARD_LOCAL_TTL`` seconds, since other workers' flushes are not
+  seen here. Also the fallback when Redis is not configured.
+
+Reads filter out songs that were unapproved or moved since they were
+ranked, so a stale entry can shorten a list but never show a wrong song.
+"""
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Song
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('plays', 'downloads')
+
+# Extra ids read per request to make up for entries filtered out at read time
+READ_SLACK = 5
+
+
+def board_name(metric, genre_id=None, artist_id=None):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown leaderboard metric: {metric}")
+    if artist_id is not None:
+        return f'{metric}:artist:{artist_id}'
+    if genre_id is not None:
+        return f'{metric}:genre:{genre_id}'
+    return f'{metric}:global'
+
+
+def _boards_for(genre_id, artist_id):
+    """Every board a song with this genre and artist belongs on, per metric"""
+    return {
+        metric: [board_name(metric)]
+        + ([board_name(metric, genre_id=genre_id)] if genre_id else [])
+        + [board_name(metric, artist_id=artist_id)]
+        for metric in METRICS
+    }
+
+
+def _load_board(name):
+    """``{song_id: score}`` for ``name`` straight from the songs table"""
+    metric, scope = name.split(':', 1)
+    songs = Song.objects.filter(is_approved=True)
+    if scope != 'global':
+        field, pk = scope.split(':')
+        songs = songs.filter(**{f'{field}_id': int(pk)})
+    return dict(songs.order_by(f'-{metric}').values_list('pk', metric)[:_size()])
+
+
+def _size():
+    return getattr(settings, 'LEADERBOARD_SIZE', 100)
+
+
+class MemoryLeaderboardBackend:
+    """Boards kept in this process and reloaded after ``ttl`` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._boards = {}
+        self._loaded_at = {}
+
+    def _board(self, name):
+        # Called with the lock held
+        loaded_at = self._loaded_at.get(name)
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self._boards[name] = _load_board(name)
+            self._loaded_at[name] = time.monotonic()
+        return self._boards[name]
+
+    def update(self, scores):
+        with self._lock:
+            for name, entries in scores.items():
+                # Boards nobody has read yet are loaded (with these totals) on first read
+                board = self._boards.get(name)
+                if board is None:
+                    continue
+                board.update(entries)
+                if len(board) > 2 * self.size:
+                    keep = heapq.nlargest(self.size, board.items(), key=lambda item: item[1])
+                    self._boards[name] = dict(keep)
+
+    def remove(self, song_id, names):
+        with self._lock:
+            for name in names:
+                if self._boards.get(name, {}).pop(song_id, None) is not None:
+                    # Someone below the cut may belong on the board now
+                    self._loaded_at.pop(name, None)
+
+    def top(self, name, n):
+        with self._lock:
+            board = self._board(name)
+            return [pk for pk, _ in heapq.nlargest(n, board.items(), key=lambda item: item[1])]
+
+
+class RedisLeaderboardBackend:
+    """Boards kept as Redis sorted sets, trimmed to ``size`` members."""
+
+    key_prefix = 'leaderboard'
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.client = cache._cache.get_client(write=True)
+
+    def _key(self, name):
+        return cache.make_key(f'{self.key_prefix}:{name}')
+
+    def _loaded_key(self, name):
+        return cache.make_key(f'{self.key_prefix}:loaded:{name}')
+
+    def update(self, scores):
+        pipe = self.client.pipeline(transaction=False)
+        for name, entries in scores.items():
+            key = self._key(name)
+            pipe.zadd(key, entries)
+            pipe.zremrangebyrank(key, 0, -self.size - 1)
+        pipe.execute()
+
+    def remove(self, song_id, names):
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.zrem(self._key(name), song_id)
+            pipe.delete(self._loaded_key(name))
+        pipe.execute()
+
+    def top(self, name, n):
+        key = self._key(name)
+        # The flag expires so boards are rebuilt now and then, repairing any drift
+        if self.client.set(self._loaded_key(name), 1, nx=True, ex=self.ttl):
+            board = _load_board(name)
+            pipe = self.client.pipeline()
+            pipe.delete(key)
+            if board:
+                pipe.zadd(key, board)
+            pipe.execute()
+        return [int(pk) for pk in self.client.zrevrange(key, 0, n - 1)]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'LEADERBOARD_BACKEND', 'memory')
+                size = _size()
+                if name == 'redis':
+                    if hasattr(cache, '_cache') and hasattr(cache._cache, 'get_client'):
+                        _backend = RedisLeaderboardBackend(size, getattr(settings, 'LEADERBOARD_REDIS_TTL', 60 * 60))
+                    else:
+                        logger.warning("LEADERBOARD_BACKEND is 'redis' but the default cache is not Redis; "
+                                       "using per-process leaderboards")
+                elif name != 'memory':
+                    raise ValueError(f"Unknown LEADERBOARD_BACKEND: {name}")
+                if _backend is None:
+                    _backend = MemoryLeaderboardBackend(size, getattr(settings, 'LEADERBOARD_LOCAL_TTL', 60))
+    return _backend
+
+
+def record(song_ids):
+    """Write the current totals of ``song_ids`` to every board they belong on"""
+    scores = {}
+    songs = Song.objects.filter(pk__in=list(song_ids)).values_list(
+        'pk', 'is_approved', 'genre_id', 'artist_id', *METRICS
+    )
+    for pk, is_approved, genre_id, artist_id, *totals in songs:
+        boards = _boards_for(genre_id, artist_id)
+        if not is_approved:
+            get_backend().remove(pk, [name for names in boards.values() for name in names])
+            continue
+        for metric, total in zip(METRICS, totals):
+            for name in boards[metric]:
+                scores.setdefault(name, {})[pk] = total
+    if scores:
+        get_backend().update(scores)
+
+
+def forget(song):
+    """Take ``song`` off the boards of its current genre and artist"""
+    boards = _boards_for(song.genre_id, song.artist_id)
+    get_backend().remove(song.pk, [name for names in boards.values() for name in names])
+
+
+def top_songs(metric='plays', n=10, genre=None, artist=None, exclude=()):
+    """
+    The ``n`` approved songs with the most ``metric``, optionally within one
+    genre or artist, best first, with artist and genre selected.
+    """
+    genre_id = getattr(genre, 'pk', genre)
+    artist_id = getattr(artist, 'pk', artist)
+    exclude = set(exclude)
+    name = board_name(metric, genre_id=genre_id, artist_id=artist_id)
+    songs = Song.objects.filter(is_approved=True).select_related('artist', 'genre')
+    try:
+        song_ids = get_backend().top(name, n + len(exclude) + READ_SLACK)
+    except Exception:
+        logger.exception("Leaderboard %s unavailable; querying the database", name)
+        if genre_id is not None:
+            songs = songs.filter(genre_id=genre_id)
+        if artist_id is not None:
+            songs = songs.filter(artist_id=artist_id)
+        return list(songs.exclude(pk__in=exclude).order_by(f'-{metric}')[:n])
+
+    by_id = songs.in_bulk(song_ids)
+    ranked = []
+    for pk in song_ids:
+        song = by_id.get(pk)
+        if song is None or pk in exclude:
+            continue
+        if (genre_id is not None and song.genre_id != genre_id) or (artist_id is not None and song.artist_id != artist_id):
+            continue
+        ranked.append(song)
+    # Totals in the board may trail the row a little; show them in the row's order
+    ranked.sort(key=lambda song: getattr(song, metric), reverse=True)
+    return ranked[:n]
@@ -0,0 +1,43 @@
+# music/management/commands/build_charts.py
+"""
+Rebuild Chart / ChartEntry from the play/download rollups.
+
+    python manage.py build_charts                 # every active chart
+    python manage.py build_charts --chart 3 --size 100
+
+Run it from cron (hourly is plenty); each run updates this week's
+snapshot, and the first run of a new week starts the next one.
+"""
+from django.core.management.base import BaseCommand
+
+from music.charts import build_charts
+from music.models import Chart
+
+
+class Command(BaseCommand):
+    help = 'Rank songs into the active charts and record this week in the chart history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chart', type=int, action='append', dest='chart_ids',
+                            help='Only this chart id (repeatable)')
+        parser.add_argument('--size', type=int, help='Entries per chart (default: CHART_SIZE)')
+
+    def handle(self, *args, **options):
+        charts = Chart.objects.filter(is_active=True)
+        if options['chart_ids']:
+            charts = Chart.objects.filter(pk__in=options['chart_ids'])
+
+        failed = 0
+        for chart, written in build_charts(charts, size=options['size']).items():
+            if written is None:
+                self.stdout.write(f"{chart.title}: nothing to rank a '{chart.chart_type}' chart by, skipped")
+            elif written is False:
+                failed += 1
+                self.stderr.write(f"{chart.title}: failed, see the log")
+            else:
+                self.stdout.write(f"{chart.title}: {chart.entries.count()} entries, {written} changed")
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} chart(s) failed"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Charts rebuilt"))
@@ -0,0 +1,117 @@
+# music/management/commands/prebrand_songs.py
+"""
+Warm the branded download cache for approved songs.
+
+    python manage.py prebrand_songs --workers 4
+    python manage.py prebrand_songs --song 12 --song 40 --force
+
+Artifacts are content-addressed, so the command is resumable: songs whose
+current branded file already exists are skipped, and an interrupted run
+picks up where it stopped.
+"""
+import concurrent.futures
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from music.artifacts import get_store
+from music.branding import BrandingSpec
+from music.jobs import build_artifact
+from music.models import Song
+
+
+class Command(BaseCommand):
+    help = 'Build branded download files for approved songs in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Number of worker processes (default: CPU count)')
+        parser.add_argument('--song', type=int, action='append', dest='song_ids',
+                            help='Only this song id (repeatable)')
+        parser.add_argument('--limit', type=int, help='Stop after this many songs')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild artifacts that already exist')
+
+    def handle(self, *args, **options):
+        store = get_store()
+        songs = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('pk')
+        if options['song_ids']:
+            songs = songs.filter(pk__in=options['song_ids'])
+        if options['limit']:
+            songs = songs[:options['limit']]
+
+        specs, skipped, missing = [], 0, 0
+        for song in songs.iterator(chunk_size=500):
+            if not song.audio_file:
+                missing += 1
+                continue
+            try:
+                spec = BrandingSpec.for_song(song)
+            except (NotImplementedError, ValueError):
+                missing += 1
+                continue
+            if not os.path.exists(spec.audio_path):
+                missing += 1
+                continue
+            path = store.path_for(spec)
+            if os.path.exists(path):
+                if not options['force']:
+                    skipped += 1
+                    continue
+                os.remove(path)
+            specs.append(spec)
+
+        self.stdout.write(
+            f"{len(specs)} songs to brand, {skipped} already cached, {missing} without a local audio file"
+        )
+        if not specs:
+            return
+
+        # Workers never touch the database; don't let them inherit its connection
+        connections.close_all()
+
+        built = failed = 0
+        started = time.monotonic()
+        last_report = started
+        workers = max(1, options['workers'])
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of jobs in flight rather than queueing every song up front
+            pending = {}
+            queue = iter(specs)
+            while True:
+                while len(pending) < workers * 4:
+                    spec = next(queue, None)
+                    if spec is None:
+                        break
+                    pending[executor.submit(build_artifact, spec, store.root, store.max_bytes)] = spec
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    spec = pending.pop(future)
+                    try:
+                        future.result()
+                        built += 1
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f"Song {spec.song_id} ({spec.title}): {e}")
+
+                now = time.monotonic()
+                if now - last_report >= 5:
+                    last_report = now
+                    rate = (built + failed) / (now - started)
+                    self.stdout.write(f"{built + failed}/{len(specs)} songs, {rate:.1f} songs/s")
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f"Branded {built} songs in {elapsed:.1f}s ({built / elapsed:.1f} songs/s), {failed} failed"
+        ))
+        total = store.size()
+        if store.max_bytes and total >= store.max_bytes:
+            self.stdout.write(self.style.WARNING(
+                f"Artifact cache is at its {store.max_bytes} byte limit; older files were evicted. "
+                "Raise BRANDED_CACHE_MAX_BYTES to keep the whole catalogue warm."
+            ))
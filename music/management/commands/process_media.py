@@ -0,0 +1,92 @@
+# music/management/commands/process_media.py
+"""
+Run the media processing pipeline (music/processing) outside the web process.
+
+    python manage.py process_media                  # every stale stage, every song
+    python manage.py process_media --stage renditions --song 12 --force
+    python manage.py process_media --stage analysis --processes --workers 8   # CPU-bound backfill
+"""
+import concurrent.futures
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from music.models import Song
+from music.processing import get_stages, process_song
+
+
+def _process(song_id, names, force):
+    try:
+        return process_song(song_id, names, force)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Run media processing stages (transcoding, analysis, ...) for songs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', dest='stages',
+                            help='Only run this stage (repeatable)')
+        parser.add_argument('--song', type=int, action='append', dest='song_ids',
+                            help='Only this song id (repeatable)')
+        parser.add_argument('--approved', action='store_true', help='Only approved songs')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-run stages even when their output is up to date')
+        parser.add_argument('--workers', type=int, default=2, help='Songs processed in parallel')
+        parser.add_argument('--processes', action='store_true',
+                            help='Use worker processes instead of threads (for CPU-bound stages like fingerprint/analysis)')
+        parser.add_argument('--list', action='store_true', help='List the registered stages and exit')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for current in get_stages():
+                self.stdout.write(f"{current.order:>4}  {current.name}")
+            return
+
+        try:
+            get_stages(options['stages'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        songs = Song.objects.order_by('pk')
+        if options['song_ids']:
+            songs = songs.filter(pk__in=options['song_ids'])
+        if options['approved']:
+            songs = songs.filter(is_approved=True)
+        song_ids = list(songs.values_list('pk', flat=True))
+
+        started = time.monotonic()
+        ran = failed = 0
+        if options['processes']:
+            # Children must not share the parent's database connection
+            connections.close_all()
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max(1, options['workers']))
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, options['workers']))
+        with executor:
+            futures = {
+                executor.submit(_process, song_id, options['stages'], options['force']): song_id
+                for song_id in song_ids
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Song {futures[future]}: {e}")
+                    continue
+                if not results:
+                    continue
+                ran += 1
+                failures = [name for name, ok in results.items() if not ok]
+                if failures:
+                    failed += 1
+                    self.stderr.write(f"Song {futures[future]}: failed {', '.join(failures)}")
+                elif options['verbosity'] > 1:
+                    self.stdout.write(f"Song {futures[future]}: {', '.join(results)}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {ran} of {len(song_ids)} songs in {time.monotonic() - started:.1f}s, {failed} with failures"
+        ))
@@ -0,0 +1,33 @@
+# music/management/commands/rebuild_search_index.py
+"""
+Rewrite the full-text search index (music/fulltext.py) from the database.
+
+    python manage.py rebuild_search_index
+
+Migration 0020 fills the index once; run this whenever it may have missed
+writes (e.g. songs edited with queryset.update()). Until a rebuild has
+finished, searches use icontains.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music import fulltext
+
+
+class Command(BaseCommand):
+    help = 'Reindex every approved song, artist and genre for full-text search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help='Objects written per statement (default: 500)')
+
+    def handle(self, *args, **options):
+        if not fulltext.index_backend():
+            raise CommandError('No full-text index on this database; search uses icontains')
+        started = time.monotonic()
+        written = fulltext.rebuild(options['batch_size'])
+        summary = ', '.join(f"{count} {kind}s" for kind, count in written.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {summary} in {time.monotonic() - started:.2f}s"
+        ))
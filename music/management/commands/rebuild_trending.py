@@ -0,0 +1,25 @@
+# music/management/commands/rebuild_trending.py
+"""
+Reload the day and week trending windows from the hourly rollups.
+
+    python manage.py rebuild_trending
+
+Run it after a cache flush or a deploy that changed TRENDING_SKETCH_*;
+the last hour fills back up from live plays within minutes.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from music import trending
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the 24h and 7d trending sketches from the hourly play/download rollups'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = trending.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {rows} rollup rows in {time.monotonic() - started:.2f}s"
+        ))
@@ -0,0 +1,30 @@
+# music/management/commands/refresh_genre_stats.py
+"""
+Recompute GenreStats (totals and top artists) from the approved songs.
+
+    python manage.py refresh_genre_stats
+    python manage.py refresh_genre_stats --genre 4
+
+Run it from cron (e.g. every 15 minutes) to pick up anything the
+incremental updates missed, such as a song moved between genres.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from music import genre_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the song, play and download totals and top artists of every genre'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--genre', type=int, action='append', dest='genre_ids',
+                            help='Only this genre id (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        updated = genre_stats.refresh(options['genre_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed {updated} genres in {time.monotonic() - started:.2f}s"
+        ))
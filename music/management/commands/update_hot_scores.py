@@ -0,0 +1,34 @@
+# music/management/commands/update_hot_scores.py
+"""
+Recompute Song.hot_score from the daily play/download rollups.
+
+    python manage.py update_hot_scores
+    python manage.py update_hot_scores --half-life 7 --days 60
+
+Run it from cron (e.g. every 15 minutes); it is a single UPDATE statement.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music.hotness import update_hot_scores
+
+
+class Command(BaseCommand):
+    help = 'Recompute the time-decayed hot score of every recently active song'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Days of activity scored (default: HOT_SCORE_WINDOW_DAYS)')
+        parser.add_argument('--half-life', type=float, dest='half_life',
+                            help='Days for a play to lose half its weight (default: HOT_SCORE_HALF_LIFE_DAYS)')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        if options['half_life'] is not None and options['half_life'] <= 0:
+            raise CommandError('--half-life must be positive')
+        started = time.monotonic()
+        updated = update_hot_scores(options['days'], options['half_life'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} songs in {time.monotonic() - started:.2f}s"
+        ))
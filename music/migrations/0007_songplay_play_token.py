@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_commentlike_newscomment_likes_newslike_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songplay',
+            name='play_token',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Client handle for a play that may still be queued', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='songdownload',
+            name='downloaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='songplay',
+            name='played_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_songplay_play_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quality', models.CharField(choices=[('standard', 'Standard'), ('high', 'High (320kbps)'), ('ultra', 'Ultra HD (FLAC)')], max_length=20)),
+                ('file', models.FileField(upload_to='renditions/')),
+                ('codec', models.CharField(max_length=20)),
+                ('bitrate', models.PositiveIntegerField(blank=True, help_text='kbps; empty for lossless', null=True)),
+                ('file_size', models.PositiveBigIntegerField(default=0, help_text='File size in bytes')),
+                ('source_name', models.CharField(help_text='audio_file name this was transcoded from', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='music.song')),
+            ],
+            options={
+                'unique_together': {('song', 'quality')},
+            },
+        ),
+    ]
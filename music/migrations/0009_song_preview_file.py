@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_songrendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='preview_file',
+            field=models.FileField(blank=True, help_text='First preview_duration seconds, generated after upload', null=True, upload_to='previews/'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='preview_source',
+            field=models.CharField(blank=True, default='', editable=False, help_text='audio_file name and duration the preview was cut from', max_length=255),
+        ),
+    ]
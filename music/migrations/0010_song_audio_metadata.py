@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0009_song_preview_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, help_text='kbps', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='embedded_tags',
+            field=models.JSONField(blank=True, default=dict, help_text='Tags found in the uploaded file'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='metadata_source',
+            field=models.CharField(blank=True, default='', editable=False, help_text='audio_file name the metadata was read from', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='sample_rate',
+            field=models.PositiveIntegerField(blank=True, help_text='Hz', null=True),
+        ),
+    ]
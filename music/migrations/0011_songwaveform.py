@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_song_audio_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peaks', models.BinaryField()),
+                ('buckets', models.PositiveIntegerField()),
+                ('source_name', models.CharField(help_text='audio_file name the peaks were computed from', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='waveform', to='music.song')),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_songwaveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='fingerprint_source',
+            field=models.CharField(blank=True, default='', editable=False, help_text='audio_file name the fingerprint was computed from', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='AudioFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.IntegerField(db_index=True)),
+                ('offset', models.PositiveIntegerField(help_text='Anchor position in spectrogram frames')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprints', to='music.song')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matches', models.PositiveIntegerField(help_text='Landmark hashes that line up with the original')),
+                ('score', models.FloatField(help_text="Share of the song's hashes that line up (0-1)")),
+                ('status', models.CharField(choices=[('pending', 'Pending review'), ('confirmed', 'Confirmed duplicate'), ('dismissed', 'Not a duplicate')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('original', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicated_by', to='music.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_candidates', to='music.song')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'unique_together': {('song', 'original')},
+            },
+        ),
+    ]
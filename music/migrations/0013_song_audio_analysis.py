@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artists', '0002_initial'),
+        ('music', '0012_audio_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='analysis_source',
+            field=models.CharField(blank=True, default='', editable=False, help_text='audio_file name the tempo/loudness analysis ran on', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='loudness',
+            field=models.FloatField(blank=True, help_text='Integrated loudness in LUFS', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='replay_gain',
+            field=models.FloatField(blank=True, help_text='dB to apply for -18 LUFS playback (ReplayGain 2.0 reference)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['is_approved', 'bpm'], name='music_song_is_appr_baa31e_idx'),
+        ),
+    ]
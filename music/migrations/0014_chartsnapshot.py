@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0013_song_audio_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField(help_text='Monday the chart week starts on')),
+                ('entries', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='music.chart')),
+            ],
+            options={
+                'ordering': ['-week'],
+                'unique_together': {('chart', 'week')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artists', '0002_initial'),
+        ('music', '0014_chartsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='hot_score',
+            field=models.FloatField(default=0, editable=False, help_text='Recent plays/downloads with time decay (music/hotness.py)'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['is_approved', '-hot_score'], name='music_song_is_appr_61b82b_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Full-text search index for music/fulltext.py: FTS5 on SQLite, tsvector + GIN
+# on PostgreSQL. Nothing is created on other databases (search uses icontains).
+# Migration 0020 fills it; until then searches use icontains.
+
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS music_search_index "
+    "USING fts5(name, context, body, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+POSTGRES_CREATE = [
+    "CREATE TABLE IF NOT EXISTS music_search_index ("
+    "kind smallint NOT NULL, object_id bigint NOT NULL, document tsvector NOT NULL, "
+    "PRIMARY KEY (kind, object_id))",
+    "CREATE INDEX IF NOT EXISTS music_search_index_document ON music_search_index USING GIN (document)",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(SQLITE_CREATE)
+        except OperationalError as e:
+            print(f"SQLite FTS5 unavailable ({e}); search will use icontains")
+    elif vendor == 'postgresql':
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute("DROP TABLE IF EXISTS music_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_genrestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
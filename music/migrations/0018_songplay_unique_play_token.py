@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def drop_duplicate_plays(apps, schema_editor):
+    """
+    Keep the first row of each (user, play_token), with the longest duration
+    reported. Anonymous plays are left alone, as the constraint is: NULL
+    users never collide.
+    """
+    SongPlay = apps.get_model('music', 'SongPlay')
+    duplicates = (
+        SongPlay.objects.filter(user__isnull=False).exclude(play_token='')
+        .values('user_id', 'play_token')
+        .annotate(rows=Count('pk'), first=Min('pk'), longest=Max('duration_played'))
+        .filter(rows__gt=1)
+    )
+    for row in duplicates.iterator():
+        plays = SongPlay.objects.filter(user_id=row['user_id'], play_token=row['play_token'])
+        plays.exclude(pk=row['first']).delete()
+        plays.update(duration_played=row['longest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0017_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_plays, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='songplay',
+            constraint=models.UniqueConstraint(condition=models.Q(('play_token', ''), _negated=True), fields=('user', 'play_token'), name='unique_user_play_token'),
+        ),
+    ]
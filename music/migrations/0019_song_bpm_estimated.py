@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0018_songplay_unique_play_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='bpm_estimated',
+            field=models.BooleanField(default=False, editable=False, help_text='bpm came from the tempo analysis, not the artist'),
+        ),
+    ]
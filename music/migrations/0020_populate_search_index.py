@@ -0,0 +1,82 @@
+# Fill the full-text index created by 0017 and write its "built" marker, so
+# search switches from icontains to the index with every document present.
+# The document layout is copied from music/fulltext.py as it was when this
+# migration was written, so later changes there don't alter it.
+
+from django.conf import settings
+from django.db import migrations
+
+TABLE = 'music_search_index'
+KINDS = {'song': 1, 'artist': 2, 'genre': 3}
+ROWID_STRIDE = 4
+BATCH_SIZE = 500
+
+
+def documents(apps):
+    """``(kind, pk, name, context, body)`` for every indexable object"""
+    Song = apps.get_model('music', 'Song')
+    Artist = apps.get_model('artists', 'Artist')
+    Genre = apps.get_model('music', 'Genre')
+
+    songs = Song.objects.filter(is_approved=True).select_related('artist', 'genre')
+    for song in songs.iterator(chunk_size=BATCH_SIZE):
+        context = ' '.join(filter(None, [song.artist.name, song.genre.name if song.genre else None]))
+        yield 'song', song.pk, song.title, context, song.lyrics or ''
+    for artist in Artist.objects.select_related('genre').iterator(chunk_size=BATCH_SIZE):
+        yield 'artist', artist.pk, artist.name, artist.genre.name if artist.genre else '', artist.bio or ''
+    for genre in Genre.objects.iterator(chunk_size=BATCH_SIZE):
+        yield 'genre', genre.pk, genre.name, '', genre.description or ''
+
+
+def populate_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    vendor = connection.vendor
+    if vendor not in ('sqlite', 'postgresql') or TABLE not in connection.introspection.table_names():
+        return
+
+    if vendor == 'sqlite':
+        sql = f"INSERT INTO {TABLE} (rowid, name, context, body) VALUES (%s, %s, %s, %s)"
+        marker = f"INSERT INTO {TABLE} (rowid, name, context, body) VALUES (0, '', '', '')"
+
+        def row(kind, pk, name, context, body):
+            return pk * ROWID_STRIDE + KINDS[kind], name, context, body
+    else:
+        config = getattr(settings, 'SEARCH_POSTGRES_CONFIG', 'simple')
+        sql = (
+            f"INSERT INTO {TABLE} (kind, object_id, document) VALUES (%s, %s, "
+            "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'B') || "
+            "setweight(to_tsvector(%s::regconfig, %s), 'C')) "
+            "ON CONFLICT (kind, object_id) DO UPDATE SET document = EXCLUDED.document"
+        )
+        marker = (
+            f"INSERT INTO {TABLE} (kind, object_id, document) VALUES (0, 0, ''::tsvector) "
+            "ON CONFLICT (kind, object_id) DO NOTHING"
+        )
+
+        def row(kind, pk, name, context, body):
+            return KINDS[kind], pk, config, name, config, context, config, body
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        batch = []
+        for document in documents(apps):
+            batch.append(row(*document))
+            if len(batch) == BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+        cursor.execute(marker)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artists', '0002_initial'),
+        ('music', '0019_song_bpm_estimated'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 # music/models.py
+import hashlib
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import timedelta
 from django.utils.text import slugify   
 
@@ -18,6 +21,23 @@ class Genre(models.Model):
     def __str__(self):
         return self.name
 
+class GenreStats(models.Model):
+    """Totals over a genre's approved songs, kept current by music/genre_stats.py"""
+    genre = models.OneToOneField(Genre, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    songs = models.PositiveIntegerField(default=0)
+    plays = models.PositiveIntegerField(default=0)
+    downloads = models.PositiveIntegerField(default=0)
+    # [{'artist_id', 'songs', 'plays', 'downloads'}], best first
+    top_artists = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'music'
+        verbose_name_plural = 'Genre stats'
+
+    def __str__(self):
+        return f"Stats for {self.genre.name}"
+
 class Song(models.Model):
     AUDIO_QUALITY_CHOICES = [
         ('standard', 'Standard'),
@@ -37,9 +57,19 @@ class Song(models.Model):
     )
     cover_image = models.ImageField(upload_to='covers/', blank=True, null=True)
     duration = models.PositiveIntegerField(help_text="Duration in seconds", default=0)
+    # Read from the audio file after upload (music/processing/metadata.py)
+    bitrate = models.PositiveIntegerField(blank=True, null=True, help_text="kbps")
+    sample_rate = models.PositiveIntegerField(blank=True, null=True, help_text="Hz")
+    embedded_tags = models.JSONField(default=dict, blank=True, help_text="Tags found in the uploaded file")
+    metadata_source = models.CharField(max_length=255, blank=True, default='', editable=False,
+                                       help_text="audio_file name the metadata was read from")
+    fingerprint_source = models.CharField(max_length=255, blank=True, default='', editable=False,
+                                          help_text="audio_file name the fingerprint was computed from")
     upload_date = models.DateTimeField(auto_now_add=True)
     plays = models.PositiveIntegerField(default=0)
     downloads = models.PositiveIntegerField(default=0)
+    hot_score = models.FloatField(default=0, editable=False,
+                                  help_text="Recent plays/downloads with time decay (music/hotness.py)")
     
     # REMOVED: Duplicate genre field that was here
     
@@ -49,31 +79,66 @@ class Song(models.Model):
     # Premium content fields
     is_premium_only = models.BooleanField(default=False, help_text="Only available to premium users")
     preview_duration = models.PositiveIntegerField(default=30, help_text="Preview duration in seconds for free users")
+    preview_file = models.FileField(upload_to='previews/', blank=True, null=True,
+                                    help_text="First preview_duration seconds, generated after upload")
+    preview_source = models.CharField(max_length=255, blank=True, default='', editable=False,
+                                      help_text="audio_file name and duration the preview was cut from")
     audio_quality = models.CharField(max_length=20, choices=AUDIO_QUALITY_CHOICES, default='standard')
     
     # Metadata
     lyrics = models.TextField(blank=True, null=True)
     bpm = models.PositiveIntegerField(blank=True, null=True, help_text="Beats per minute")
+    bpm_estimated = models.BooleanField(default=False, editable=False,
+                                        help_text="bpm came from the tempo analysis, not the artist")
     release_year = models.PositiveIntegerField(blank=True, null=True)
+    loudness = models.FloatField(blank=True, null=True, help_text="Integrated loudness in LUFS")
+    replay_gain = models.FloatField(blank=True, null=True,
+                                    help_text="dB to apply for -18 LUFS playback (ReplayGain 2.0 reference)")
+    analysis_source = models.CharField(max_length=255, blank=True, default='', editable=False,
+                                       help_text="audio_file name the tempo/loudness analysis ran on")
     
     class Meta:
         ordering = ['-upload_date']
         indexes = [
             models.Index(fields=['-upload_date']),
             models.Index(fields=['is_approved', 'is_featured']),
+            models.Index(fields=['is_approved', 'bpm']),
+            models.Index(fields=['is_approved', '-hot_score']),
         ]
         app_label = 'music'  # Add this line
     
     def __str__(self):
         return f"{self.title} - {self.artist.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        song = super().from_db(db, field_names, values)
+        # Stored genre and approval, so saves that don't move genre totals skip the recount
+        if 'genre_id' in song.__dict__ and 'is_approved' in song.__dict__:
+            song._stored_genre_stats = (song.genre_id, song.is_approved)
+        return song
+    
     def increment_plays(self):
-        self.plays += 1
-        self.save()
+        """Buffer a play; written to the database by music.counters"""
+        from .counters import increment_plays
+        increment_plays(self)
     
     def increment_downloads(self):
-        self.downloads += 1
-        self.save()
+        """Buffer a download; written to the database by music.counters"""
+        from .counters import increment_downloads
+        increment_downloads(self)
+    
+    @property
+    def current_plays(self):
+        """Stored plays plus increments not flushed yet"""
+        from .counters import pending_counts
+        return self.plays + pending_counts(self)['plays']
+    
+    @property
+    def current_downloads(self):
+        """Stored downloads plus increments not flushed yet"""
+        from .counters import pending_counts
+        return self.downloads + pending_counts(self)['downloads']
     
     @property
     def formatted_duration(self):
@@ -97,11 +162,67 @@ class Song(models.Model):
         if user.is_authenticated and hasattr(user, 'userprofile'):
             return user.userprofile.is_premium_active
         return False
+    
+    @property
+    def preview_url(self):
+        """Public URL of the preview clip, once one has been generated"""
+        if not self.preview_file:
+            return None
+        from django.urls import reverse
+        return reverse('preview_song', args=[self.pk])
+    
+    @cached_property
+    def waveform_url(self):
+        """Versioned URL of the waveform peaks, once they have been computed
+
+        Uses the ``waveform`` row when the queryset already loaded it (select_related or
+        prefetch_related, deferring ``peaks``), so list pages don't query once per song.
+        """
+        if Song.waveform.is_cached(self):
+            try:
+                waveform = (self.waveform.source_name, self.waveform.buckets)
+            except SongWaveform.DoesNotExist:
+                return None
+        else:
+            waveform = SongWaveform.objects.filter(song_id=self.pk).values_list('source_name', 'buckets').first()
+        if waveform is None or waveform[0] != self.audio_file.name:
+            return None
+        from django.urls import reverse
+        return reverse('song_waveform', args=[self.pk, SongWaveform.version_for(*waveform)])
+    
+    @staticmethod
+    def stream_quality_for(user):
+        """Highest quality tier the user's plan may stream"""
+        from django.conf import settings
+        plan = 'free'
+        if user is not None and user.is_authenticated and hasattr(user, 'userprofile'):
+            if user.userprofile.is_premium_active:
+                plan = user.userprofile.premium_plan
+        qualities = getattr(settings, 'STREAM_QUALITY_BY_PLAN', {})
+        return qualities.get(plan, qualities.get('free', 'standard'))
+    
+    @classmethod
+    def allowed_stream_qualities(cls, user):
+        """Quality tiers the user may stream, lowest first"""
+        ranks = [quality for quality, _ in cls.AUDIO_QUALITY_CHOICES]
+        return ranks[:ranks.index(cls.stream_quality_for(user)) + 1]
+    
+    def rendition_for(self, user):
+        """Best transcoded rendition the user may stream, or None to use audio_file"""
+        allowed = self.allowed_stream_qualities(user)
+        renditions = {r.quality: r for r in self.renditions.filter(quality__in=allowed)}
+        for quality in reversed(allowed):
+            if quality in renditions:
+                return renditions[quality]
+        return None
 
 class SongPlay(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='play_history')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='song_plays')
-    played_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: queued plays are bulk-inserted later with their real time
+    played_at = models.DateTimeField(default=timezone.now)
+    play_token = models.CharField(max_length=32, blank=True, default='', db_index=True,
+                                  help_text="Client handle for a play that may still be queued")
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     duration_played = models.PositiveIntegerField(default=0, help_text="Seconds played")
     
@@ -122,6 +243,14 @@ class SongPlay(models.Model):
             models.Index(fields=['-played_at']),
             models.Index(fields=['song', 'played_at']),
         ]
+        constraints = [
+            # A retried or replayed play is never stored twice
+            models.UniqueConstraint(
+                fields=['user', 'play_token'],
+                condition=~models.Q(play_token=''),
+                name='unique_user_play_token',
+            ),
+        ]
         app_label = 'music'  # Add this line
     
     def __str__(self):
@@ -130,7 +259,7 @@ class SongPlay(models.Model):
 class SongDownload(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='download_history')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='song_downloads')
-    downloaded_at = models.DateTimeField(auto_now_add=True)
+    downloaded_at = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
     # Download details
@@ -153,6 +282,79 @@ class SongDownload(models.Model):
     def __str__(self):
         return f"{self.song.title} downloaded by {self.user.username if self.user else 'Anonymous'}"
 
+class SongRendition(models.Model):
+    """A transcoded copy of a song's audio for one quality tier"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='renditions')
+    quality = models.CharField(max_length=20, choices=Song.AUDIO_QUALITY_CHOICES)
+    file = models.FileField(upload_to='renditions/')
+    codec = models.CharField(max_length=20)
+    bitrate = models.PositiveIntegerField(null=True, blank=True, help_text="kbps; empty for lossless")
+    file_size = models.PositiveBigIntegerField(default=0, help_text="File size in bytes")
+    source_name = models.CharField(max_length=255, help_text="audio_file name this was transcoded from")
+    created_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['song', 'quality']
+        app_label = 'music'
+    
+    def __str__(self):
+        return f"{self.song.title} ({self.get_quality_display()})"
+
+class SongWaveform(models.Model):
+    """Downsampled peaks for drawing a song's waveform in the player"""
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, related_name='waveform')
+    # uint8 min/max pairs, one pair per bucket; 0 and 255 are full scale, 128 is silence
+    peaks = models.BinaryField()
+    buckets = models.PositiveIntegerField()
+    source_name = models.CharField(max_length=255, help_text="audio_file name the peaks were computed from")
+    created_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'music'
+    
+    def __str__(self):
+        return f"Waveform for {self.song.title}"
+    
+    @staticmethod
+    def version_for(source_name, buckets):
+        return hashlib.sha1(f'{source_name}:{buckets}'.encode('utf-8')).hexdigest()[:12]
+
+class AudioFingerprint(models.Model):
+    """One spectral landmark hash of a song (music/processing/fingerprint.py)"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='fingerprints')
+    hash = models.IntegerField(db_index=True)
+    offset = models.PositiveIntegerField(help_text="Anchor position in spectrogram frames")
+    
+    class Meta:
+        app_label = 'music'
+    
+    def __str__(self):
+        return f"{self.song_id}:{self.hash:06x}@{self.offset}"
+
+class DuplicateCandidate(models.Model):
+    """A newer upload that sounds like an existing song, waiting for a moderator"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending review'),
+        ('confirmed', 'Confirmed duplicate'),
+        ('dismissed', 'Not a duplicate'),
+    ]
+    
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='duplicate_candidates')
+    original = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='duplicated_by')
+    matches = models.PositiveIntegerField(help_text="Landmark hashes that line up with the original")
+    score = models.FloatField(help_text="Share of the song's hashes that line up (0-1)")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ['song', 'original']
+        app_label = 'music'
+    
+    def __str__(self):
+        return f"{self.song.title} ~ {self.original.title} ({self.score:.0%})"
+
 # music/models.py (update your existing models)
 
 from django.utils.crypto import get_random_string
@@ -328,6 +530,22 @@ class ChartEntry(models.Model):
     class Meta:
         ordering = ['position']
         unique_together = ['chart', 'position']
+
+class ChartSnapshot(models.Model):
+    """A chart as published for one week, so past weeks are served as stored"""
+    chart = models.ForeignKey(Chart, on_delete=models.CASCADE, related_name='snapshots')
+    week = models.DateField(help_text="Monday the chart week starts on")
+    # [{song_id, position, previous_position, weeks_on_chart, plays, downloads}, ...] by position
+    entries = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-week']
+        unique_together = ['chart', 'week']
+    
+    def __str__(self):
+        return f"{self.chart.title} - week of {self.week:%Y-%m-%d}"
 import re
 
 class YouTubeVideo(models.Model):
@@ -0,0 +1,169 @@
+# music/mp3frames.py
+"""
+Minimal MPEG audio frame walker.
+
+Enough of the frame header is decoded to know each frame's length and
+duration, which lets us cut an MP3 on frame boundaries (for previews)
+without decoding or re-encoding any audio.
+"""
+import struct
+from dataclasses import dataclass
+
+from .id3splice import audio_bounds
+
+# Bitrates in kbps by (version is MPEG-1, layer), indexed by the 4 bit field
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by the 2 bit version field: 0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1
+SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+LAYERS = {1: 3, 2: 2, 3: 1}  # 2 bit layer field -> layer number
+
+# How far to search for the next frame sync after garbage
+MAX_RESYNC_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    mpeg1: bool
+    layer: int
+    bitrate: int  # kbps
+    sample_rate: int
+    padding: int
+    mono: bool
+
+    @property
+    def samples(self):
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and not self.mpeg1:
+            return 576
+        return 1152
+
+    @property
+    def length(self):
+        if self.layer == 1:
+            return (12 * self.bitrate * 1000 // self.sample_rate + self.padding) * 4
+        return self.samples // 8 * self.bitrate * 1000 // self.sample_rate + self.padding
+
+    @property
+    def duration(self):
+        return self.samples / self.sample_rate
+
+    @property
+    def side_info_size(self):
+        if self.mpeg1:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+
+def parse_header(data):
+    """FrameHeader for the 4 bytes in ``data``, or None if they are not a valid header."""
+    if len(data) < 4:
+        return None
+    (word,) = struct.unpack('>I', data[:4])
+    if word >> 21 != 0x7FF:
+        return None
+    version = (word >> 19) & 0x3
+    layer_bits = (word >> 17) & 0x3
+    bitrate_index = (word >> 12) & 0xF
+    rate_index = (word >> 10) & 0x3
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # reserved values, or free-format bitrate we can't size
+    mpeg1 = version == 3
+    layer = LAYERS[layer_bits]
+    return FrameHeader(
+        mpeg1=mpeg1,
+        layer=layer,
+        bitrate=BITRATES[(mpeg1, layer)][bitrate_index],
+        sample_rate=SAMPLE_RATES[version][rate_index],
+        padding=(word >> 9) & 0x1,
+        mono=((word >> 6) & 0x3) == 3,
+    )
+
+
+def _is_vbr_info_frame(header, frame):
+    """Xing/Info/VBRI frames describe the whole file and must not survive a cut."""
+    offset = 4 + header.side_info_size
+    return frame[offset:offset + 4] in (b'Xing', b'Info') or frame[36:40] == b'VBRI'
+
+
+def iter_frames(path, bounds=None, chunk_size=64 * 1024):
+    """Yield ``(offset, header)`` for each audio frame in ``path``, reading it incrementally."""
+    start, end = bounds or audio_bounds(path)
+    with open(path, 'rb') as audio:
+        audio.seek(start)
+        buffer = b''
+        base = start  # file offset of buffer[0]
+        position = 0
+        first = True
+        skipped = 0
+
+        def fill(needed):
+            nonlocal buffer, base, position
+            while len(buffer) - position < needed and base + len(buffer) < end:
+                # Drop consumed bytes, then read more
+                buffer, base, position = buffer[position:], base + position, 0
+                buffer += audio.read(min(chunk_size, end - base - len(buffer)))
+            return len(buffer) - position >= needed
+
+        while fill(4):
+            header = parse_header(buffer[position:position + 4])
+            if header is None or header.length <= 4:
+                # Lost sync: look for the next plausible header
+                position += 1
+                skipped += 1
+                if skipped > MAX_RESYNC_BYTES:
+                    return
+                continue
+            if not fill(header.length):
+                return  # truncated last frame
+            skipped = 0
+            frame = buffer[position:position + header.length]
+            if first:
+                first = False
+                if _is_vbr_info_frame(header, frame):
+                    position += header.length
+                    continue
+            yield base + position, header
+            position += header.length
+
+
+def cut_range(path, seconds):
+    """
+    ``(start, end)`` byte range holding the first ``seconds`` of audio in
+    whole frames, or None if no MPEG frames were found.
+    """
+    cut_start = cut_end = None
+    elapsed = 0.0
+    for offset, header in iter_frames(path):
+        if cut_start is None:
+            cut_start = offset
+        if elapsed >= seconds:
+            break
+        elapsed += header.duration
+        cut_end = offset + header.length
+    if cut_start is None:
+        return None
+    return cut_start, cut_end
+
+
+def write_clip(path, seconds, output_path):
+    """Write the first ``seconds`` of ``path`` to ``output_path``. Returns bytes written or None."""
+    byte_range = cut_range(path, seconds)
+    if byte_range is None:
+        return None
+    start, end = byte_range
+    with open(path, 'rb') as source, open(output_path, 'wb') as output:
+        source.seek(start)
+        output.write(source.read(end - start))
+    return end - start
@@ -0,0 +1,124 @@
+# music/offload.py
+"""
+Front-proxy offload for large file transfers.
+
+When ``AUDIO_OFFLOAD_MODE`` is set, views still do the access check and
+record the play/download, but return an empty response carrying an
+internal-redirect header. The proxy then sends the bytes (including Range
+requests), so a slow mobile download no longer ties up a gunicorn worker.
+
+* ``'nginx'``  - ``X-Accel-Redirect`` to an ``internal`` location. Each root in
+  ``AUDIO_OFFLOAD_LOCATIONS`` needs a matching block, e.g.::
+
+      location /protected/media/ { internal; alias /srv/sangabiz/media/; }
+
+* ``'apache'`` - ``X-Sendfile`` with the absolute path (mod_xsendfile).
+
+``OffloadStandInMiddleware`` plays the proxy's part in development so the
+same code path works under ``runserver``.
+"""
+import os
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from . import streaming
+
+OFFLOAD_HEADERS = {
+    'nginx': 'X-Accel-Redirect',
+    'apache': 'X-Sendfile',
+}
+
+
+def _locations():
+    """(filesystem root, internal URI prefix) pairs, longest root first."""
+    locations = getattr(settings, 'AUDIO_OFFLOAD_LOCATIONS', {})
+    pairs = [(os.path.realpath(root), prefix) for root, prefix in locations.items()]
+    return sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+
+
+def internal_uri(path):
+    """Internal proxy URI for ``path``, or None if it is outside every location."""
+    path = os.path.realpath(path)
+    for root, prefix in _locations():
+        if path == root or path.startswith(root + os.sep):
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            return prefix.rstrip('/') + '/' + quote(relative)
+    return None
+
+
+def resolve_internal_uri(uri):
+    """Inverse of ``internal_uri``; None if the URI is unknown or escapes its root."""
+    for root, prefix in _locations():
+        prefix = prefix.rstrip('/') + '/'
+        if uri.startswith(prefix):
+            path = os.path.realpath(os.path.join(root, unquote(uri[len(prefix):])))
+            if path.startswith(root + os.sep):
+                return path
+    return None
+
+
+def offload_response(path, content_type=None, filename=None):
+    """
+    Response that asks the front proxy to send ``path``, or None when offload
+    is disabled (or the path is not under a configured location) and the
+    caller should stream the file itself.
+    """
+    mode = getattr(settings, 'AUDIO_OFFLOAD_MODE', None)
+    if not mode:
+        return None
+    if mode not in OFFLOAD_HEADERS:
+        raise ValueError(f"Unknown AUDIO_OFFLOAD_MODE: {mode}")
+
+    response = HttpResponse(content_type=content_type or 'application/octet-stream')
+    if mode == 'nginx':
+        uri = internal_uri(path)
+        if uri is None:
+            return None
+        response['X-Accel-Redirect'] = uri
+    else:
+        response['X-Sendfile'] = os.path.realpath(path)
+
+    if content_type is None:
+        # Let the proxy pick the type from the file extension
+        del response['Content-Type']
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class OffloadStandInMiddleware:
+    """
+    Serve offloaded responses in-process, standing in for nginx/Apache when
+    ``AUDIO_OFFLOAD_STAND_IN`` is on (defaults to DEBUG). Otherwise Django
+    drops it from the stack at startup, so production requests never pass
+    through it.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'AUDIO_OFFLOAD_STAND_IN', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('X-Accel-Redirect'):
+            path = resolve_internal_uri(response['X-Accel-Redirect'])
+        elif response.has_header('X-Sendfile'):
+            path = response['X-Sendfile']
+        else:
+            return response
+
+        if not path or not os.path.isfile(path):
+            return HttpResponse(status=404)
+
+        served = streaming.serve_file(
+            request, path,
+            content_type=response.get('Content-Type'),
+        )
+        for header in ('Content-Disposition', 'Cache-Control'):
+            if response.has_header(header):
+                served[header] = response[header]
+        return served
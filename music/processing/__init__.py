@@ -0,0 +1,14 @@
+# music/processing/__init__.py
+"""
+Offline media processing for uploaded songs.
+
+Stages register themselves with ``@stage`` and run in ``order`` after a song
+is uploaded (on a background thread pool, once the upload commits) or from
+``manage.py process_media``.
+"""
+from .registry import STAGES, get_stages, process_song, run_stages, schedule, stage
+
+# Importing the stage modules registers them
+from . import metadata, fingerprint, preview, renditions, hls, waveform, analysis  # noqa: E402,F401
+
+__all__ = ['STAGES', 'get_stages', 'process_song', 'run_stages', 'schedule', 'stage']
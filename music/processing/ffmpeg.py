@@ -0,0 +1,101 @@
+# music/processing/ffmpeg.py
+"""Thin wrapper around the ffmpeg binary."""
+import shutil
+import subprocess
+import time
+
+from django.conf import settings
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def binary():
+    """Path of ffmpeg, or None when it is not installed."""
+    return shutil.which(getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'))
+
+
+def available():
+    return binary() is not None
+
+
+def _command(args):
+    executable = binary()
+    if executable is None:
+        raise FFmpegError("ffmpeg is not installed")
+    return [executable, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', *map(str, args)]
+
+
+def run(*args, timeout=None):
+    """Run ffmpeg quietly with ``args``; raises FFmpegError on failure."""
+    command = _command(args)
+    try:
+        result = subprocess.run(
+            command,
+            capture_output=True,
+            timeout=timeout or getattr(settings, 'FFMPEG_TIMEOUT', 10 * 60),
+        )
+    except subprocess.TimeoutExpired:
+        raise FFmpegError(f"ffmpeg timed out: {' '.join(command)}")
+    if result.returncode != 0:
+        raise FFmpegError(result.stderr.decode('utf-8', 'replace').strip() or f"ffmpeg exited {result.returncode}")
+    return result.stdout
+
+
+def stream(*args, block_size=1 << 20, timeout=None):
+    """
+    Run ffmpeg with ``args`` and yield its stdout in blocks of up to
+    ``block_size`` bytes as it is produced; raises FFmpegError on failure.
+    """
+    command = _command(args)
+    deadline = time.monotonic() + (timeout or getattr(settings, 'FFMPEG_TIMEOUT', 10 * 60))
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if time.monotonic() > deadline:
+                raise FFmpegError(f"ffmpeg timed out: {' '.join(command)}")
+            data = process.stdout.read(block_size)
+            if not data:
+                break
+            yield data
+        # -loglevel error keeps stderr small enough not to block the pipe
+        stderr = process.stderr.read()
+        returncode = process.wait(timeout=max(deadline - time.monotonic(), 1))
+    except subprocess.TimeoutExpired:
+        raise FFmpegError(f"ffmpeg timed out: {' '.join(command)}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+    if returncode != 0:
+        raise FFmpegError(stderr.decode('utf-8', 'replace').strip() or f"ffmpeg exited {returncode}")
+
+
+def _pcm_args(source_path, sample_rate, channels):
+    return (
+        '-i', source_path, '-map', '0:a:0', '-vn', '-ac', channels, '-ar', sample_rate,
+        '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1',
+    )
+
+
+def decode_pcm(source_path, sample_rate, channels=1):
+    """
+    The first audio stream of ``source_path`` as signed 16-bit little-endian
+    PCM bytes, downmixed to ``channels`` (interleaved when more than one).
+    """
+    return run(*_pcm_args(source_path, sample_rate, channels))
+
+
+def stream_pcm(source_path, sample_rate, channels=1, block_size=1 << 20):
+    """Like ``decode_pcm``, but yielding the PCM in blocks of whole frames."""
+    frame_size = 2 * channels
+    remainder = b''
+    for data in stream(*_pcm_args(source_path, sample_rate, channels), block_size=block_size):
+        data = remainder + data
+        usable = len(data) - len(data) % frame_size
+        remainder = data[usable:]
+        if usable:
+            yield data[:usable]
@@ -0,0 +1,184 @@
+# music/processing/fingerprint.py
+"""
+Acoustic fingerprints for spotting re-uploads of a song already in the catalog.
+
+Landmark hashing: the strongest local peaks of the spectrogram are paired
+with a few peaks that follow them, and each pair (both frequencies and the
+time between them) becomes a 24 bit hash stored with the anchor's time in
+``AudioFingerprint``. At most PEAKS_PER_SECOND x FAN_OUT = 15 hashes a
+second: about 2,700 rows for a 3 minute song, some 300KB on PostgreSQL at
+~110 bytes a row with its indexes. Two recordings of the same track share many hashes at
+a constant time offset, whatever the file name, tags or container. A match
+against an existing song opens a ``DuplicateCandidate`` for moderators.
+"""
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ffmpeg
+from .registry import stage
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+    print("NumPy not installed - duplicate detection disabled")
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 11025
+FFT_SIZE = 1024
+HOP = 512  # ~21.5 frames per second
+FREQ_BINS = 512  # bins 1-512 of the FFT (~10.8Hz each), 9 bits
+PEAK_TIME_RADIUS = 10  # frames either side a peak must dominate
+PEAK_FREQ_RADIUS = 15  # bins either side
+WINDOW_FRAMES = 22  # ~1 second; each keeps at most PEAKS_PER_SECOND peaks
+PEAKS_PER_SECOND = 5
+FAN_OUT = 3  # targets paired with each anchor
+MAX_DELTA = 63  # frames between anchor and target, 6 bits
+QUERY_CHUNK = 500  # hashes per IN (...) lookup
+
+
+def fingerprint_stale(song):
+    return HAS_NUMPY and ffmpeg.available() and song.fingerprint_source != song.audio_file.name
+
+
+def _sliding_max(values, radius, axis):
+    padded = np.pad(values, [(radius, radius) if a == axis else (0, 0) for a in range(values.ndim)],
+                    mode='constant', constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1, axis=axis).max(axis=-1)
+
+
+def spectrogram(samples):
+    """Log-magnitude spectrogram, shape (frames, FREQ_BINS)."""
+    if len(samples) < FFT_SIZE:
+        return np.zeros((0, FREQ_BINS), dtype=np.float32)
+    window = np.hanning(FFT_SIZE).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP]
+    spec = np.empty((len(frames), FREQ_BINS), dtype=np.float32)
+    # Chunked so a long song never materialises every windowed frame at once
+    for start in range(0, len(frames), 2048):
+        chunk = frames[start:start + 2048] * window
+        spec[start:start + 2048] = np.abs(np.fft.rfft(chunk, axis=1))[:, 1:FREQ_BINS + 1]
+    return np.log1p(spec)
+
+
+def find_peaks(spec):
+    """``(frames, bins)`` of the strongest local maxima in each window, ordered by time."""
+    if not spec.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    neighbourhood = _sliding_max(_sliding_max(spec, PEAK_FREQ_RADIUS, axis=1), PEAK_TIME_RADIUS, axis=0)
+    frames, bins = np.nonzero((spec == neighbourhood) & (spec > np.median(spec)))
+    # Capped per window rather than per song, so quiet passages keep their landmarks too
+    windows = frames // WINDOW_FRAMES
+    order = np.lexsort((-spec[frames, bins], windows))
+    rank = np.arange(len(order)) - np.searchsorted(windows[order], windows[order])
+    frames, bins = frames[order][rank < PEAKS_PER_SECOND], bins[order][rank < PEAKS_PER_SECOND]
+    order = np.lexsort((bins, frames))
+    return frames[order], bins[order]
+
+
+def landmarks(pcm):
+    """``(hashes, offsets)`` arrays for signed 16-bit mono ``pcm`` at SAMPLE_RATE."""
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+    frames, bins = find_peaks(spectrogram(samples))
+    hashes, offsets = [], []
+    for step in range(1, FAN_OUT + 1):
+        if len(frames) <= step:
+            break
+        delta = frames[step:] - frames[:-step]
+        keep = (delta > 0) & (delta <= MAX_DELTA)
+        hashes.append((bins[:-step][keep] << 15) | (bins[step:][keep] << 6) | delta[keep])
+        offsets.append(frames[:-step][keep])
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Drop repeated (hash, offset) pairs
+    pairs = np.unique(np.concatenate(hashes) << 32 | np.concatenate(offsets))
+    return pairs >> 32, pairs & 0xFFFFFFFF
+
+
+def find_matches(song_id, hashes, offsets):
+    """``{song_id: aligned hash count}`` for other songs sharing landmarks at a consistent offset."""
+    from ..models import AudioFingerprint
+
+    ours = defaultdict(list)
+    for value, offset in zip(hashes.tolist(), offsets.tolist()):
+        ours[value].append(offset)
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    unique = list(ours)
+    for start in range(0, len(unique), QUERY_CHUNK):
+        rows = (
+            AudioFingerprint.objects
+            .filter(hash__in=unique[start:start + QUERY_CHUNK])
+            .exclude(song_id=song_id)
+            .values_list('song_id', 'hash', 'offset')
+        )
+        for other_id, value, offset in rows.iterator():
+            for our_offset in ours[value]:
+                deltas[other_id][offset - our_offset] += 1
+
+    matches = {}
+    for other_id, counts in deltas.items():
+        # Allow a frame of jitter between encodes
+        matches[other_id] = max(
+            counts.get(delta - 1, 0) + count + counts.get(delta + 1, 0)
+            for delta, count in counts.items()
+        )
+    return matches
+
+
+def flag_duplicates(song, matches, total):
+    """Open DuplicateCandidates for strong matches; the older upload is the original."""
+    from ..models import AudioFingerprint, DuplicateCandidate, Song
+
+    min_matches = getattr(settings, 'FINGERPRINT_MIN_MATCHES', 20)
+    min_score = getattr(settings, 'FINGERPRINT_MATCH_SCORE', 0.1)
+    for other_id, count in matches.items():
+        if count < min_matches:
+            continue
+        other_total = AudioFingerprint.objects.filter(song_id=other_id).count()
+        # Relative to the shorter song, so a clip of a longer track still matches
+        score = min(1.0, count / max(1, min(total, other_total)))
+        if score < min_score:
+            continue
+        other = Song.objects.filter(pk=other_id).only('pk', 'upload_date').first()
+        if other is None:
+            continue
+        newer, original = (song, other) if (song.upload_date, song.pk) > (other.upload_date, other.pk) else (other, song)
+        candidate, created = DuplicateCandidate.objects.get_or_create(
+            song=newer, original=original, defaults={'matches': count, 'score': score},
+        )
+        if not created and candidate.status == 'pending':
+            candidate.matches, candidate.score = count, score
+            candidate.save(update_fields=['matches', 'score'])
+        logger.info("Song %s looks like a duplicate of song %s (%.0f%% aligned)", newer.pk, original.pk, score * 100)
+
+
+@stage('fingerprint', order=15, is_stale=fingerprint_stale)
+def fingerprint_song(song, source_path, force=False):
+    from ..models import AudioFingerprint, DuplicateCandidate
+
+    if not HAS_NUMPY:
+        return
+    if not force and song.fingerprint_source == song.audio_file.name:
+        return
+
+    hashes, offsets = landmarks(ffmpeg.decode_pcm(source_path, SAMPLE_RATE))
+    matches = find_matches(song.pk, hashes, offsets)
+
+    with transaction.atomic():
+        AudioFingerprint.objects.filter(song=song).delete()
+        AudioFingerprint.objects.bulk_create(
+            (AudioFingerprint(song=song, hash=value, offset=offset)
+             for value, offset in zip(hashes.tolist(), offsets.tolist())),
+            batch_size=2000,
+        )
+        # New audio: earlier verdicts about this song no longer apply
+        DuplicateCandidate.objects.filter(song=song, status='pending').delete()
+        song.fingerprint_source = song.audio_file.name
+        song.save(update_fields=['fingerprint_source'])
+        flag_duplicates(song, matches, len(hashes))
@@ -0,0 +1,119 @@
+# music/processing/hls.py
+"""
+HLS packaging: fixed-length AAC segments plus a media playlist per quality tier.
+
+Output lives at ``HLS_ROOT/<song_id>/<version>/<quality>/``. ``version`` is
+an HMAC of everything that shapes the output, so a re-encode gets new URLs.
+Segments and media playlists can therefore be cached forever, and the
+version cannot be guessed without a master playlist from ``music.views``.
+"""
+import hashlib
+import hmac
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from . import ffmpeg
+from .registry import stage
+from .renditions import ladder, target_qualities
+
+MASTER_CODECS = 'mp4a.40.2'  # AAC-LC
+SEGMENT_NAME_RE = re.compile(r'^(index\.m3u8|seg_\d{5}\.ts)$')
+
+
+def hls_root():
+    return str(getattr(settings, 'HLS_ROOT', os.path.join(settings.MEDIA_ROOT, 'hls')))
+
+
+def segment_seconds():
+    return getattr(settings, 'HLS_SEGMENT_SECONDS', 6)
+
+
+def hls_qualities(song):
+    """Tiers to package: the lossy rendition tiers the song qualifies for."""
+    return [q for q in target_qualities(song) if ladder()[q]['bitrate']]
+
+
+def hls_version(song):
+    parts = [
+        str(song.pk), song.audio_file.name, str(segment_seconds()),
+        ','.join(f"{q}:{ladder()[q]['bitrate']}" for q in hls_qualities(song)),
+    ]
+    digest = hmac.new(settings.SECRET_KEY.encode(), '|'.join(parts).encode(), hashlib.sha256)
+    return digest.hexdigest()[:20]
+
+
+def song_dir(song_id):
+    return os.path.join(hls_root(), str(song_id))
+
+
+def package_dir(song):
+    return os.path.join(song_dir(song.pk), hls_version(song))
+
+
+def is_packaged(song):
+    return all(
+        os.path.exists(os.path.join(package_dir(song), quality, 'index.m3u8'))
+        for quality in hls_qualities(song)
+    ) and bool(hls_qualities(song))
+
+
+def hls_stale(song):
+    return bool(song.audio_file) and ffmpeg.available() and not is_packaged(song)
+
+
+def resolve_file(song_id, version, quality, name):
+    """Filesystem path of a packaged file, or None if the request is not for one."""
+    if not SEGMENT_NAME_RE.match(name) or not re.fullmatch(r'[0-9a-f]{20}', version):
+        return None
+    if quality not in ladder():
+        return None
+    path = os.path.join(song_dir(song_id), version, quality, name)
+    return path if os.path.isfile(path) else None
+
+
+def master_playlist(song, qualities, variant_url):
+    """Master playlist text listing ``qualities``; ``variant_url(quality)`` gives each media playlist URL."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for quality in qualities:
+        bandwidth = ladder()[quality]['bitrate'] * 1000
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="{MASTER_CODECS}"')
+        lines.append(variant_url(quality))
+    return '\n'.join(lines) + '\n'
+
+
+@stage('hls', order=40, is_stale=hls_stale, approved_only=True)
+def package_hls(song, source_path, force=False):
+    target = package_dir(song)
+    if os.path.isdir(target) and not force and is_packaged(song):
+        return
+
+    os.makedirs(song_dir(song.pk), exist_ok=True)
+    # Package into a scratch dir next to the target and swap it in whole
+    work_dir = tempfile.mkdtemp(dir=song_dir(song.pk), prefix='.build-')
+    try:
+        for quality in hls_qualities(song):
+            output = os.path.join(work_dir, quality)
+            os.makedirs(output)
+            ffmpeg.run(
+                '-i', source_path, '-map', '0:a:0', '-vn',
+                '-c:a', getattr(settings, 'HLS_AUDIO_CODEC', 'aac'),
+                '-b:a', f"{ladder()[quality]['bitrate']}k",
+                '-f', 'hls',
+                '-hls_time', segment_seconds(),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(output, 'seg_%05d.ts'),
+                os.path.join(output, 'index.m3u8'),
+            )
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(work_dir, target)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Older versions are no longer referenced by any master playlist
+    for name in os.listdir(song_dir(song.pk)):
+        if name != os.path.basename(target) and not name.startswith('.'):
+            shutil.rmtree(os.path.join(song_dir(song.pk), name), ignore_errors=True)
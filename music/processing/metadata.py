@@ -0,0 +1,60 @@
+# music/processing/metadata.py
+"""
+Read duration, bitrate, sample rate and embedded tags from the uploaded file
+once, so pages and the player never have to open audio at request time.
+"""
+from .registry import stage
+
+try:
+    import mutagen
+    HAS_MUTAGEN = True
+except ImportError:
+    HAS_MUTAGEN = False
+    print("Mutagen not installed - audio metadata extraction disabled")
+
+# Longest tag value worth keeping (lyrics and comments can be huge)
+MAX_TAG_LENGTH = 500
+
+
+def metadata_stale(song):
+    return HAS_MUTAGEN and song.metadata_source != song.audio_file.name
+
+
+def read_tags(audio):
+    """Embedded text tags as a plain dict, e.g. {'title': 'x', 'artist': 'y'}."""
+    tags = {}
+    for key, values in (audio.tags or {}).items():
+        if not isinstance(values, list):
+            values = [values]
+        values = [str(value)[:MAX_TAG_LENGTH] for value in values if str(value).strip()]
+        if values:
+            tags[key] = values[0] if len(values) == 1 else values
+    return tags
+
+
+@stage('metadata', order=10, is_stale=metadata_stale)
+def extract_metadata(song, source_path, force=False):
+    if not HAS_MUTAGEN:
+        return
+    if not force and song.metadata_source == song.audio_file.name:
+        return
+
+    # easy=True maps ID3/MP4/Vorbis frames to common names (title, artist, album, ...)
+    audio = mutagen.File(source_path, easy=True)
+    if audio is None:
+        raise ValueError(f"Unrecognised audio format: {song.audio_file.name}")
+
+    info = audio.info
+    fields = ['embedded_tags', 'metadata_source']
+    if getattr(info, 'length', 0):
+        song.duration = int(round(info.length))
+        fields.append('duration')
+    if getattr(info, 'bitrate', 0):
+        song.bitrate = info.bitrate // 1000
+        fields.append('bitrate')
+    if getattr(info, 'sample_rate', 0):
+        song.sample_rate = info.sample_rate
+        fields.append('sample_rate')
+    song.embedded_tags = read_tags(audio)
+    song.metadata_source = song.audio_file.name
+    song.save(update_fields=fields)
@@ -0,0 +1,78 @@
+# music/processing/preview.py
+"""
+Preview clips for premium-only songs: the first ``preview_duration`` seconds,
+but never the last ``PREVIEW_MIN_WITHHELD`` seconds of the song, so a long
+preview_duration cannot hand out the whole track. Songs too short for any
+preview, or no longer premium-only, lose their clip.
+
+MP3 uploads are cut on frame boundaries by ``music.mp3frames`` with no
+re-encode; other formats go through ffmpeg when it is installed. Free users
+only ever receive this clip, never the full-length file.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+
+from .. import mp3frames
+from . import ffmpeg
+from .registry import stage
+from .sources import save_output
+
+
+def clip_seconds(song):
+    """Length of the preview to cut; 0 when the song gets none"""
+    if not song.is_premium_only or not song.preview_duration or not song.duration:
+        return 0
+    withheld = getattr(settings, 'PREVIEW_MIN_WITHHELD', 30)
+    return max(min(song.preview_duration, song.duration - withheld), 0)
+
+
+def preview_source(song):
+    return f'{song.audio_file.name}@{clip_seconds(song)}s'
+
+
+def wants_preview(song):
+    return clip_seconds(song) > 0
+
+
+def preview_stale(song):
+    if not wants_preview(song):
+        return bool(song.preview_file)
+    return not song.preview_file or song.preview_source != preview_source(song)
+
+
+def _drop_preview(song):
+    song.preview_file.delete(save=False)
+    song.preview_source = ''
+    song.save(update_fields=['preview_file', 'preview_source'])
+
+
+@stage('preview', order=20, is_stale=preview_stale)
+def cut_preview(song, source_path, force=False):
+    if not wants_preview(song):
+        if song.preview_file:
+            _drop_preview(song)
+        return
+    if not force and song.preview_file and song.preview_source == preview_source(song):
+        return
+
+    seconds = clip_seconds(song)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, f'{song.pk}-preview.mp3')
+        written = None
+        if source_path.lower().endswith('.mp3'):
+            written = mp3frames.write_clip(source_path, seconds, output)
+        if written is None:
+            if not ffmpeg.available():
+                return
+            ffmpeg.run(
+                '-i', source_path, '-map', '0:a:0', '-t', seconds,
+                '-map_metadata', '-1', '-c:a', 'libmp3lame', '-b:a', '128k', output,
+            )
+
+        if song.preview_file:
+            song.preview_file.delete(save=False)
+        song.preview_source = preview_source(song)
+        save_output(song.preview_file, os.path.basename(output), output, save=False)
+        song.save(update_fields=['preview_file', 'preview_source'])
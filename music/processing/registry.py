@@ -0,0 +1,194 @@
+# music/processing/registry.py
+"""
+Stage registry and runner for post-upload media processing.
+
+A stage is a function ``func(song, source_path, force=False)`` registered
+with ``@stage(name, order=..., is_stale=...)``. ``is_stale(song)`` tells the
+runner whether the stage has work to do, so re-running the pipeline on an
+up-to-date song costs a few queries and never fetches the audio.
+"""
+import concurrent.futures
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+
+from ..cachelock import CacheLock
+from .sources import local_audio
+
+logger = logging.getLogger(__name__)
+
+STAGES = {}
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    func: Callable
+    order: int = 100
+    is_stale: Optional[Callable] = None
+    approved_only: bool = False
+
+    def needs_run(self, song):
+        if self.approved_only and not song.is_approved:
+            return False
+        return self.is_stale is None or self.is_stale(song)
+
+
+def stage(name, order=100, is_stale=None, approved_only=False):
+    """Register a processing stage. Lower ``order`` runs first."""
+    def register(func):
+        STAGES[name] = Stage(name, func, order, is_stale, approved_only)
+        return func
+    return register
+
+
+def get_stages(names=None):
+    stages = sorted(STAGES.values(), key=lambda s: s.order)
+    if names:
+        unknown = set(names) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown processing stages: {', '.join(sorted(unknown))}")
+        stages = [s for s in stages if s.name in names]
+    return stages
+
+
+def _run_locked(song, stages, force):
+    results = {}
+    with local_audio(song.audio_file) as source_path:
+        for current in stages:
+            if current.approved_only:
+                # Approval may have been withdrawn since the song was loaded
+                song.refresh_from_db(fields=['is_approved'])
+            # Earlier stages can change the answer (e.g. a song flagged as a duplicate)
+            if not force and not current.needs_run(song):
+                continue
+            try:
+                current.func(song, source_path, force=force)
+                results[current.name] = True
+            except Exception:
+                logger.exception("Processing stage %s failed for song %s", current.name, song.pk)
+                results[current.name] = False
+    return results
+
+
+def run_stages(song, names=None, force=False):
+    """
+    Run the stages that are stale for ``song`` (all of them with ``force``).
+    Returns ``{stage name: True/False}`` for the stages that ran.
+
+    One pipeline runs per song at a time, across threads and processes. A
+    run that finds the song busy marks it dirty and returns; the run holding
+    the lock then reloads the song and runs whatever is stale once more, so
+    a save made during processing is never left unprocessed.
+    """
+    from ..models import Song
+
+    stages = [s for s in get_stages(names) if force or s.needs_run(song)]
+    if not stages or not song.audio_file:
+        return {}
+
+    timeout = getattr(settings, 'MEDIA_PROCESSING_LOCK_TIMEOUT', 30 * 60)
+    lock = CacheLock(f'mediaprocessing:{song.pk}', timeout=timeout)
+    dirty_key = f'mediaprocessing:{song.pk}:dirty'
+    # Marked before trying the lock: a holder releasing it right now still sees the mark
+    cache.set(dirty_key, 1, timeout=timeout)
+
+    results = {}
+    while True:
+        if not lock.acquire():
+            logger.info("Song %s is already being processed; it will be processed again after", song.pk)
+            return results
+        try:
+            cache.delete(dirty_key)
+            results.update(_run_locked(song, stages, force))
+        finally:
+            lock.release()
+
+        if not cache.get(dirty_key):
+            return results
+        # Saved while we were running: pick up the saved state
+        try:
+            song = Song.objects.select_related('artist', 'genre').get(pk=song.pk)
+        except Song.DoesNotExist:
+            return results
+        force = False
+        stages = [s for s in get_stages() if s.needs_run(song)]
+        if not stages or not song.audio_file:
+            return results
+
+
+def process_song(song_id, names=None, force=False):
+    """Load a song and run its stages; used by the background pool."""
+    from ..models import Song
+
+    try:
+        song = Song.objects.select_related('artist', 'genre').get(pk=song_id)
+    except Song.DoesNotExist:
+        return {}
+    return run_stages(song, names, force)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Stages mostly wait on ffmpeg subprocesses, so threads are enough
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'MEDIA_PROCESSING_WORKERS', 2),
+                    thread_name_prefix='media-processing',
+                )
+    return _executor
+
+
+# Runs submitted to the pool that have not started yet; a song saved several
+# times in a row is queued once
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def _queue_key(song_id, names, force):
+    return song_id, tuple(sorted(names)) if names else None, force
+
+
+def _process_in_background(song_id, names, force):
+    with _queued_lock:
+        _queued.discard(_queue_key(song_id, names, force))
+    close_old_connections()
+    try:
+        process_song(song_id, names, force)
+    except Exception:
+        logger.exception("Background processing failed for song %s", song_id)
+    finally:
+        connection.close()
+
+
+def _submit(song_id, names, force):
+    key = _queue_key(song_id, names, force)
+    with _queued_lock:
+        if key in _queued:
+            return
+        _queued.add(key)
+    try:
+        get_executor().submit(_process_in_background, song_id, names, force)
+    except Exception:
+        with _queued_lock:
+            _queued.discard(key)
+        raise
+
+
+def schedule(song_id, names=None, force=False):
+    """
+    Process a song on the background pool once the current transaction
+    commits, unless the same run is already queued.
+    """
+    transaction.on_commit(lambda: _submit(song_id, names, force))
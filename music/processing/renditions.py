@@ -0,0 +1,111 @@
+# music/processing/renditions.py
+"""
+Transcoding ladder: one SongRendition per quality tier in AUDIO_RENDITIONS.
+
+Tiers above the quality the artist declared for the upload are skipped, and
+the lossless tier is only produced from a lossless source, so nothing is
+ever "upscaled".
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ffmpeg
+from .registry import stage
+from .sources import save_output
+
+LOSSLESS_EXTENSIONS = {'.wav', '.flac'}
+
+DEFAULT_LADDER = {
+    'standard': {'codec': 'libmp3lame', 'bitrate': 128, 'extension': 'mp3'},
+    'high': {'codec': 'libmp3lame', 'bitrate': 320, 'extension': 'mp3'},
+    'ultra': {'codec': 'flac', 'bitrate': None, 'extension': 'flac'},
+}
+
+
+def ladder():
+    return getattr(settings, 'AUDIO_RENDITIONS', DEFAULT_LADDER)
+
+
+def target_qualities(song):
+    """Quality tiers that should have a rendition for ``song``."""
+    ranks = [quality for quality, _ in song.AUDIO_QUALITY_CHOICES]
+    top = ranks.index(song.audio_quality) if song.audio_quality in ranks else 0
+    lossless_source = os.path.splitext(song.audio_file.name)[1].lower() in LOSSLESS_EXTENSIONS
+    targets = []
+    for quality in ranks[:top + 1]:
+        tier = ladder().get(quality)
+        if tier is None:
+            continue
+        if tier['bitrate'] is None and not lossless_source:
+            continue
+        targets.append(quality)
+    return targets
+
+
+def renditions_stale(song):
+    if not ffmpeg.available():
+        return False
+    # Don't spend transcoding on a probable re-upload until a moderator has looked
+    if song.duplicate_candidates.exclude(status='dismissed').exists():
+        return False
+    current = {
+        r.quality: r.source_name
+        for r in song.renditions.all()
+    }
+    targets = target_qualities(song)
+    if set(current) - set(targets):
+        return True
+    return any(current.get(quality) != song.audio_file.name for quality in targets)
+
+
+@stage('renditions', order=30, is_stale=renditions_stale)
+def transcode_renditions(song, source_path, force=False):
+    from ..models import SongRendition
+
+    targets = target_qualities(song)
+    existing = {r.quality: r for r in song.renditions.all()}
+
+    # Tiers the song no longer qualifies for (e.g. its declared quality dropped)
+    for quality, rendition in existing.items():
+        if quality not in targets:
+            rendition.file.delete(save=False)
+            rendition.delete()
+
+    for quality in targets:
+        rendition = existing.get(quality)
+        if rendition is not None and rendition.source_name == song.audio_file.name and not force:
+            continue
+
+        tier = ladder()[quality]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, f"{song.pk}-{quality}.{tier['extension']}")
+            args = ['-i', source_path, '-map', '0:a:0', '-map_metadata', '-1', '-c:a', tier['codec']]
+            if tier['bitrate']:
+                args += ['-b:a', f"{tier['bitrate']}k"]
+            ffmpeg.run(*args, output)
+
+            # Store the file first, then upsert the row: a concurrent run for
+            # the same song must update the row, not trip UNIQUE(song, quality)
+            output_file = SongRendition(song=song, quality=quality).file
+            save_output(output_file, os.path.basename(output), output, save=False)
+            file_size = os.path.getsize(output)
+
+        with transaction.atomic():
+            current = SongRendition.objects.select_for_update().filter(song=song, quality=quality).first()
+            replaced = current.file.name if current is not None else ''
+            SongRendition.objects.update_or_create(
+                song=song,
+                quality=quality,
+                defaults={
+                    'file': output_file.name,
+                    'codec': tier['codec'],
+                    'bitrate': tier['bitrate'],
+                    'file_size': file_size,
+                    'source_name': song.audio_file.name,
+                },
+            )
+        if replaced and replaced != output_file.name:
+            output_file.storage.delete(replaced)
@@ -0,0 +1,36 @@
+# music/processing/sources.py
+"""Local filesystem access to stored media, whatever the storage backend."""
+import contextlib
+import os
+import shutil
+import tempfile
+
+from django.core.files import File
+
+
+@contextlib.contextmanager
+def local_audio(field_file):
+    """
+    Yield a local path for ``field_file``. Files in remote storage (e.g.
+    Cloudinary) are downloaded to a temporary file for the duration.
+    """
+    try:
+        path = field_file.path
+    except (NotImplementedError, ValueError):
+        path = None
+    if path and os.path.exists(path):
+        yield path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as temp:
+        with field_file.open('rb') as source:
+            shutil.copyfileobj(source, temp)
+        temp.flush()
+        yield temp.name
+
+
+def save_output(field_file, name, path, save=True):
+    """Store the local file at ``path`` in ``field_file`` under ``name``."""
+    with open(path, 'rb') as output:
+        field_file.save(name, File(output), save=save)
@@ -0,0 +1,76 @@
+# music/processing/waveform.py
+"""
+Waveform peaks: decode the song once with ffmpeg to low-rate mono PCM and
+keep the min/max of each of ``WAVEFORM_BUCKETS`` equal slices as uint8.
+1000 buckets is a 2KB blob, small enough to fetch before playback starts.
+"""
+import array
+
+from django.conf import settings
+
+from . import ffmpeg
+from .registry import stage
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+def waveform_stale(song):
+    from ..models import SongWaveform
+
+    if not ffmpeg.available():
+        return False
+    # A changed WAVEFORM_BUCKETS recomputes the peaks (and so changes their URL)
+    return not SongWaveform.objects.filter(
+        song=song, source_name=song.audio_file.name, buckets=getattr(settings, 'WAVEFORM_BUCKETS', 1000),
+    ).exists()
+
+
+def _to_uint8(value):
+    return (value + 32768) >> 8
+
+
+def compute_peaks(pcm, buckets):
+    """Interleaved uint8 (min, max) pairs for signed 16-bit little-endian ``pcm``."""
+    if HAS_NUMPY:
+        samples = np.frombuffer(pcm, dtype='<i2')
+        if not len(samples):
+            return b'', 0
+        # Fewer samples than buckets repeat samples, so the count stays as configured
+        edges = np.linspace(0, len(samples), buckets + 1).astype(np.int64)[:-1]
+        mins = np.minimum.reduceat(samples, edges).astype(np.int32)
+        maxs = np.maximum.reduceat(samples, edges).astype(np.int32)
+        pairs = np.column_stack((_to_uint8(mins), _to_uint8(maxs))).astype(np.uint8)
+        return pairs.tobytes(), buckets
+
+    samples = array.array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if array.array('h', [1]).tobytes() != b'\x01\x00':
+        samples.byteswap()  # big-endian host
+    if not samples:
+        return b'', 0
+    peaks = bytearray()
+    for index in range(buckets):
+        start = len(samples) * index // buckets
+        chunk = samples[start:max(len(samples) * (index + 1) // buckets, start + 1)]
+        peaks.append(_to_uint8(min(chunk)))
+        peaks.append(_to_uint8(max(chunk)))
+    return bytes(peaks), buckets
+
+
+@stage('waveform', order=50, is_stale=waveform_stale)
+def build_waveform(song, source_path, force=False):
+    from ..models import SongWaveform
+
+    pcm = ffmpeg.decode_pcm(source_path, getattr(settings, 'WAVEFORM_SAMPLE_RATE', 8000))
+    peaks, buckets = compute_peaks(pcm, getattr(settings, 'WAVEFORM_BUCKETS', 1000))
+    waveform, _ = SongWaveform.objects.update_or_create(
+        song=song,
+        defaults={'peaks': peaks, 'buckets': buckets, 'source_name': song.audio_file.name},
+    )
+    # Keep the song's cached relation and versioned URL in step with the new peaks
+    song.waveform = waveform
+    song.__dict__.pop('waveform_url', None)
@@ -1,8 +1,14 @@
 # music/signals.py
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Song
+from artists.models import Artist
+from .models import Genre, Song, SongRendition
+from . import artifacts, fulltext, genre_stats, leaderboards, processing, trending
+from .counters import counters_flushed
+from .ingest import events_flushed
 
 @receiver(post_save, sender=Song)
 def update_artist_profile(sender, instance, created, **kwargs):
@@ -22,4 +28,177 @@ def update_artist_profile(sender, instance, created, **kwargs):
                     genre=instance.genre
                 )
         except Exception as e:
-            print(f"Error in song post_save signal: {e}")
\ No newline at end of file
+            print(f"Error in song post_save signal: {e}")
+
+
+@receiver(post_save, sender=Song)
+def refresh_branded_artifacts(sender, instance, **kwargs):
+    """Drop cached branded downloads that no longer match the song"""
+    try:
+        artifacts.refresh_song(instance)
+    except Exception as e:
+        print(f"Error refreshing branded artifacts for song {instance.pk}: {e}")
+
+
+# Saves that can change what the processing pipeline produces
+PROCESSING_FIELDS = {'audio_file', 'audio_quality', 'is_approved', 'is_premium_only', 'preview_duration'}
+
+
+@receiver(post_save, sender=Song)
+def schedule_media_processing(sender, instance, created, update_fields=None, **kwargs):
+    """Transcode and analyse uploads in the background; stages skip work that is up to date"""
+    if not getattr(settings, 'MEDIA_PROCESSING_ON_UPLOAD', True):
+        return
+    if update_fields is not None and not PROCESSING_FIELDS.intersection(update_fields):
+        return
+    processing.schedule(instance.pk)
+
+
+@receiver(post_delete, sender=SongRendition)
+def delete_rendition_file(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
+
+
+@receiver(post_delete, sender=Song)
+def delete_branded_artifacts(sender, instance, **kwargs):
+    artifacts.get_store().invalidate(instance.pk)
+
+
+# Saves that can move a song in or out of its genre's totals
+GENRE_STATS_FIELDS = {'is_approved', 'genre'}
+
+
+@receiver(counters_flushed)
+def update_genre_play_totals(sender, deltas, **kwargs):
+    try:
+        genre_stats.add_counter_deltas(deltas)
+    except Exception as e:
+        # `manage.py refresh_genre_stats` recounts from the songs
+        print(f"Error updating genre stats after counter flush: {e}")
+
+
+@receiver(pre_save, sender=Song)
+def remember_song_genre(sender, instance, update_fields=None, **kwargs):
+    """Note the stored genre and approval, so a save recounts the genres it moved the song between"""
+    instance._old_genre_stats = None
+    if instance.pk is None or (update_fields is not None and not GENRE_STATS_FIELDS.intersection(update_fields)):
+        return
+    # Songs read from the database carry them already (Song.from_db)
+    stored = getattr(instance, '_stored_genre_stats', None)
+    if stored is None:
+        stored = Song.objects.filter(pk=instance.pk).values_list('genre_id', 'is_approved').first()
+    instance._old_genre_stats = stored
+
+
+@receiver(post_save, sender=Song)
+def refresh_genre_stats(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not GENRE_STATS_FIELDS.intersection(update_fields):
+        return
+    old = getattr(instance, '_old_genre_stats', None) or (None, False)
+    saved = GENRE_STATS_FIELDS if update_fields is None else update_fields
+    new = (
+        instance.genre_id if 'genre' in saved else old[0],
+        instance.is_approved if 'is_approved' in saved else old[1],
+    )
+    instance._stored_genre_stats = new
+    if new == old:
+        return
+    # Totals count approved songs only
+    genre_ids = {genre_id for genre_id, approved in (old, new) if approved} - {None}
+    if genre_ids:
+        genre_stats.refresh(sorted(genre_ids))
+
+
+@receiver(post_delete, sender=Song)
+def refresh_genre_stats_on_delete(sender, instance, **kwargs):
+    if instance.genre_id:
+        genre_stats.refresh([instance.genre_id], create=False)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genre_stats(sender, **kwargs):
+    genre_stats.invalidate()
+
+
+# Saves that can change where a song ranks
+LEADERBOARD_FIELDS = {'is_approved', 'genre', 'artist', 'plays', 'downloads'}
+
+
+@receiver(counters_flushed)
+def update_leaderboards(sender, deltas, **kwargs):
+    try:
+        leaderboards.record(deltas)
+    except Exception as e:
+        # Boards are reloaded from the database periodically, so this only delays the update
+        print(f"Error updating leaderboards after counter flush: {e}")
+
+
+@receiver(post_save, sender=Song)
+def rerank_song(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not LEADERBOARD_FIELDS.intersection(update_fields):
+        return
+    try:
+        leaderboards.record([instance.pk])
+    except Exception as e:
+        print(f"Error updating leaderboards for song {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Song)
+def unrank_song(sender, instance, **kwargs):
+    try:
+        leaderboards.forget(instance)
+    except Exception as e:
+        print(f"Error updating leaderboards for song {instance.pk}: {e}")
+
+
+@receiver(events_flushed)
+def update_trending(sender, plays=(), downloads=(), **kwargs):
+    try:
+        trending.record(plays, downloads)
+    except Exception as e:
+        # `manage.py rebuild_trending` reloads the day and week windows from the rollups
+        print(f"Error updating trending after event flush: {e}")
+
+
+# Saves that change a song's search document
+SEARCH_FIELDS = {'title', 'lyrics', 'is_approved', 'artist', 'genre'}
+
+
+def _update_search_index(update, description):
+    # A savepoint, so a failed index write cannot abort the caller's transaction
+    try:
+        with transaction.atomic():
+            update()
+    except Exception as e:
+        print(f"Error updating the search index for {description}: {e}")
+
+
+@receiver(post_save, sender=Song)
+def index_song(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    _update_search_index(lambda: fulltext.index_song(instance), f"song {instance.pk}")
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Genre)
+def index_artist_or_genre(sender, instance, created, **kwargs):
+    """Artist and genre names are part of their songs' documents too"""
+    kind = 'artist' if sender is Artist else 'genre'
+
+    def update():
+        fulltext.index(kind, fulltext.indexable(kind).filter(pk=instance.pk))
+        if not created:
+            fulltext.index('song', fulltext.indexable('song').filter(**{kind: instance}))
+
+    _update_search_index(update, f"{kind} {instance.pk}")
+
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Genre)
+def unindex(sender, instance, **kwargs):
+    kind = {Song: 'song', Artist: 'artist', Genre: 'genre'}[sender]
+    _update_search_index(lambda: fulltext.remove(kind, [instance.pk]), f"{kind} {instance.pk}")
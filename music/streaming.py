@@ -0,0 +1,191 @@
+# music/streaming.py
+"""
+Helpers for serving audio with HTTP Range support.
+
+The stream view checks ``Song.can_be_accessed_by`` once, when the player asks
+for the song, and hands out a signed stream URL. Every range request the
+browser then makes while seeking only verifies the signature.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+
+STREAM_TOKEN_SALT = 'music.streaming'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangedFile:
+    """
+    File wrapper that yields ``length`` bytes starting at ``start``.
+
+    ``fileno()`` is passed through, so under gunicorn the range is sent with
+    ``sendfile`` (the server uses the current offset and Content-Length).
+    There is deliberately no ``tell``/``seek`` so FileResponse does not try to
+    compute its own Content-Length for the whole file.
+    """
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def _token_value(song_id, user, quality=''):
+    user_id = user.pk if user is not None and user.is_authenticated else 0
+    value = f'{song_id}:{user_id}'
+    return f'{value}:{quality}' if quality else value
+
+
+def make_stream_token(song, user, quality=''):
+    return signing.TimestampSigner(salt=STREAM_TOKEN_SALT).sign(_token_value(song.pk, user, quality))
+
+
+def check_stream_token(token, song_id, user, quality=''):
+    """True if ``token`` was issued for this song, user and quality tier and has not expired."""
+    if not token:
+        return False
+    try:
+        value = signing.TimestampSigner(salt=STREAM_TOKEN_SALT).unsign(
+            token, max_age=getattr(settings, 'AUDIO_STREAM_TOKEN_MAX_AGE', 6 * 60 * 60)
+        )
+    except signing.BadSignature:
+        return False
+    return value == _token_value(song_id, user, quality)
+
+
+def stream_url(song, user, quality=''):
+    """Signed URL for the range-aware stream view, optionally for one rendition tier."""
+    url = f"{reverse('stream_song', args=[song.pk])}?t={make_stream_token(song, user, quality)}"
+    return f"{url}&q={quality}" if quality else url
+
+
+def hls_url(song, user):
+    """Signed master playlist URL, or None until the song has been packaged."""
+    from .processing import hls
+
+    if not song.audio_file or not hls.is_packaged(song):
+        return None
+    return f"{reverse('hls_master', args=[song.pk])}?t={make_stream_token(song, user, 'hls')}"
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Returns ``(start, end)`` inclusive, ``None`` when the header should be
+    ignored (absent, malformed or multi-range) and ``False`` when it is
+    unsatisfiable.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def if_range_matches(header, etag, stat):
+    """True if there is no If-Range header or it still matches the file."""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        return header == etag
+    try:
+        return int(parsedate_to_datetime(header).timestamp()) == int(stat.st_mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def local_path(field_file):
+    """Filesystem path of a FileField, or None for remote storage."""
+    try:
+        path = field_file.path
+    except (NotImplementedError, ValueError):
+        return None
+    return path if os.path.exists(path) else None
+
+
+def serve_file(request, path, content_type=None, filename=None):
+    """
+    Respond with the file at ``path``, honouring Range, If-Range and
+    If-None-Match. ``filename`` makes it an attachment download.
+    """
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    if if_range_matches(request.headers.get('If-Range'), etag, stat):
+        byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    fileobj = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(fileobj, content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangedFile(fileobj, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = length
+
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.block_size = getattr(settings, 'AUDIO_STREAM_CHUNK_SIZE', 64 * 1024)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
@@ -1,3 +1,1329 @@
-from django.test import TestCase
+import io
+import concurrent.futures
+import glob
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import wave
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from analytics import rollups
+from analytics.models import SongRollup
+from artists import stats as artist_stats
+from artists.models import Artist
+
+from . import (
+    artifacts, branding, charts, counters, fulltext, genre_stats, hotness, ingest, jobs, leaderboards, offload,
+    streaming, trending,
+)
+from .admin import DuplicateCandidateAdmin
+from .management.commands import prebrand_songs
+from .cachelock import CacheLock
+from .models import AudioFingerprint, Chart, ChartEntry, ChartSnapshot, DuplicateCandidate, Genre, GenreStats, Song, SongPlay, SongRendition, SongWaveform
+from .processing import analysis, ffmpeg, fingerprint, hls, metadata, preview, registry, renditions, waveform
+
+# The default cache is Redis; tests run against an in-process cache
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def mp3_bytes(frames=40):
+    """Silent MPEG-1 layer III frames (128 kbps, 44.1 kHz)"""
+    return (b'\xff\xfb\x90\x64' + bytes(413)) * frames
+
+
+def wav_bytes(samples=800):
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(8000)
+        audio.writeframes(bytes(2 * samples))
+    return output.getvalue()
+
+
+def make_song(title='Song', artist=None, genre=None, **fields):
+    if artist is None:
+        user = User.objects.create_user(f'artist-{User.objects.count()}', password='x')
+        artist = Artist.objects.create(user=user, name=f'{title} Artist')
+    fields.setdefault('is_approved', True)
+    fields.setdefault('audio_file', f'songs/{title}.mp3')
+    return Song.objects.create(title=title, artist=artist, genre=genre, **fields)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MEDIA_PROCESSING_ON_UPLOAD=False, SECURE_SSL_REDIRECT=False)
+class MusicTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Views feed the process-wide buffers; give each test its own, never
+        # flushed in the background or at exit
+        self.temp_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_root, ignore_errors=True)
+        spool_dir = os.path.join(self.temp_root, 'spool')
+        # Nothing a test builds lands in the project's var/ or media/
+        override = self.settings(
+            BRANDED_COVER_CACHE_ROOT=os.path.join(self.temp_root, 'covers'),
+            BRANDED_DOWNLOAD_ROOT=os.path.join(self.temp_root, 'branded'),
+            HLS_ROOT=os.path.join(self.temp_root, 'hls'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        for module, name, value in (
+            (counters, '_buffer', counters.CounterBuffer(counters.MemoryCounterBackend(), 3600, 10 ** 6)),
+            (ingest, '_queue', ingest.EventQueue(spool_dir, 10 ** 6, 3600)),
+            (leaderboards, '_backend', leaderboards.MemoryLeaderboardBackend(100, 3600)),
+        ):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class CounterBufferTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.genre = Genre.objects.create(name='Afrobeat')
+        self.song = make_song('One', genre=self.genre)
+        self.other = make_song('Two', genre=self.genre)
+
+    def buffer(self, backend):
+        return counters.CounterBuffer(backend, flush_interval=3600, max_pending=10 ** 6)
+
+    def test_flush_writes_batched_deltas(self):
+        buffer = self.buffer(counters.MemoryCounterBackend())
+        for _ in range(3):
+            buffer.add(self.song.pk, 'plays')
+        buffer.add(self.other.pk, 'downloads', 2)
+        self.assertEqual(buffer.pending(self.song.pk), {'plays': 3, 'downloads': 0})
+
+        sent = []
+        counters.counters_flushed.connect(lambda sender, deltas, **kwargs: sent.append(deltas), weak=False)
+        try:
+            self.assertEqual(buffer.flush(), 2)
+        finally:
+            counters.counters_flushed.receivers.pop()
+        self.song.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.song.plays, self.other.downloads), (3, 2))
+        self.assertEqual(sent, [{self.song.pk: {'plays': 3, 'downloads': 0},
+                                 self.other.pk: {'plays': 0, 'downloads': 2}}])
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_cache_backend_drains_deltas_of_another_worker(self):
+        dead_worker = counters.CacheCounterBackend()
+        dead_worker.add(self.song.pk, 'plays', 4)
+
+        # A different process (own backend instance) picks the deltas up
+        buffer = self.buffer(counters.CacheCounterBackend())
+        self.assertEqual(buffer.flush(), 1)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.plays, 4)
+        self.assertEqual(dead_worker.pending(self.song.pk), {'plays': 0, 'downloads': 0})
+
+    def test_cache_backend_never_drains_twice(self):
+        first, second = counters.CacheCounterBackend(), counters.CacheCounterBackend()
+        first.add(self.song.pk, 'plays', 3)
+        second.add(self.song.pk, 'plays', 2)
+        drained = [first.drain(), second.drain()]
+        self.assertEqual(drained, [{self.song.pk: {'plays': 5, 'downloads': 0}}, {}])
+
+    def test_cache_backend_keeps_increments_made_during_drain(self):
+        backend = counters.CacheCounterBackend()
+        backend.add(self.song.pk, 'plays', 3)
+        pending = backend.pending
+
+        def pending_then_increment(song_id):
+            counts = pending(song_id)
+            backend.add(song_id, 'plays', 1)
+            return counts
+
+        backend.pending = pending_then_increment
+        self.assertEqual(backend.drain(), {self.song.pk: {'plays': 3, 'downloads': 0}})
+        backend.pending = pending
+        self.assertEqual(backend.drain(), {self.song.pk: {'plays': 1, 'downloads': 0}})
+
+    def test_failed_flush_restores_deltas(self):
+        buffer = self.buffer(counters.CacheCounterBackend())
+        buffer.add(self.song.pk, 'plays', 2)
+        with mock.patch.object(Song.objects, 'filter', side_effect=DatabaseError('down')):
+            with self.assertLogs('music.counters', 'ERROR'):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending(self.song.pk)['plays'], 2)
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_restore_does_not_count_deltas_twice(self):
+        memory = counters.MemoryCounterBackend()
+        memory.add(self.song.pk, 'plays', 2)
+        deltas = memory.drain()
+        memory.add(self.other.pk, 'plays', 1)
+        memory.restore(deltas)
+        self.assertEqual(memory.add(self.other.pk, 'downloads', 1), 4)
+
+        shared = counters.CacheCounterBackend()
+        shared.add(self.song.pk, 'plays', 5)
+        shared.restore(shared.drain())
+        self.assertEqual(shared.add(self.song.pk, 'plays', 1), 1)
+        self.assertEqual(shared.pending(self.song.pk)['plays'], 6)
+        self.assertEqual(shared.drain(), {self.song.pk: {'plays': 6, 'downloads': 0}})
+
+
+class EventSpoolTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        self.song = make_song('Spooled')
+
+    def queue(self):
+        return ingest.EventQueue(self.spool_dir, batch_size=10 ** 6, flush_interval=3600, lease=60)
+
+    def play(self, token):
+        return {'kind': 'play', 'song_id': self.song.pk, 'play_token': token, 'duration_played': 0,
+                'played_at': '2026-01-01T10:00:00+00:00', 'audio_quality': 'standard'}
+
+    def expire_lease(self, queue):
+        stale = time.time() - 3600
+        os.utime(queue._lease_path(queue.owner), (stale, stale))
+
+    def test_spool_of_dead_worker_is_replayed(self):
+        dead = self.queue()
+        dead.put(self.play('a'))
+        dead.update_pending_play('a', duration_played=42)
+        self.expire_lease(dead)
+
+        self.assertEqual(self.queue().flush(), 1)
+        play = SongPlay.objects.get(play_token='a')
+        self.assertEqual(play.duration_played, 42)
+        # Only the live worker's lease is left
+        self.assertEqual([name.split('-')[0] for name in os.listdir(self.spool_dir)], ['lease'])
+
+    def test_spool_of_live_worker_is_left_alone(self):
+        live = self.queue()
+        live.put(self.play('a'))
+        self.assertEqual(self.queue().flush(), 0)
+        self.assertEqual(live.flush(), 1)
+
+    def test_restarted_worker_with_same_pid_does_not_take_over_live_spool(self):
+        first, second = self.queue(), self.queue()
+        first.put(self.play('a'))
+        # Same PID, different owner id
+        self.assertNotEqual(first.owner, second.owner)
+        self.assertEqual(second.flush(), 0)
+        self.assertFalse(SongPlay.objects.exists())
+
+    def test_update_during_flush_waits_for_the_write(self):
+        queue = self.queue()
+        queue.put(self.play('a'))
+        results = []
+        bulk_create = SongPlay.objects.bulk_create
+
+        def slow_bulk_create(*args, **kwargs):
+            updater = threading.Thread(
+                target=lambda: results.append(queue.update_pending_play('a', duration_played=30))
+            )
+            updater.start()
+            time.sleep(0.2)
+            self.assertEqual(results, [])  # still waiting on the flush
+            self.updater = updater
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(SongPlay.objects, 'bulk_create', side_effect=slow_bulk_create):
+            self.assertEqual(queue.flush(), 1)
+        self.updater.join(5)
+        # Not queued any more: the caller now finds the play in the database
+        self.assertEqual(results, [False])
+        self.assertTrue(SongPlay.objects.filter(play_token='a').exists())
+
+    def test_failed_flush_keeps_plays_updatable(self):
+        queue = self.queue()
+        queue.put(self.play('a'))
+        with mock.patch.object(SongPlay.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertLogs('music.ingest', 'ERROR'):
+                self.assertEqual(queue.flush(), 0)
+        self.assertTrue(queue.update_pending_play('a', duration_played=55))
+        self.assertEqual(queue.flush(), 1)
+        self.assertEqual(SongPlay.objects.get(play_token='a').duration_played, 55)
+
+    def test_update_replayed_from_a_file_listed_before_its_play(self):
+        queue = self.queue()
+        queue.put(self.play('a'))
+        with mock.patch.object(SongPlay.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertLogs('music.ingest', 'ERROR'):
+                queue.flush()
+                queue.update_pending_play('a', duration_played=55)
+                queue.flush()
+        # Two .flushing files now; hand them over newest first
+        listing = glob.glob
+        with mock.patch.object(ingest.glob, 'glob', side_effect=lambda pattern: sorted(listing(pattern), reverse=True)):
+            self.assertEqual(queue.flush(), 1)
+        self.assertEqual(SongPlay.objects.get(play_token='a').duration_played, 55)
+
+
+class TrackEventsTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = make_song('Tracked', duration=200)
+        self.user = User.objects.create_user('listener', password='x')
+        self.client.force_login(self.user)
+
+    def post(self, *events, raw=None, flush=True):
+        body = raw if raw is not None else json.dumps({'events': list(events)})
+        response = self.client.post(reverse('api_track_events'), body, content_type='application/json')
+        if flush:
+            ingest.flush()
+        return response
+
+    def play(self, **fields):
+        return dict({'type': 'play', 'song_id': self.song.pk}, **fields)
+
+    def test_overflowing_numbers_are_rejected(self):
+        for event in ('{"type": "play", "song_id": %d, "duration_played": Infinity}' % self.song.pk,
+                      '{"type": "play", "song_id": Infinity}',
+                      '{"type": "play", "song_id": %d, "timestamp": 1e20}' % self.song.pk,
+                      '{"type": "play", "song_id": %d, "duration_played": NaN}' % self.song.pk):
+            response = self.post(raw='{"events": [%s]}' % event)
+            self.assertEqual(response.status_code, 200, event)
+            self.assertEqual(response.json()['accepted'], 0, event)
+        self.assertFalse(SongPlay.objects.exists())
+
+    def test_duration_is_capped_to_the_song(self):
+        self.post(self.play(play_id='abc', duration_played=10 ** 6))
+        self.assertEqual(SongPlay.objects.get(play_token='abc').duration_played, 200)
+        self.post({'type': 'progress', 'play_id': 'abc', 'duration_played': 10 ** 9})
+        self.assertEqual(SongPlay.objects.get(play_token='abc').duration_played, 200)
+
+    def test_old_timestamps_are_clamped(self):
+        self.post(self.play(play_id='old', timestamp=0))
+        played_at = SongPlay.objects.get(play_token='old').played_at
+        self.assertGreater(played_at, timezone.now() - timedelta(days=1, minutes=1))
+
+    def test_play_id_must_be_ascii_alphanumeric(self):
+        response = self.post(self.play(play_id='\u00b2\u0663'), self.play(play_id='x' * 33), self.play(play_id=['a']))
+        self.assertEqual([row['error'] for row in response.json()['rejected']], ['Invalid play_id'] * 3)
+
+    def test_retried_batch_counts_the_play_once(self):
+        self.post(self.play(play_id='again'))
+        self.post(self.play(play_id='again', duration_played=50))
+        play = SongPlay.objects.get(play_token='again')
+        self.assertEqual(play.duration_played, 50)
+
+        # Retried while the first attempt is still queued
+        self.post(self.play(play_id='queued'), flush=False)
+        self.post(self.play(play_id='queued', duration_played=70), flush=False)
+        ingest.flush()
+        self.assertEqual(SongPlay.objects.get(play_token='queued').duration_played, 70)
+        self.assertEqual(counters.pending_counts(self.song)['plays'], 2)
+
+    def test_dedupe_migration_leaves_anonymous_plays(self):
+        for _ in range(2):
+            SongPlay.objects.create(song=self.song, play_token='shared')
+        migration = importlib.import_module('music.migrations.0018_songplay_unique_play_token')
+        migration.drop_duplicate_plays(apps, None)
+        self.assertEqual(SongPlay.objects.filter(play_token='shared').count(), 2)
+
+    def test_plays_are_queued_with_the_stream_quality(self):
+        # A premium listener of a song only transcoded to 'standard' hears 'standard'
+        self.user.userprofile.premium_plan = 'premium'
+        self.user.userprofile.save()
+        self.assertEqual(Song.stream_quality_for(self.user), 'high')
+        SongRendition.objects.create(song=self.song, quality='standard', file='renditions/tracked.mp3')
+        self.post(self.play(play_id='q1'), flush=False)
+        self.assertFalse(SongPlay.objects.exists())
+        ingest.flush()
+        self.assertEqual(SongPlay.objects.get(play_token='q1').audio_quality, 'standard')
+
+
+class RangeRequestTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.temp_root, 'song.mp3')
+        self.data = bytes(range(256)) * 4
+        with open(self.path, 'wb') as output:
+            output.write(self.data)
+
+    def serve(self, **headers):
+        request = RequestFactory().get('/', headers=headers)
+        return streaming.serve_file(request, self.path, content_type='audio/mpeg')
+
+    def test_whole_file_advertises_ranges(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], streaming.file_etag(os.stat(self.path)))
+
+    def test_byte_ranges(self):
+        response = self.serve(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.serve(Range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+        response = self.serve(Range='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[1000:])
+
+        response = self.serve(Range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_stream_view_serves_approved_songs_only(self):
+        os.makedirs(os.path.join(self.temp_root, 'songs'))
+        shutil.copy(self.path, os.path.join(self.temp_root, 'songs', 'Live.mp3'))
+        with self.settings(MEDIA_ROOT=self.temp_root):
+            live = make_song('Live')
+            pending = make_song('Pending', audio_file='songs/Live.mp3', is_approved=False)
+            response = self.client.get(reverse('stream_song', args=[live.pk]), HTTP_RANGE='bytes=0-9')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(self.client.get(reverse('stream_song', args=[pending.pk])).status_code, 404)
+
+    def test_etag_validators(self):
+        etag = self.serve()['ETag']
+        self.assertEqual(self.serve(**{'If-None-Match': etag}).status_code, 304)
+        # A range of a file that changed since is answered with the whole file
+        response = self.serve(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.serve(Range='bytes=0-9', **{'If-Range': etag}).status_code, 206)
+
+
+class OffloadTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.temp_root, 'songs'))
+        self.path = os.path.join(self.temp_root, 'songs', 'Live.mp3')
+        self.data = bytes(range(256)) * 4
+        with open(self.path, 'wb') as output:
+            output.write(self.data)
+        override = self.settings(MEDIA_ROOT=self.temp_root,
+                                 AUDIO_OFFLOAD_LOCATIONS={self.temp_root: '/protected/media/'})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = reverse('stream_song', args=[make_song('Live').pk])
+
+    def test_nginx_mode_sends_an_internal_redirect(self):
+        with self.settings(AUDIO_OFFLOAD_MODE='nginx', AUDIO_OFFLOAD_STAND_IN=False):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+            self.assertIsNone(offload.offload_response(os.path.join(tempfile.gettempdir(), 'elsewhere.mp3')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/media/songs/Live.mp3')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        self.assertIsNone(offload.resolve_internal_uri('/protected/media/../../etc/passwd'))
+
+    def test_apache_mode_sends_the_file_path(self):
+        with self.settings(AUDIO_OFFLOAD_MODE='apache', AUDIO_OFFLOAD_STAND_IN=False):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.realpath(self.path))
+        self.assertEqual(response.content, b'')
+
+    def test_without_offload_django_streams_the_file(self):
+        with self.settings(AUDIO_OFFLOAD_MODE=None, AUDIO_OFFLOAD_STAND_IN=False):
+            self.assertIsNone(offload.offload_response(self.path))
+            response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[:10])
+        self.assertFalse(response.has_header('X-Accel-Redirect'))
+
+    def test_stand_in_serves_offloaded_responses(self):
+        for mode in ('nginx', 'apache'):
+            self.client = self.client_class()
+            with self.settings(AUDIO_OFFLOAD_MODE=mode, AUDIO_OFFLOAD_STAND_IN=True):
+                response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+            self.assertEqual(response.status_code, 206, mode)
+            self.assertEqual(b''.join(response.streaming_content), self.data[10:20], mode)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=86400', mode)
+
+    def test_stand_in_is_dropped_from_the_stack_when_off(self):
+        with self.settings(AUDIO_OFFLOAD_STAND_IN=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                offload.OffloadStandInMiddleware(lambda request: None)
+        with self.settings(AUDIO_OFFLOAD_STAND_IN=True):
+            middleware = offload.OffloadStandInMiddleware(
+                lambda request: offload.offload_response(os.path.join(self.temp_root, 'gone.mp3')))
+            with self.settings(AUDIO_OFFLOAD_MODE='nginx'):
+                self.assertEqual(middleware(RequestFactory().get('/')).status_code, 404)
+
+
+class BrandingTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def spec(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as audio:
+            audio.write(data)
+        return branding.BrandingSpec(song_id=1, title='Title', artist='Artist', genre='', audio_path=path)
+
+    def build(self, spec):
+        output = os.path.join(self.root, 'out')
+        branding.build_branded_file(spec, output)
+        with open(output, 'rb') as built:
+            return built.read()
+
+    def test_mp3_gets_id3_tag(self):
+        spec = self.spec('song.mp3', mp3_bytes())
+        built = self.build(spec)
+        self.assertTrue(built.startswith(b'ID3'))
+        self.assertTrue(built.endswith(mp3_bytes()))
+        self.assertEqual((spec.download_filename, spec.content_type), ('Sangabiz - Title - Artist.mp3', 'audio/mpeg'))
+
+    def test_other_formats_are_served_unchanged(self):
+        for name in ('song.wav', 'misnamed.mp3'):
+            spec = self.spec(name, wav_bytes())
+            self.assertFalse(spec.is_mp3, name)
+            self.assertEqual(self.build(spec), wav_bytes(), name)
+            stream, length = branding.open_branded_stream(spec)
+            self.assertEqual(b''.join(stream), wav_bytes(), name)
+            self.assertEqual(length, len(wav_bytes()), name)
+        self.assertTrue(self.spec('song.wav', wav_bytes()).download_filename.endswith('.wav'))
+
+
+class ArtifactStoreTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.store = artifacts.ArtifactStore(os.path.join(self.root, 'branded'), 250)
+        self.audio_path = os.path.join(self.root, 'song.mp3')
+        with open(self.audio_path, 'wb') as audio:
+            audio.write(mp3_bytes())
+
+    def spec(self, song_id=1, artist='A'):
+        return branding.BrandingSpec(song_id=song_id, title='T', artist=artist, genre='', audio_path=self.audio_path)
+
+    @staticmethod
+    def builder(spec, output):
+        with open(output, 'wb') as built:
+            built.write(bytes(100))
+
+    def test_renamed_artist_misses_and_the_rebuild_drops_the_old_file(self):
+        old_path = self.store.get_or_build(self.spec(), self.builder)
+        self.assertIsNone(self.store.get(self.spec(artist='B')))
+        new_path = self.store.get_or_build(self.spec(artist='B'), self.builder)
+        self.assertNotEqual(new_path, old_path)
+        self.assertEqual(os.listdir(self.store.song_dir(1)), [os.path.basename(new_path)])
+
+    def test_replaced_audio_file_changes_the_key(self):
+        key = artifacts.artifact_key(self.spec())
+        with open(self.audio_path, 'ab') as audio:
+            audio.write(mp3_bytes())
+        self.assertNotEqual(artifacts.artifact_key(self.spec()), key)
+
+    def test_least_recently_used_artifact_is_evicted(self):
+        first = self.store.get_or_build(self.spec(song_id=1), self.builder)
+        second = self.store.get_or_build(self.spec(song_id=2), self.builder)
+        os.utime(second, ns=(1, os.stat(second).st_mtime_ns))
+        self.store.get(self.spec(song_id=1))
+        third = self.store.get_or_build(self.spec(song_id=3), self.builder)
+        self.assertEqual([os.path.exists(path) for path in (first, second, third)], [True, False, True])
+        self.assertEqual(self.store.size(), 200)
+
+
+class BrandingJobTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        store = artifacts.ArtifactStore(os.path.join(root, 'branded'), 10 ** 9)
+        patcher = mock.patch.object(artifacts, '_store', store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        audio_path = os.path.join(root, 'song.mp3')
+        with open(audio_path, 'wb') as audio:
+            audio.write(mp3_bytes())
+        self.spec = branding.BrandingSpec(song_id=1, title='T', artist='A', genre='', audio_path=audio_path)
+        self.job_id = artifacts.artifact_key(self.spec)
+        self.executor = mock.Mock()
+        self.executor.submit.return_value = concurrent.futures.Future()
+        patcher = mock.patch.object(jobs, 'get_executor', return_value=self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_evicted_artifact_is_rebuilt(self):
+        jobs._set_state(self.job_id, status=jobs.READY, song_id=1)
+        self.assertEqual(jobs.job_status(self.job_id, self.spec)['status'], jobs.PENDING)
+        self.assertEqual(self.executor.submit.call_count, 1)
+
+    def test_existing_artifact_is_ready(self):
+        artifacts.get_store().get_or_build(self.spec)
+        self.assertEqual(jobs.job_status(self.job_id, self.spec), {'status': jobs.READY})
+        self.executor.submit.assert_not_called()
+
+    def test_status_view_answers_at_once(self):
+        with self.settings(MEDIA_ROOT=os.path.dirname(self.spec.audio_path)):
+            song = make_song('Job', audio_file='song.mp3')
+            self.client.force_login(User.objects.create_user('downloader', password='x'))
+            job_id = jobs.submit_branding(branding.BrandingSpec.for_song(song))
+            started = time.monotonic()
+            response = self.client.get(reverse('download_job_status', args=[song.pk, job_id]), {'wait': 20})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response.json()['status'], jobs.PENDING)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class InlineExecutor:
+    """Runs a job only when the command waits for one, so every other submitted job stays in flight"""
+
+    def __init__(self):
+        self.jobs = []
+        self.max_in_flight = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.jobs.append((future, fn, args))
+        self.max_in_flight = max(self.max_in_flight, len(self.jobs))
+        return future
+
+    def wait(self, futures, return_when=None):
+        future, fn, args = self.jobs.pop(0)
+        future.set_result(fn(*args))
+        return {future}, set(futures) - {future}
+
+
+class PrebrandCommandTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        store = artifacts.ArtifactStore(os.path.join(self.temp_root, 'branded'), 10 ** 9)
+        self.executor = InlineExecutor()
+        for target, name, value in (
+            (artifacts, '_store', store),
+            (concurrent.futures, 'ProcessPoolExecutor', mock.Mock(return_value=self.executor)),
+            (concurrent.futures, 'wait', self.executor.wait),
+            # The command closes connections before forking; keep the test's transaction open
+            (prebrand_songs, 'connections', mock.Mock()),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.makedirs(os.path.join(self.temp_root, 'songs'))
+        override = self.settings(MEDIA_ROOT=self.temp_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.songs = []
+        for index in range(6):
+            with open(os.path.join(self.temp_root, 'songs', f'{index}.mp3'), 'wb') as audio:
+                audio.write(mp3_bytes())
+            self.songs.append(make_song(f'Song {index}', audio_file=f'songs/{index}.mp3'))
+
+    def prebrand(self, **options):
+        output = io.StringIO()
+        call_command('prebrand_songs', workers=1, stdout=output, **options)
+        return output.getvalue()
+
+    def test_bounded_in_flight_window(self):
+        self.assertIn('6 songs to brand, 0 already cached', self.prebrand())
+        self.assertEqual(self.executor.max_in_flight, 4)
+        for song in self.songs:
+            self.assertIsNotNone(artifacts.get_store().get(branding.BrandingSpec.for_song(song)))
+
+    def test_rerun_skips_built_artifacts(self):
+        self.prebrand()
+        os.remove(artifacts.get_store().path_for(branding.BrandingSpec.for_song(self.songs[2])))
+        self.executor.max_in_flight = 0
+        self.assertIn('1 songs to brand, 5 already cached', self.prebrand())
+        self.assertEqual(self.executor.max_in_flight, 1)
+        self.assertIn('0 songs to brand, 6 already cached', self.prebrand())
+        self.assertIn('1 songs to brand', self.prebrand(song_ids=[self.songs[0].pk], force=True))
+
+
+class CoverCacheTests(MusicTestCase):
+    def spec(self, title):
+        return branding.BrandingSpec(song_id=1, title=title, artist='A', genre='', audio_path='')
+
+    def test_least_recently_used_renders_are_evicted(self):
+        first = branding.branded_cover_path(self.spec('first'))
+        size = os.path.getsize(first)
+        with self.settings(BRANDED_COVER_CACHE_MAX_BYTES=2 * size + size // 2):
+            second = branding.branded_cover_path(self.spec('second'))
+            # Make the second render the least recently used one
+            os.utime(second, ns=(1, os.stat(second).st_mtime_ns))
+            self.assertEqual(branding.branded_cover_path(self.spec('first')), first)
+            third = branding.branded_cover_path(self.spec('third'))
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+
+
+class ProcessingScheduleTests(MusicTestCase):
+    def test_repeated_saves_queue_one_run(self):
+        executor = mock.Mock()
+        with mock.patch.object(registry, 'get_executor', return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(3):
+                    registry.schedule(7)
+                registry.schedule(7, names=['renditions'])
+        self.assertEqual(executor.submit.call_count, 2)
+        # Once a run has started, a later save queues another
+        with mock.patch.object(registry, 'process_song'), mock.patch.object(registry, 'connection'), \
+                mock.patch.object(registry, 'close_old_connections'):
+            registry._process_in_background(7, None, False)
+        with mock.patch.object(registry, 'get_executor', return_value=executor):
+            with self.captureOnCommitCallbacks(execute=True):
+                registry.schedule(7)
+        self.assertEqual(executor.submit.call_count, 3)
+
+
+class RenditionTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        override = self.settings(MEDIA_ROOT=os.path.join(self.temp_root, 'media'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.song = make_song('Ladder', audio_quality='high')
+
+    def fake_ffmpeg(self, *args, **kwargs):
+        with open(args[-1], 'wb') as output:
+            output.write(b'audio')
+
+    def test_concurrent_run_updates_the_existing_row(self):
+        competitor = SongRendition(song=self.song, quality='standard', codec='libmp3lame', source_name='old')
+        competitor.file.save('competitor.mp3', io.BytesIO(b'x'), save=False)
+        competitor_path = competitor.file.path
+
+        def run(*args, **kwargs):
+            # Another run stores its row between our snapshot and our write
+            if not SongRendition.objects.exists():
+                competitor.save()
+            self.fake_ffmpeg(*args)
+
+        with mock.patch.object(ffmpeg, 'run', side_effect=run):
+            renditions.transcode_renditions(self.song, '/dev/null')
+        rows = {r.quality: r for r in SongRendition.objects.filter(song=self.song)}
+        self.assertEqual(set(rows), {'standard', 'high'})
+        self.assertEqual(rows['standard'].source_name, self.song.audio_file.name)
+        self.assertEqual(rows['standard'].file_size, len(b'audio'))
+        self.assertFalse(os.path.exists(competitor_path))
+
+
+class HlsAccessTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = make_song('Tiers', audio_quality='high')
+        self.version = hls.hls_version(self.song)
+        for quality in ('standard', 'high'):
+            directory = os.path.join(hls.package_dir(self.song), quality)
+            os.makedirs(directory)
+            for name in ('index.m3u8', 'seg_00000.ts'):
+                with open(os.path.join(directory, name), 'wb') as output:
+                    output.write(b'data')
+        self.free = User.objects.create_user('free', password='x')
+        self.premium = User.objects.create_user('premium', password='x')
+        self.premium.userprofile.premium_plan = 'premium'
+        self.premium.userprofile.save()
+
+    def get(self, quality, user=None):
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.get(reverse('hls_file', args=[self.song.pk, self.version, quality, 'seg_00000.ts']))
+
+    def test_free_listener_cannot_fetch_higher_tier(self):
+        self.assertEqual(self.get('high', self.free).status_code, 403)
+        response = self.get('standard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_premium_tier_is_private(self):
+        response = self.get('high', self.premium)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_premium_song_needs_subscription(self):
+        Song.objects.filter(pk=self.song.pk).update(is_premium_only=True)
+        self.assertEqual(self.get('standard', self.free).status_code, 403)
+        response = self.get('standard', self.premium)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+
+class RunStagesTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = make_song('Pipeline')
+        self.calls = []
+        stages = {
+            'first': registry.Stage('first', self.record('first'), order=1),
+            'published': registry.Stage('published', self.record('published'), order=2, approved_only=True),
+        }
+        patcher = mock.patch.dict(registry.STAGES, stages, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(registry, 'local_audio', return_value=mock.MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, name):
+        def run(song, source_path, force=False):
+            self.calls.append(name)
+        return run
+
+    def test_busy_song_is_processed_again_after_the_running_pipeline(self):
+        def first(song, source_path, force=False):
+            self.calls.append('first')
+            if self.calls.count('first') == 1:
+                # A save during the run tries to process the song too
+                self.assertEqual(registry.run_stages(Song.objects.get(pk=song.pk)), {})
+        registry.STAGES['first'] = registry.Stage('first', first, order=1)
+
+        results = registry.run_stages(self.song)
+        self.assertEqual(results, {'first': True, 'published': True})
+        self.assertEqual(self.calls, ['first', 'published', 'first', 'published'])
+
+    def test_unapproved_while_running_skips_approved_only_stages(self):
+        def unpublish(song, source_path, force=False):
+            self.calls.append('first')
+            Song.objects.filter(pk=song.pk).update(is_approved=False)
+        registry.STAGES['first'] = registry.Stage('first', unpublish, order=1)
+
+        self.assertEqual(registry.run_stages(self.song), {'first': True})
+        self.assertEqual(self.calls, ['first'])
+
+
+@skipUnless(metadata.HAS_MUTAGEN, 'needs mutagen')
+class MetadataTests(MusicTestCase):
+    def test_tags_and_stream_info_are_read_from_the_file(self):
+        from mutagen.easyid3 import EasyID3
+
+        path = os.path.join(self.temp_root, 'tagged.mp3')
+        with open(path, 'wb') as audio:
+            audio.write(mp3_bytes(frames=200))
+        tags = EasyID3()
+        tags.update({'title': 'Tagged Title', 'artist': 'Tag Artist', 'album': ['x' * 600]})
+        tags.save(path)
+
+        song = make_song('Tagged', duration=0)
+        song.title = 'Unsaved edit'
+        with mock.patch.object(song, 'save', wraps=song.save) as save:
+            metadata.extract_metadata(song, path)
+        save.assert_called_once_with(
+            update_fields=['embedded_tags', 'metadata_source', 'duration', 'bitrate', 'sample_rate'])
+
+        song = Song.objects.get(pk=song.pk)
+        # 200 frames of 1152 samples at 44.1 kHz
+        self.assertEqual((song.duration, song.bitrate, song.sample_rate), (5, 128, 44100))
+        self.assertEqual(song.embedded_tags, {
+            'title': 'Tagged Title', 'artist': 'Tag Artist', 'album': 'x' * metadata.MAX_TAG_LENGTH,
+        })
+        self.assertEqual(song.title, 'Tagged')
+        self.assertFalse(metadata.metadata_stale(song))
+
+
+@override_settings(PREVIEW_MIN_WITHHELD=30)
+class PreviewTests(MusicTestCase):
+    FRAME_BYTES = 417
+    FRAME_SECONDS = 1152 / 44100
+
+    def setUp(self):
+        super().setUp()
+        override = self.settings(MEDIA_ROOT=os.path.join(self.temp_root, 'media'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source = os.path.join(self.temp_root, 'source.mp3')
+        with open(self.source, 'wb') as audio:
+            audio.write(mp3_bytes(2000))  # about 52 seconds
+        self.song = make_song('Paywalled', is_premium_only=True, preview_duration=30, duration=52)
+
+    def clip_seconds(self):
+        return os.path.getsize(self.song.preview_file.path) / self.FRAME_BYTES * self.FRAME_SECONDS
+
+    def test_preview_never_reaches_the_withheld_end(self):
+        self.song.preview_duration = 600
+        preview.cut_preview(self.song, self.source)
+        self.assertAlmostEqual(self.clip_seconds(), 52 - 30, delta=1)
+
+    def test_short_preview_is_cut_as_asked(self):
+        self.song.preview_duration = 5
+        preview.cut_preview(self.song, self.source)
+        self.assertAlmostEqual(self.clip_seconds(), 5, delta=1)
+
+    def test_preview_is_dropped_when_no_longer_wanted(self):
+        preview.cut_preview(self.song, self.source)
+        path = self.song.preview_file.path
+        self.song.is_premium_only = False
+        self.assertTrue(preview.preview_stale(self.song))
+        preview.cut_preview(self.song, self.source)
+        self.assertFalse(self.song.preview_file)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(preview.preview_stale(self.song))
+
+    def test_song_too_short_for_a_preview(self):
+        self.song.duration = 25
+        self.assertEqual(preview.clip_seconds(self.song), 0)
+        self.assertFalse(preview.preview_stale(self.song))
+
+
+class WaveformTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.song = make_song('Peaks')
+        patcher = mock.patch.object(ffmpeg, 'available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_changed_bucket_count_recomputes_and_changes_url(self):
+        SongWaveform.objects.create(song=self.song, peaks=bytes(2000), buckets=1000,
+                                    source_name=self.song.audio_file.name)
+        with self.settings(WAVEFORM_BUCKETS=1000):
+            self.assertFalse(waveform.waveform_stale(self.song))
+        old_url = self.song.waveform_url
+        with self.settings(WAVEFORM_BUCKETS=500):
+            self.assertTrue(waveform.waveform_stale(self.song))
+            with mock.patch.object(ffmpeg, 'decode_pcm', return_value=bytes(20000)):
+                waveform.build_waveform(self.song, '/dev/null')
+            self.assertFalse(waveform.waveform_stale(self.song))
+        self.assertNotEqual(self.song.waveform_url, old_url)
+        response = self.client.get(old_url)
+        self.assertRedirects(response, self.song.waveform_url, fetch_redirect_response=False)
+
+    def test_url_reads_a_select_related_waveform_without_querying(self):
+        SongWaveform.objects.create(song=self.song, peaks=bytes(2000), buckets=1000,
+                                    source_name=self.song.audio_file.name)
+        make_song('No peaks yet')
+        songs = list(Song.objects.select_related('waveform').defer('waveform__peaks').order_by('pk'))
+        with self.assertNumQueries(0):
+            urls = [song.waveform_url for song in songs]
+        self.assertEqual(urls, [self.song.waveform_url, None])
+        song = Song.objects.get(pk=self.song.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(song.waveform_url, urls[0])
+            self.assertEqual(song.waveform_url, urls[0])
+
+    def test_short_audio_keeps_the_configured_bucket_count(self):
+        self.assertEqual(waveform.compute_peaks(bytes(20), 1000)[1], 1000)
+
+
+def click_track(bpm=120, seconds=12, rate=48000):
+    """Stereo s16le PCM with a short burst on every beat"""
+    import numpy as np
+
+    samples = np.zeros(seconds * rate)
+    burst = np.random.default_rng(0).uniform(-1, 1, rate // 50) * np.linspace(1, 0, rate // 50)
+    for start in range(0, len(samples) - len(burst), int(rate * 60 / bpm)):
+        samples[start:start + len(burst)] = burst
+    return (np.repeat(samples, 2) * 16000).astype('<i2').tobytes()
+
+
+@mock.patch.object(analysis, 'HAS_NUMPY', True)
+class AnalysisTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pcm = click_track()
+
+    def analyze(self, song):
+        # Odd-sized blocks, as a pipe would hand them over
+        blocks = [self.pcm[start:start + 99996] for start in range(0, len(self.pcm), 99996)]
+        with mock.patch.object(ffmpeg, 'stream_pcm', return_value=iter(blocks)):
+            analysis.analyze_audio(song, '/dev/null', force=True)
+        song.refresh_from_db()
+
+    def test_streamed_analysis_matches_whole_file(self):
+        import numpy as np
+
+        song = make_song('Clicks')
+        self.analyze(song)
+        frames = np.frombuffer(self.pcm, dtype='<i2').reshape(-1, 2)
+        self.assertEqual(song.loudness, round(analysis.integrated_loudness(frames, full_scale=32768.0), 2))
+        self.assertEqual(song.bpm, round(analysis.estimate_tempo(frames.mean(axis=1, dtype=np.float32) / 32768.0)))
+        self.assertEqual(song.bpm, 120)
+        self.assertTrue(song.bpm_estimated)
+
+    def test_only_estimated_tempo_is_replaced(self):
+        entered = make_song('Entered', bpm=90)
+        self.analyze(entered)
+        self.assertEqual(entered.bpm, 90)
+        self.assertFalse(entered.bpm_estimated)
+
+        estimated = make_song('Estimated', bpm=90, bpm_estimated=True)
+        self.analyze(estimated)
+        self.assertEqual(estimated.bpm, 120)
+        self.assertTrue(estimated.bpm_estimated)
+
+
+class GenreStatsTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bongo = Genre.objects.create(name='Bongo')
+        self.taarab = Genre.objects.create(name='Taarab')
+        self.song = make_song('Mover', genre=self.bongo, plays=4)
+
+    def test_genre_change_recounts_both_genres(self):
+        self.assertEqual(genre_stats.for_genre(self.bongo.pk).song_count, 1)
+        self.song.genre = self.taarab
+        self.song.save()
+        self.assertEqual(genre_stats.for_genre(self.bongo.pk).song_count, 0)
+        self.assertEqual(genre_stats.for_genre(self.taarab.pk).song_count, 1)
+        self.assertEqual(genre_stats.for_genre(self.taarab.pk).total_plays, 4)
+
+    def test_saves_that_keep_genre_and_approval_skip_the_recount(self):
+        song = Song.objects.get(pk=self.song.pk)
+        song.lyrics = 'Kwa mara nyingine'
+        with mock.patch.object(genre_stats, 'refresh') as refresh, CaptureQueriesContext(connection) as queries:
+            song.save(update_fields=['lyrics', 'genre', 'is_approved'])
+        refresh.assert_not_called()
+        stored = 'SELECT "music_song"."genre_id" AS "genre_id", "music_song"."is_approved"'
+        self.assertFalse([query for query in queries if query['sql'].startswith(stored)])
+
+    def test_unapproving_recounts_the_genre(self):
+        song = Song.objects.get(pk=self.song.pk)
+        song.is_approved = False
+        song.save()
+        self.assertEqual(genre_stats.for_genre(self.bongo.pk).song_count, 0)
+        song.genre = self.taarab
+        with mock.patch.object(genre_stats, 'refresh') as refresh:
+            song.save()
+        refresh.assert_not_called()
+
+    def test_counter_flush_keeps_the_cached_list(self):
+        genre_stats.all_genres()
+        with mock.patch.object(genre_stats, 'invalidate') as invalidate:
+            genre_stats.add_counter_deltas({self.song.pk: {'plays': 3, 'downloads': 1}})
+        invalidate.assert_not_called()
+        self.assertEqual(GenreStats.objects.get(pk=self.bongo.pk).plays, 7)
+        genre_stats.invalidate()
+        self.assertEqual(genre_stats.for_genre(self.bongo.pk).total_plays, 7)
+
+
+class TrendingTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(trending, '_pending', trending.defaultdict(int))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counts_kept_while_the_lock_is_busy(self):
+        now = time.time()
+        held = CacheLock(trending.LOCK_KEY, timeout=30)
+        self.assertTrue(held.acquire())
+        with self.settings(TRENDING_LOCK_WAIT=0):
+            self.assertFalse(trending.add_counts({('song', 'plays', 7, now): 3}, now))
+        held.release()
+
+        self.assertTrue(trending.add_counts({('song', 'plays', 7, now): 2}, now))
+        self.assertEqual(trending.ranking('song', '1h'), [(7, 5, 0)])
+        self.assertFalse(trending._pending)
+
+    def test_lock_of_another_holder_is_not_released(self):
+        held = CacheLock(trending.LOCK_KEY, timeout=30)
+        self.assertTrue(held.acquire())
+        stale = CacheLock(trending.LOCK_KEY, timeout=30)
+        stale.token = 'expired-holder'
+        stale.release()
+        self.assertFalse(CacheLock(trending.LOCK_KEY, timeout=30).acquire())
+        held.release()
+        self.assertTrue(CacheLock(trending.LOCK_KEY, timeout=30).acquire())
+
+
+class HotScoreTests(MusicTestCase):
+    def add_day(self, song, age, plays=0, downloads=0):
+        bucket = rollups.since(1) - timedelta(days=age)
+        SongRollup.objects.create(song=song, period='day', bucket=bucket, plays=plays, downloads=downloads)
+
+    def test_decay_weights_halve_every_half_life(self):
+        weights = hotness.decay_weights(days=7, half_life=3)
+        today = rollups.since(1)
+        self.assertEqual(len(weights), 7)
+        self.assertEqual(weights[today], 1.0)
+        self.assertAlmostEqual(weights[today - timedelta(days=3)], 0.5)
+        self.assertAlmostEqual(weights[today - timedelta(days=6)], 0.25)
+
+    def test_scores_and_ordering(self):
+        fresh = make_song('Fresh')
+        self.add_day(fresh, 0, plays=10, downloads=1)
+        steady = make_song('Steady')
+        self.add_day(steady, 1, plays=12)
+        old_hit = make_song('Old Hit')
+        self.add_day(old_hit, 6, plays=100)
+        # Activity before the window no longer counts, and its stale score is cleared
+        faded = make_song('Faded', hot_score=5.0)
+        self.add_day(faded, 30, plays=1000)
+        make_song('Silent')
+
+        with self.settings(HOT_SCORE_WINDOW_DAYS=30, HOT_SCORE_HALF_LIFE_DAYS=3):
+            call_command('update_hot_scores', stdout=io.StringIO())
+        scores = dict(Song.objects.values_list('title', 'hot_score'))
+        self.assertAlmostEqual(scores['Fresh'], 12.0)
+        self.assertAlmostEqual(scores['Steady'], 12 * 0.5 ** (1 / 3))
+        self.assertAlmostEqual(scores['Old Hit'], 25.0)
+        self.assertEqual((scores['Faded'], scores['Silent']), (0.0, 0.0))
+        self.assertEqual(
+            list(Song.objects.order_by('-hot_score', 'title').values_list('title', flat=True)),
+            ['Old Hit', 'Fresh', 'Steady', 'Faded', 'Silent'],
+        )
+
+        # A shorter half-life puts last week's hit behind today's plays
+        self.assertEqual(hotness.update_hot_scores(half_life=1), 3)
+        self.assertEqual(
+            list(Song.objects.filter(hot_score__gt=0).order_by('-hot_score').values_list('title', flat=True)),
+            ['Fresh', 'Steady', 'Old Hit'],
+        )
+
+    def test_command_rejects_a_bad_window(self):
+        with self.assertRaises(CommandError):
+            call_command('update_hot_scores', days=0)
+
+
+class LeaderboardTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(leaderboards, '_backend', leaderboards.MemoryLeaderboardBackend(3, 3600))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.genre = Genre.objects.create(name='Bongo')
+        self.songs = [make_song(f'Hit {n}', genre=self.genre, plays=n * 10) for n in range(1, 6)]
+
+    def top(self, **scope):
+        return [song.pk for song in leaderboards.top_songs('plays', n=3, **scope)]
+
+    def database_top(self, **scope):
+        songs = Song.objects.filter(is_approved=True, **scope).order_by('-plays')
+        return list(songs.values_list('pk', flat=True)[:3])
+
+    def test_boards_follow_flushed_totals(self):
+        self.assertEqual(self.top(), self.database_top())
+        # A song below the cut climbs past the leader on its next flush
+        Song.objects.filter(pk=self.songs[0].pk).update(plays=100)
+        leaderboards.record([self.songs[0].pk])
+        self.assertEqual(self.top(), self.database_top())
+        self.assertEqual(self.top(genre=self.genre), self.database_top(genre=self.genre))
+
+    def test_unapproved_and_moved_songs_leave_their_boards(self):
+        self.assertEqual(self.top(genre=self.genre), self.database_top(genre=self.genre))
+        leader = self.songs[-1]
+        leader.is_approved = False
+        leader.save(update_fields=['is_approved'])
+        self.assertEqual(self.top(), self.database_top())
+
+        moved = self.songs[-2]
+        moved.genre = Genre.objects.create(name='Taarab')
+        moved.save()
+        self.assertNotIn(moved.pk, self.top(genre=self.genre))
+        self.assertEqual(self.top(genre=moved.genre), [moved.pk])
+
+
+class SimilarSongsTests(MusicTestCase):
+    def similar(self, song):
+        response = self.client.get(reverse('song_detail', args=[song.pk]))
+        return [similar.pk for similar in response.context['similar_songs']]
+
+    def test_similar_songs_share_the_genre(self):
+        genre = Genre.objects.create(name='Bongo')
+        song = make_song('Base', genre=genre)
+        same = make_song('Same', genre=genre, plays=5)
+        make_song('Other', genre=Genre.objects.create(name='Taarab'), plays=50)
+        make_song('Loose', plays=90)
+        self.assertEqual(self.similar(song), [same.pk])
+
+    def test_songs_without_a_genre_get_other_songs_without_one(self):
+        song = make_song('Base')
+        loose = make_song('Loose', plays=5)
+        make_song('Other', genre=Genre.objects.create(name='Taarab'), plays=50)
+        self.assertEqual(self.similar(song), [loose.pk])
+
+
+class SearchFallbackTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(fulltext._built, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.song = make_song('Jambo Tune', lyrics='habari')
+
+    def empty_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {fulltext.TABLE}")
+        fulltext._built.clear()
+
+    def test_icontains_until_the_index_is_built(self):
+        self.empty_index()
+        self.assertIsNone(fulltext.backend())
+        self.assertEqual([song.pk for song in fulltext.search('song', 'jambo')], [self.song.pk])
+
+        fulltext.rebuild()
+        self.assertEqual(fulltext.backend(), connection.vendor)
+        self.assertEqual([song.pk for song in fulltext.search('song', 'haba')], [self.song.pk])
+
+    def test_migration_fills_the_index(self):
+        self.empty_index()
+        migration = importlib.import_module('music.migrations.0020_populate_search_index')
+        migration.populate_search_index(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(fulltext.backend(), connection.vendor)
+        self.assertEqual(fulltext.ids('song', 'jambo'), [self.song.pk])
+        self.assertEqual(fulltext.ids('artist', 'jambo'), [self.song.artist.pk])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs PostgreSQL')
+class PostgresSearchTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(fulltext._built, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_weighted_prefix_search(self):
+        in_lyrics = make_song('Usiku', lyrics='sauti ya mvua')
+        in_title = make_song('Mvua Kubwa')
+        fulltext.rebuild()
+        self.assertEqual(fulltext.backend(), 'postgresql')
+        # Title (weight A) ranks above lyrics (weight C); every word is a prefix
+        self.assertEqual(fulltext.ids('song', 'mvu'), [in_title.pk, in_lyrics.pk])
+        self.assertEqual(fulltext.ids('song', 'mvua sau'), [in_lyrics.pk])
+
+        in_title.title = 'Jua Kali'
+        in_title.save()
+        self.assertEqual(fulltext.ids('song', 'kali'), [in_title.pk])
+        in_lyrics.delete()
+        self.assertEqual(fulltext.ids('song', 'sauti'), [])
+
+    def test_marker_row_is_never_a_result(self):
+        fulltext.rebuild()
+        fulltext.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {fulltext.TABLE} WHERE kind = 0")
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(fulltext.ids('genre', 'a'), [])
+
+
+@skipUnless(fingerprint.HAS_NUMPY, 'needs numpy')
+class FingerprintTests(MusicTestCase):
+    def chords(self, seconds):
+        """s16le mono PCM: three random tones every quarter second, at varying levels"""
+        import numpy as np
+
+        rng = np.random.default_rng(1)
+        t = np.arange(fingerprint.SAMPLE_RATE // 4) / fingerprint.SAMPLE_RATE
+        parts = [
+            sum(np.sin(2 * np.pi * freq * t) for freq in rng.uniform(200, 3000, 3)) * rng.uniform(0.05, 0.3)
+            for _ in range(seconds * 4)
+        ]
+        return (np.concatenate(parts) * 10000).astype('<i2').tobytes()
+
+    def test_hash_density_is_capped_and_a_clip_still_matches(self):
+        pcm = self.chords(40)
+        hashes, offsets = fingerprint.landmarks(pcm)
+        self.assertLessEqual(len(hashes), 40 * fingerprint.PEAKS_PER_SECOND * fingerprint.FAN_OUT)
+
+        original = make_song('Original')
+        AudioFingerprint.objects.bulk_create(
+            AudioFingerprint(song=original, hash=value, offset=offset)
+            for value, offset in zip(hashes.tolist(), offsets.tolist())
+        )
+        # 600 frames (~28s) starting 200 frames in
+        clip = pcm[2 * fingerprint.HOP * 200:2 * fingerprint.HOP * 800]
+        copy = make_song('Clip')
+        clip_hashes, clip_offsets = fingerprint.landmarks(clip)
+        matches = fingerprint.find_matches(copy.pk, clip_hashes, clip_offsets)
+        self.assertGreater(matches[original.pk], len(clip_hashes) // 2)
+        fingerprint.flag_duplicates(copy, matches, len(clip_hashes))
+        self.assertTrue(DuplicateCandidate.objects.filter(song=copy, original=original).exists())
+
+
+class DuplicateReviewTests(MusicTestCase):
+    def test_confirmed_copy_leaves_search_and_stats(self):
+        genre = Genre.objects.create(name='Bongo')
+        original = make_song('Original Tune', genre=genre)
+        copy = make_song('Copied Tune', artist=original.artist, genre=genre)
+        DuplicateCandidate.objects.create(song=copy, original=original, matches=50, score=0.9)
+        self.assertEqual(artist_stats.for_artist(original.artist).songs, 2)
+        self.assertEqual(genre_stats.for_genre(genre.pk).song_count, 2)
+
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser('moderator', password='x')
+        model_admin = DuplicateCandidateAdmin(DuplicateCandidate, site)
+        with mock.patch.object(model_admin, 'message_user'):
+            model_admin.confirm_duplicates(request, DuplicateCandidate.objects.all())
+
+        copy.refresh_from_db()
+        self.assertFalse(copy.is_approved)
+        self.assertEqual(artist_stats.for_artist(original.artist).songs, 1)
+        self.assertEqual(genre_stats.for_genre(genre.pk).song_count, 1)
+        self.assertEqual([song.pk for song in fulltext.search('song', 'tune')], [original.pk])
+
+
+class ChartTests(MusicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chart = Chart.objects.create(title='Top 3', chart_type='top_songs')
+        self.songs = [make_song(title) for title in ('Kwanza', 'Pili', 'Tatu')]
+        self.this_week = charts.chart_week()
+        self.last_week = self.this_week - timedelta(days=7)
+
+    def set_totals(self, *totals):
+        """Today's (plays, downloads) for each song"""
+        today = rollups.bucket_start(timezone.now(), 'day')
+        for song, (plays, downloads) in zip(self.songs, totals):
+            SongRollup.objects.update_or_create(song=song, period='day', bucket=today,
+                                                defaults={'plays': plays, 'downloads': downloads})
+
+    def entries(self):
+        return list(self.chart.entries.order_by('position').values_list(
+            'song__title', 'previous_position', 'weeks_on_chart'))
+
+    def test_ranks_and_movement_against_last_week(self):
+        kwanza, pili, tatu = [song.pk for song in self.songs]
+        # Pili's 4 downloads count as 8 plays
+        self.set_totals((10, 0), (3, 4), (2, 0))
+        self.assertEqual(charts.build_chart(self.chart, week=self.last_week), 3)
+        self.assertEqual(self.entries(), [('Pili', None, 1), ('Kwanza', None, 1), ('Tatu', None, 1)])
+
+        self.set_totals((10, 0), (3, 4), (20, 0))
+        charts.build_chart(self.chart)
+        self.assertEqual(self.entries(), [('Tatu', 3, 2), ('Pili', 1, 2), ('Kwanza', 2, 2)])
+        snapshot = ChartSnapshot.objects.get(chart=self.chart, week=self.this_week)
+        self.assertEqual(
+            [(item['song_id'], item['position'], item['plays'], item['downloads']) for item in snapshot.entries],
+            [(tatu, 1, 20, 0), (pili, 2, 3, 4), (kwanza, 3, 10, 0)],
+        )
+        self.assertEqual(ChartSnapshot.objects.filter(chart=self.chart).count(), 2)
+
+    def test_command_rewrites_changed_entries_only(self):
+        self.set_totals((5, 0), (4, 0), (0, 0))
+        output = io.StringIO()
+        call_command('build_charts', stdout=output)
+        self.assertIn('Top 3: 2 entries, 2 changed', output.getvalue())
+        first_ids = list(ChartEntry.objects.values_list('pk', flat=True))
+
+        self.set_totals((5, 0), (4, 0), (1, 0))
+        output = io.StringIO()
+        call_command('build_charts', chart_ids=[self.chart.pk], stdout=output)
+        self.assertIn('Top 3: 3 entries, 1 changed', output.getvalue())
+        self.assertTrue(set(first_ids) <= set(ChartEntry.objects.values_list('pk', flat=True)))
+
+    def test_chart_pages_render_this_week_and_past_weeks(self):
+        self.set_totals((5, 0), (0, 0), (0, 0))
+        charts.build_chart(self.chart, week=self.last_week)
+        self.set_totals((5, 0), (7, 0), (0, 0))
+        charts.build_chart(self.chart)
+
+        response = self.client.get(reverse('charts'))
+        self.assertContains(response, 'Pili')
+        response = self.client.get(reverse('chart_detail', args=[self.chart.pk]))
+        self.assertEqual([song.title for _, song in response.context['entries']], ['Pili', 'Kwanza'])
+        response = self.client.get(reverse('chart_detail', args=[self.chart.pk]),
+                                   {'week': self.last_week.isoformat()})
+        self.assertEqual([song.title for _, song in response.context['entries']], ['Kwanza'])
+        response = self.client.get(reverse('chart_detail', args=[self.chart.pk]), {'week': 'soon'})
+        self.assertEqual(response.status_code, 404)
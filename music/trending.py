@@ -0,0 +1,337 @@
+# music/trending.py
+"""
+Trending songs and artists over the last hour, day and week, from the
+play/download stream rather than from ``SongPlay`` queries.
+
+Each window is a ring of time buckets (5 minutes for ``1h``, an hour for
+``24h``, six hours for ``7d``). A bucket holds a Count-Min sketch of the
+plays and downloads of every song and artist seen in it, plus a short list
+of heavy hitters: the ``TRENDING_CANDIDATES`` songs and artists with the
+highest estimated score in that bucket. A window is ranked by summing the
+sketch estimates of the candidates of its buckets, so memory is fixed by
+the sketch size and candidate count, never by the size of the catalog.
+
+Buckets live in the shared cache. ``record`` (fed by ``events_flushed``)
+updates them under a cache lock; counts that find the lock busy are kept
+in this process and added with the next batch. ``top_songs`` / ``top_artists`` read them
+and cache the ranking for ``TRENDING_RESULT_TTL`` seconds. After a cache
+flush, ``manage.py rebuild_trending`` reloads the 24h and 7d windows from
+the hourly rollups.
+"""
+import heapq
+import logging
+import threading
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cachelock import CacheLock
+
+logger = logging.getLogger(__name__)
+
+# name: (bucket seconds, buckets per window)
+WINDOWS = {
+    '1h': (5 * 60, 12),
+    '24h': (60 * 60, 24),
+    '7d': (6 * 60 * 60, 28),
+}
+
+KINDS = ('song', 'artist')
+METRICS = ('plays', 'downloads')
+
+# A download counts like two plays, as in Song.popularity_score
+DOWNLOAD_WEIGHT = 2
+
+# (a, b) for the hash rows h(x) = ((a * x + b) mod P) mod width; fixed so
+# every process hashes alike
+_PRIME = (1 << 61) - 1
+_HASH_SEEDS = (
+    (0x5851F42D4C957F2D, 0x14057B7EF767814F),
+    (0x2545F4914F6CDD1D, 0x9E3779B97F4A7C15),
+    (0x94D049BB133111EB, 0xBF58476D1CE4E5B9),
+    (0x369DEA0F31A53F85, 0xDB4F0B9175AE2165),
+    (0x4CF5AD432745937F, 0xD6E8FEB86659FD93),
+    (0x61C8864680B583EB, 0x7A646E4D21A1F3C5),
+)
+
+LOCK_KEY = 'trending:lock'
+
+# Counts that found the lock busy, retried with the next add_counts
+_pending = defaultdict(int)
+_pending_lock = threading.Lock()
+
+
+def _width():
+    return getattr(settings, 'TRENDING_SKETCH_WIDTH', 2048)
+
+
+def _depth():
+    return min(getattr(settings, 'TRENDING_SKETCH_DEPTH', 4), len(_HASH_SEEDS))
+
+
+def _item(kind, metric, pk):
+    """Integer sketch key for one counter of one song or artist"""
+    return pk * 4 + KINDS.index(kind) * 2 + METRICS.index(metric)
+
+
+def _bucket_key(window, start):
+    return f'trending:{window}:{start}'
+
+
+def _bucket_start(window, timestamp):
+    seconds = WINDOWS[window][0]
+    return int(timestamp) // seconds * seconds
+
+
+class Bucket:
+    """Count-Min sketch and heavy hitters of one time bucket (pickled into the cache)."""
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.counts = array('I', bytes(4 * width * depth))
+        self.hitters = {kind: {} for kind in KINDS}
+
+    def _cells(self, x):
+        width = self.width
+        return [row * width + (a * x + b) % _PRIME % width for row, (a, b) in enumerate(_HASH_SEEDS[:self.depth])]
+
+    def add(self, x, n):
+        counts = self.counts
+        for cell in self._cells(x):
+            counts[cell] += n
+
+    def estimate(self, x):
+        counts = self.counts
+        return min(counts[cell] for cell in self._cells(x))
+
+    def score(self, kind, pk):
+        return (self.estimate(_item(kind, 'plays', pk))
+                + DOWNLOAD_WEIGHT * self.estimate(_item(kind, 'downloads', pk)))
+
+    def update(self, counts, candidates):
+        """Add ``{(kind, metric, pk): n}`` and re-rank the touched items"""
+        for (kind, metric, pk), n in counts.items():
+            self.add(_item(kind, metric, pk), n)
+        for kind, pk in {(kind, pk) for kind, _, pk in counts}:
+            self.hitters[kind][pk] = self.score(kind, pk)
+        for kind, hitters in self.hitters.items():
+            if len(hitters) > candidates:
+                self.hitters[kind] = dict(heapq.nlargest(candidates, hitters.items(), key=lambda item: item[1]))
+
+
+def _load(keys, width, depth):
+    """``{key: Bucket}`` from the cache; missing or differently sized buckets start empty"""
+    found = cache.get_many(keys)
+    buckets = {}
+    for key in keys:
+        bucket = found.get(key)
+        if not isinstance(bucket, Bucket) or (bucket.width, bucket.depth) != (width, depth):
+            bucket = Bucket(width, depth)
+        buckets[key] = bucket
+    return buckets
+
+
+def _keep_for_later(counts):
+    # Floored to the finest bucket: they land in the same buckets, in far fewer keys
+    finest = min(seconds for seconds, _ in WINDOWS.values())
+    with _pending_lock:
+        for (kind, metric, pk, timestamp), n in counts.items():
+            _pending[(kind, metric, pk, timestamp // finest * finest)] += n
+
+
+def _take_pending(counts):
+    with _pending_lock:
+        if not _pending:
+            return counts
+        merged = defaultdict(int, _pending)
+        _pending.clear()
+    for key, n in counts.items():
+        merged[key] += n
+    return merged
+
+
+def add_counts(counts, now=None, windows=WINDOWS):
+    """
+    Add ``{(kind, metric, pk, timestamp): n}`` to ``windows``. Counts older
+    than a window are ignored by it. Returns False if the lock was busy; the
+    counts of a full update (every window) are then kept for the next call.
+    """
+    now = now or time.time()
+    retry = windows is WINDOWS
+    if retry:
+        counts = _take_pending(counts)
+    width, depth = _width(), _depth()
+    per_bucket = defaultdict(lambda: defaultdict(int))
+    timeouts = {}
+    for (kind, metric, pk, timestamp), n in counts.items():
+        for window in windows:
+            seconds, size = WINDOWS[window]
+            if timestamp <= now - seconds * size or timestamp > now + seconds:
+                continue
+            key = _bucket_key(window, _bucket_start(window, timestamp))
+            per_bucket[key][(kind, metric, pk)] += n
+            timeouts[key] = seconds * (size + 1)
+    if not per_bucket:
+        return True
+
+    lock = CacheLock(LOCK_KEY, timeout=30)
+    if not lock.acquire(wait=getattr(settings, 'TRENDING_LOCK_WAIT', 0.2), interval=0.01):
+        if retry:
+            _keep_for_later(counts)
+            logger.info("Trending lock busy; keeping %d counts for the next update", len(counts))
+        else:
+            logger.warning("Trending lock busy; dropped %d counts", len(counts))
+        return False
+    try:
+        buckets = _load(list(per_bucket), width, depth)
+        candidates = getattr(settings, 'TRENDING_CANDIDATES', 200)
+        for key, bucket_counts in per_bucket.items():
+            buckets[key].update(bucket_counts, candidates)
+        # Same-lifetime buckets are written together; 1h buckets expire sooner than 7d ones
+        by_timeout = defaultdict(dict)
+        for key, bucket in buckets.items():
+            by_timeout[timeouts[key]][key] = bucket
+        for timeout, values in by_timeout.items():
+            cache.set_many(values, timeout)
+    finally:
+        lock.release()
+    return True
+
+
+def _timestamp(value):
+    return value.timestamp() if value else time.time()
+
+
+def record(plays=(), downloads=()):
+    """Feed a flushed batch of SongPlay / SongDownload instances into the sketches"""
+    from .models import Song
+
+    events = [('plays', play.song_id, play.played_at) for play in plays]
+    events += [('downloads', download.song_id, download.downloaded_at) for download in downloads]
+    if not events:
+        return
+    artist_ids = dict(
+        Song.objects.filter(pk__in={song_id for _, song_id, _ in events}).values_list('pk', 'artist_id')
+    )
+    counts = defaultdict(int)
+    for metric, song_id, when in events:
+        if song_id not in artist_ids:
+            continue
+        timestamp = _timestamp(when)
+        counts[('song', metric, song_id, timestamp)] += 1
+        counts[('artist', metric, artist_ids[song_id], timestamp)] += 1
+    add_counts(counts)
+
+
+def ranking(kind, window):
+    """
+    ``[(pk, plays, downloads)]`` best first for ``window``, from the
+    candidates of its buckets. Cached for ``TRENDING_RESULT_TTL`` seconds.
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"Unknown trending window: {window}")
+    cache_key = f'trending:top:{kind}:{window}'
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    seconds, size = WINDOWS[window]
+    current = _bucket_start(window, time.time())
+    keys = [_bucket_key(window, current - seconds * age) for age in range(size)]
+    buckets = [
+        bucket for bucket in cache.get_many(keys).values()
+        if isinstance(bucket, Bucket)
+    ]
+    candidates = set()
+    for bucket in buckets:
+        candidates.update(bucket.hitters[kind])
+
+    result = []
+    for pk in candidates:
+        plays = sum(bucket.estimate(_item(kind, 'plays', pk)) for bucket in buckets)
+        downloads = sum(bucket.estimate(_item(kind, 'downloads', pk)) for bucket in buckets)
+        if plays or downloads:
+            result.append((pk, plays, downloads))
+    result.sort(key=lambda row: (row[1] + DOWNLOAD_WEIGHT * row[2], row[1]), reverse=True)
+    result = result[:getattr(settings, 'TRENDING_CANDIDATES', 200)]
+    cache.set(cache_key, result, getattr(settings, 'TRENDING_RESULT_TTL', 60))
+    return result
+
+
+def _ranked(queryset, kind, window, n):
+    rows = ranking(kind, window)
+    by_id = queryset.in_bulk([pk for pk, _, _ in rows[:n + 10]])
+    ranked = []
+    for pk, plays, downloads in rows:
+        obj = by_id.get(pk)
+        if obj is None:
+            continue
+        obj.recent_plays = plays
+        obj.recent_downloads = downloads
+        ranked.append(obj)
+        if len(ranked) == n:
+            break
+    return ranked
+
+
+def top_songs(window='24h', n=10, queryset=None):
+    """
+    Approved songs (or songs of ``queryset``) trending in ``window``, with
+    ``recent_plays`` / ``recent_downloads`` set.
+    """
+    from .models import Song
+
+    if queryset is None:
+        queryset = Song.objects.filter(is_approved=True).select_related('artist', 'genre')
+    return _ranked(queryset, 'song', window, n)
+
+
+def top_artists(window='7d', n=10, queryset=None):
+    """
+    Verified artists (or artists of ``queryset``) trending in ``window``,
+    with ``recent_plays`` / ``recent_downloads`` set.
+    """
+    from artists.models import Artist
+
+    if queryset is None:
+        queryset = Artist.objects.verified()
+    return _ranked(queryset, 'artist', window, n)
+
+
+def rebuild(now=None):
+    """
+    Reload the ``24h`` and ``7d`` windows from the hourly rollups, replacing
+    what they hold (the ``1h`` window is finer than the rollups and is left
+    alone). Returns the number of rollup rows read.
+    """
+    from analytics.models import ArtistRollup, SongRollup
+
+    now = now or time.time()
+    windows = ('24h', '7d')
+    oldest = max(WINDOWS[window][0] * WINDOWS[window][1] for window in windows)
+    since = datetime.fromtimestamp(_bucket_start('7d', now - oldest), dt_timezone.utc)
+
+    for window in windows:
+        seconds, size = WINDOWS[window]
+        current = _bucket_start(window, now)
+        cache.delete_many([_bucket_key(window, current - seconds * age) for age in range(size)])
+
+    counts = defaultdict(int)
+    rows = 0
+    for model, kind, field in ((SongRollup, 'song', 'song_id'), (ArtistRollup, 'artist', 'artist_id')):
+        hourly = model.objects.filter(period='hour', bucket__gte=since).values_list(field, 'bucket', *METRICS)
+        for pk, bucket, plays, downloads in hourly.iterator():
+            rows += 1
+            for metric, n in zip(METRICS, (plays, downloads)):
+                if n:
+                    counts[(kind, metric, pk, bucket.timestamp())] += n
+
+    add_counts(counts, now, windows)
+    for kind in KINDS:
+        cache.delete_many([f'trending:top:{kind}:{window}' for window in WINDOWS])
+    return rows
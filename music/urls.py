@@ -8,10 +8,18 @@ urlpatterns = [
     path('genres/', views.genres, name='genres'),
     path('genre/<int:genre_id>/', views.genre_songs, name='genre_songs'),
     path('download-song/<int:song_id>/', views.download_song, name='download_song'),
+    path('download-song/<int:song_id>/prepare/', views.prepare_download, name='prepare_download'),
+    path('download-song/<int:song_id>/jobs/<str:job_id>/', views.download_job_status, name='download_job_status'),
+    path('download-song/<int:song_id>/jobs/<str:job_id>/file/', views.download_job_file, name='download_job_file'),
     path('song/<int:song_id>/', views.song_detail, name='song_detail'),
     
     # Play and interaction URLs
     path('play-song/<int:song_id>/', views.play_song, name='play_song'),
+    path('stream/<int:song_id>/', views.stream_song, name='stream_song'),
+    path('preview/<int:song_id>/', views.preview_song, name='preview_song'),
+    path('waveform/<int:song_id>/<str:version>.bin', views.song_waveform, name='song_waveform'),
+    path('hls/<int:song_id>/master.m3u8', views.hls_master, name='hls_master'),
+    path('hls/<int:song_id>/<str:version>/<str:quality>/<str:name>', views.hls_file, name='hls_file'),
     path('update-play-duration/<int:song_id>/', views.update_play_duration, name='update_play_duration'),
     path('follow-artist/<int:artist_id>/', views.follow_artist_from_music, name='follow_artist_music'),
     
@@ -29,8 +37,8 @@ urlpatterns = [
     #path('api/like-video/', views.like_video, name='like_video'),
     
     # Charts and events
-   # path('charts/', views.charts_view, name='charts'),
-    #path('charts/<int:chart_id>/', views.chart_detail_view, name='chart_detail'),
+    path('charts/', views.charts_view, name='charts'),
+    path('charts/<int:chart_id>/', views.chart_detail_view, name='chart_detail'),
     #path('events/', views.events_view, name='events'),
     #path('radio/', views.radio_view, name='radio'),
     path('videos/', views.videos_view, name='videos'),
@@ -38,6 +46,7 @@ urlpatterns = [
      # API endpoints for tracking
     path('api/track-play/', views.api_track_play, name='api_track_play'),
     path('api/track-download/', views.api_track_download, name='api_track_download'),
+    path('api/track-events/', views.api_track_events, name='api_track_events'),
     path('api/songs/<int:song_id>/like/', views.api_like_song, name='api_like_song'),
     path('api/artists/<int:artist_id>/follow/', views.api_follow_artist, name='api_follow_artist'),
     
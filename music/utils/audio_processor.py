@@ -1,20 +1,26 @@
 # music/utils/audio_processor.py
+import functools
 import os
 from mutagen import File
 from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TCON, TDRC
 from PIL import Image, ImageDraw, ImageFont
 import io
 
+@functools.lru_cache(maxsize=16)
+def _resized_logo(logo_path, mtime_ns, size):
+    """Logo loaded and resized once per process for each cover size"""
+    with Image.open(logo_path) as logo:
+        return logo.convert('RGBA').resize(size, Image.Resampling.LANCZOS)
+
 def add_logo_to_cover(cover_path, logo_path, output_path):
     """Add logo to song cover image"""
     try:
         # Open cover image
         cover = Image.open(cover_path).convert('RGBA')
         
-        # Open logo and resize
-        logo = Image.open(logo_path).convert('RGBA')
-        logo_size = (cover.width // 4, cover.height // 4)  # 25% of cover size
-        logo = logo.resize(logo_size, Image.Resampling.LANCZOS)
+        # Logo at 25% of cover size; cached until the logo file changes
+        logo_size = (cover.width // 4, cover.height // 4)
+        logo = _resized_logo(logo_path, os.stat(logo_path).st_mtime_ns, logo_size)
         
         # Position logo in bottom right corner
         position = (cover.width - logo.width - 20, cover.height - logo.height - 20)
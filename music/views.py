@@ -1,38 +1,31 @@
 # music/views.py
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse, FileResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.decorators.http import require_POST, require_http_methods
-from django.db.models import Q, Count, Sum, Avg
+from django.db.models import Count, Sum, Avg, Prefetch
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.core.paginator import Paginator
 from django.conf import settings
-from django.db.models.functions import Coalesce
-from datetime import timedelta
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.urls import reverse
+from datetime import datetime, timedelta, timezone as dt_timezone
 import json
 import os
+import re
+import uuid
 
 from .models import Song, Genre, SongPlay, SongDownload, NewsArticle, Chart, ChartEntry, YouTubeVideo, NewsView
-from .models import NewsComment, NewsSubscription, NewsLike, CommentLike
+from .models import NewsComment, NewsSubscription, NewsLike, CommentLike, SongWaveform, ChartSnapshot
+from analytics import rollups
+from analytics.models import SongRollup
 from .forms import NewsCommentForm, NewsSubscriptionForm
+from . import artifacts, branding, charts, fulltext, genre_stats, ingest, jobs, leaderboards, offload, streaming, trending
+from .processing import hls, preview
 from artists.models import Artist, Follow
-# Import for image and audio processing
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-    print("Pillow not installed - cover art branding disabled")
-
-try:
-    import mutagen
-    from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, APIC, COMM
-    from mutagen.mp3 import MP3
-    HAS_MUTAGEN = True
-except ImportError:
-    HAS_MUTAGEN = False
-    print("Mutagen not installed - metadata branding disabled")
+from artists import stats as artist_stats
 
 # Utility function to get client IP
 def get_client_ip(request):
@@ -43,164 +36,35 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def create_branded_cover(song, output_path):
-    """Create branded cover art with Sangabiz branding"""
-    try:
-        if not HAS_PIL:
-            # Fallback without PIL
-            if song.cover_image and os.path.exists(song.cover_image.path):
-                shutil.copy2(song.cover_image.path, output_path)
-            return
-        
-        # Create a new cover image
-        width, height = 500, 500
-        
-        # Use original cover if available, otherwise create new
-        if song.cover_image and os.path.exists(song.cover_image.path):
-            image = Image.open(song.cover_image.path).convert('RGB')
-            image = image.resize((width, height), Image.LANCZOS)
-        else:
-            # Create default background
-            image = Image.new('RGB', (width, height), '#1DB954')  # Sangabiz green
-        
-        draw = ImageDraw.Draw(image)
-        
-        # Add text branding
-        try:
-            # Use default font (works on all systems)
-            font_large = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-            
-            # Song title
-            title = song.title
-            title_bbox = draw.textbbox((0, 0), title, font=font_large)
-            title_width = title_bbox[2] - title_bbox[0]
-            title_x = (width - title_width) // 2
-            draw.text((title_x, height//2 - 30), title, fill='white', font=font_large)
-            
-            # Artist name
-            artist = f"by {song.artist.name}"
-            artist_bbox = draw.textbbox((0, 0), artist, font=font_small)
-            artist_width = artist_bbox[2] - artist_bbox[0]
-            artist_x = (width - artist_width) // 2
-            draw.text((artist_x, height//2), artist, fill='#333333', font=font_small)
-            
-            # Sangabiz branding
-            branding = "Downloaded from Sangabiz"
-            branding_bbox = draw.textbbox((0, 0), branding, font=font_small)
-            branding_width = branding_bbox[2] - branding_bbox[0]
-            branding_x = (width - branding_width) // 2
-            draw.text((branding_x, height - 40), branding, fill='#666666', font=font_small)
-            
-        except Exception as e:
-            print(f"Text rendering error: {e}")
-        
-        # Save the branded cover
-        image.save(output_path, 'JPEG', quality=90)
-        
-    except Exception as e:
-        print(f"Cover creation error: {e}")
-        # Final fallback
-        if song.cover_image and os.path.exists(song.cover_image.path):
-            shutil.copy2(song.cover_image.path, output_path)
-
-def add_branded_metadata(audio_path, song, cover_path=None):
-    """Add Sangabiz branding to audio file metadata"""
-    try:
-        if not HAS_MUTAGEN:
-            return
-        
-        # Load the audio file
-        audio = MP3(audio_path, ID3=ID3)
-        
-        # Ensure ID3 tag exists
-        try:
-            audio.add_tags()
-        except mutagen.id3.error:
-            pass  # Tags already exist
-        
-        # Set basic metadata
-        audio.tags.add(TIT2(encoding=3, text=song.title))
-        audio.tags.add(TPE1(encoding=3, text=song.artist.name))
-        audio.tags.add(TALB(encoding=3, text="Sangabiz Music"))
-        
-        if song.genre:
-            audio.tags.add(TCON(encoding=3, text=song.genre.name))
-        
-        # Add comment with branding
-        comment_text = "Downloaded from Sangabiz - Your Favorite Music Platform"
-        audio.tags.add(COMM(encoding=3, text=comment_text))
-        
-        # Add cover art if available
-        if cover_path and os.path.exists(cover_path):
-            try:
-                with open(cover_path, 'rb') as cover_file:
-                    cover_data = cover_file.read()
-                
-                audio.tags.add(
-                    APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,  # Cover (front)
-                        desc='Cover',
-                        data=cover_data
-                    )
-                )
-            except Exception as e:
-                print(f"Cover art embedding error: {e}")
-        
-        # Save metadata
-        audio.save()
-        
-    except Exception as e:
-        print(f"Metadata error: {e}")
-
 def home(request):
     """Home page with featured content"""
     # Get featured songs
     featured_songs = Song.objects.filter(
         is_approved=True
-    ).select_related('artist', 'genre').order_by('-plays', '-upload_date')[:12]
+    ).select_related('artist', 'genre').order_by('-hot_score', '-upload_date')[:12]
     
     # Most played songs
-    most_played = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('-plays')[:10]
+    most_played = leaderboards.top_songs('plays', 10)
     
     # Most downloaded songs
-    most_downloaded = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('-downloads')[:10]
+    most_downloaded = leaderboards.top_songs('downloads', 10)
     
     # New artists
-    new_artists = Artist.objects.filter(is_verified=True).annotate(
-        total_songs_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays_count=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        total_downloads_count=Coalesce(Sum('songs__downloads', filter=Q(songs__is_approved=True)), 0),
-        followers_count=Count('followers')
-    ).order_by('-created_at')[:8]
+    new_artists = Artist.objects.filter(is_verified=True).annotate(**artist_stats.stat_annotations(
+        total_songs_count='songs',
+        total_plays_count='plays',
+        total_downloads_count='downloads',
+        followers_count='followers',
+    )).order_by('-created_at')[:8]
     
     # Trending artists
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    trending_artists = Artist.objects.filter(is_verified=True).annotate(
-        weekly_plays=Coalesce(Sum(
-            'songs__plays',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0),
-        weekly_downloads=Coalesce(Sum(
-            'songs__downloads',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0),
-        weekly_followers=Count(
-            'followers',
-            filter=Q(followers__followed_at__gte=seven_days_ago)
-        )
-    ).filter(
-        Q(weekly_plays__gt=0) | Q(weekly_downloads__gt=0) | Q(weekly_followers__gt=0)
-    ).order_by('-weekly_plays', '-weekly_downloads', '-weekly_followers')[:8]
+    trending_artists = trending.top_artists('7d', 8)
     
     # Genres with song counts
-    genres = Genre.objects.annotate(
-        song_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        total_downloads=Coalesce(Sum('songs__downloads', filter=Q(songs__is_approved=True)), 0)
-    ).filter(song_count__gt=0).order_by('-song_count')[:12]
+    genres = sorted(
+        (genre for genre in genre_stats.all_genres() if genre.song_count),
+        key=lambda genre: -genre.song_count,
+    )[:12]
     
     # Get stats
     total_songs = Song.objects.filter(is_approved=True).count()
@@ -246,7 +110,7 @@ def home(request):
         ).order_by('-published_date')[:3]
         featured_charts = Chart.objects.filter(
             is_active=True
-        ).prefetch_related('entries__song')[:2]
+        ).prefetch_related(_chart_entries())[:2]
     except Exception as e:
         print(f"Error loading additional content: {e}")
         featured_videos = []
@@ -273,7 +137,10 @@ def home(request):
 
 def discover(request):
     """Discover page with all songs and enhanced content"""
-    songs_list = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('-upload_date')
+    # Hot (time-decayed recent activity) by default, or newest first with ?sort=new
+    sort = request.GET.get('sort', 'hot')
+    ordering = ('-upload_date',) if sort == 'new' else ('-hot_score', '-upload_date')
+    songs_list = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by(*ordering)
     genres = Genre.objects.all()
     
     # Filtering
@@ -284,34 +151,24 @@ def discover(request):
     search_query = request.GET.get('q')
     if search_query:
         songs_list = songs_list.filter(
-            Q(title__icontains=search_query) |
-            Q(artist__name__icontains=search_query) |
-            Q(genre__name__icontains=search_query)
+            pk__in=fulltext.ids('song', search_query, getattr(settings, 'SEARCH_MAX_RESULTS', 1000))
         )
     
+    # Tempo range, e.g. ?bpm_min=120&bpm_max=130
+    bpm_min = request.GET.get('bpm_min', '')
+    bpm_max = request.GET.get('bpm_max', '')
+    if bpm_min.isdigit():
+        songs_list = songs_list.filter(bpm__gte=int(bpm_min))
+    if bpm_max.isdigit():
+        songs_list = songs_list.filter(bpm__lte=int(bpm_max))
+    
     # Pagination
     paginator = Paginator(songs_list, 20)
     page_number = request.GET.get('page')
     songs = paginator.get_page(page_number)
     
     # Get trending artists
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    discover_trending_artists = Artist.objects.filter(is_verified=True).annotate(
-        recent_followers=Count(
-            'followers', 
-            filter=Q(followers__followed_at__gte=seven_days_ago)
-        ),
-        recent_plays=Coalesce(Sum(
-            'songs__plays',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0),
-        recent_downloads=Coalesce(Sum(
-            'songs__downloads',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0)
-    ).filter(
-        Q(recent_followers__gt=0) | Q(recent_plays__gt=0) | Q(recent_downloads__gt=0)
-    ).order_by('-recent_plays', '-recent_downloads', '-recent_followers')[:6]
+    discover_trending_artists = trending.top_artists('7d', 6)
     
     # Get additional content
     try:
@@ -326,6 +183,9 @@ def discover(request):
         'genres': genres,
         'selected_genre': genre_filter,
         'search_query': search_query or '',
+        'bpm_min': bpm_min,
+        'bpm_max': bpm_max,
+        'sort': sort,
         'trending_artists': discover_trending_artists,
         'trending_videos': trending_videos,
         'discover_news': discover_news,
@@ -349,10 +209,14 @@ def song_detail(request, song_id):
             artist=song.artist
         ).exists()
     
-    similar_songs = Song.objects.filter(
-        genre=song.genre,
-        is_approved=True
-    ).exclude(id=song.id).select_related('artist', 'genre').order_by('-plays')[:6]
+    if song.genre_id is not None:
+        similar_songs = leaderboards.top_songs('plays', 6, genre=song.genre_id, exclude=[song.id])
+    else:
+        # No board holds the songs without a genre; they are the similar ones here
+        similar_songs = Song.objects.filter(
+            genre__isnull=True,
+            is_approved=True
+        ).exclude(id=song.id).select_related('artist', 'genre').order_by('-plays')[:6]
     
     play_stats = SongPlay.objects.filter(song=song).aggregate(
         total_plays=Count('id'),
@@ -383,24 +247,16 @@ def search(request):
     if not query:
         return redirect('discover')
     
-    # Search songs
-    songs = Song.objects.filter(
-        Q(title__icontains=query) | 
-        Q(artist__name__icontains=query) |
-        Q(genre__name__icontains=query),
-        is_approved=True
-    ).select_related('artist', 'genre').distinct().order_by('-plays')[:50]
+    # Search songs (title, artist, genre and lyrics), best match first
+    songs = fulltext.search('song', query, 50)
     
     # Get related artists
-    related_artists = Artist.objects.filter(
-        Q(name__icontains=query) |
-        Q(bio__icontains=query)
-    ).distinct().annotate(
-        song_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        total_downloads=Coalesce(Sum('songs__downloads', filter=Q(songs__is_approved=True)), 0),
-        followers_count=Count('followers')
-    ).filter(song_count__gt=0).order_by('-song_count')[:10]
+    related_artists = fulltext.search('artist', query, 50, queryset=Artist.objects.annotate(**artist_stats.stat_annotations(
+        song_count='songs',
+        total_plays='plays',
+        total_downloads='downloads',
+        followers_count='followers',
+    )).filter(song_count__gt=0))[:10]
     
     # Add follow status
     for artist in related_artists:
@@ -411,15 +267,11 @@ def search(request):
                 artist=artist
             ).exists()
     
-    # Get related genres
-    related_genres = Genre.objects.filter(
-        Q(name__icontains=query) |
-        Q(description__icontains=query)
-    ).distinct().annotate(
-        song_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        total_downloads=Coalesce(Sum('songs__downloads', filter=Q(songs__is_approved=True)), 0)
-    ).filter(song_count__gt=0).order_by('-song_count')[:8]
+    # Get related genres, with their stats from genre_stats
+    genres_by_id = {genre.pk: genre for genre in genre_stats.all_genres() if genre.song_count}
+    related_genres = [
+        genres_by_id[pk] for pk in fulltext.ids('genre', query, 50) if pk in genres_by_id
+    ][:8]
     
     context = {
         'songs': songs,
@@ -432,11 +284,7 @@ def search(request):
 
 def genres(request):
     """All genres page"""
-    genres = Genre.objects.annotate(
-        song_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays=Coalesce(Sum('songs__plays'), 0),
-        total_downloads=Coalesce(Sum('songs__downloads'), 0)
-    ).filter(song_count__gt=0).order_by('name')
+    genres = [genre for genre in genre_stats.all_genres() if genre.song_count]
     
     context = {
         'genres': genres,
@@ -445,35 +293,43 @@ def genres(request):
 
 def genre_songs(request, genre_id):
     """Songs by specific genre"""
-    genre = get_object_or_404(Genre, id=genre_id)
+    genre = genre_stats.for_genre(genre_id)
+    if genre is None:
+        raise Http404("No Genre matches the given query.")
     songs = Song.objects.filter(
         genre=genre, 
         is_approved=True
     ).select_related('artist', 'genre').order_by('-upload_date')
     
-    genre_stats = songs.aggregate(
-        total_songs=Count('id'),
-        total_plays=Sum('plays'),
-        total_downloads=Sum('downloads')
-    )
+    stats = {
+        'total_songs': genre.song_count,
+        'total_plays': genre.total_plays,
+        'total_downloads': genre.total_downloads,
+    }
     
-    top_artists = Artist.objects.filter(
-        songs__genre=genre,
-        songs__is_approved=True
-    ).annotate(
-        genre_songs_count=Count('songs', filter=Q(songs__genre=genre, songs__is_approved=True)),
-        genre_plays=Sum('songs__plays', filter=Q(songs__genre=genre)),
-        genre_downloads=Sum('songs__downloads', filter=Q(songs__genre=genre))
-    ).distinct().order_by('-genre_plays', '-genre_downloads')[:8]
+    artists_by_id = Artist.objects.in_bulk([row['artist_id'] for row in genre.top_artists])
+    top_artists = []
+    for row in genre.top_artists:
+        artist = artists_by_id.get(row['artist_id'])
+        if artist:
+            artist.genre_songs_count = row['songs']
+            artist.genre_plays = row['plays']
+            artist.genre_downloads = row['downloads']
+            top_artists.append(artist)
     
     context = {
         'genre': genre,
         'songs': songs,
-        'genre_stats': genre_stats,
+        'genre_stats': stats,
         'top_artists': top_artists,
     }
     return render(request, 'music/genre_songs.html', context)
 
+def _stream_quality(song, user, rendition=None):
+    """Quality ``user`` hears ``song`` at: their best allowed rendition, else the original's"""
+    rendition = rendition or song.rendition_for(user)
+    return rendition.quality if rendition else song.audio_quality
+
 @login_required
 def play_song(request, song_id):
     """Play song and increment play count"""
@@ -482,21 +338,26 @@ def play_song(request, song_id):
     if not song.can_be_accessed_by(request.user):
         return JsonResponse({
             'error': 'Premium content requires subscription',
-            'can_preview': song.preview_duration > 0,
-            'preview_duration': song.preview_duration
+            'can_preview': song.preview_url is not None,
+            'preview_duration': preview.clip_seconds(song),
+            'preview_url': song.preview_url
         }, status=403)
     
+    # Stream the best rendition the user's plan allows; the original until it is transcoded
+    rendition = song.rendition_for(request.user)
+    audio_quality = _stream_quality(song, request.user, rendition)
+    
     # Increment play count on the song model
     song.increment_plays()
     
-    # Create play record for detailed tracking
-    play = SongPlay.objects.create(
-        song=song,
+    # Queue play record for detailed tracking
+    play_token = ingest.record_play(
+        song,
         user=request.user,
         ip_address=get_client_ip(request),
         duration_played=0,
         user_agent=request.META.get('HTTP_USER_AGENT', ''),
-        audio_quality='high' if request.user.userprofile.is_premium else 'standard'
+        audio_quality=audio_quality
     )
     
     return JsonResponse({
@@ -505,14 +366,128 @@ def play_song(request, song_id):
         'artist': song.artist.name,
         'artist_id': song.artist.id,
         'cover': song.cover_image.url if song.cover_image else '/static/images/default-cover.jpg',
-        'audio': song.audio_file.url,
+        'audio': streaming.stream_url(song, request.user, rendition.quality if rendition else ''),
+        'audio_quality': audio_quality,
+        'hls': streaming.hls_url(song, request.user),
+        'waveform': song.waveform_url,
+        'replay_gain': song.replay_gain,
         'duration': song.duration,
-        'plays': song.plays,
-        'downloads': song.downloads,
+        'formatted_duration': song.formatted_duration,
+        'plays': song.current_plays,
+        'downloads': song.current_downloads,
         'is_premium': song.is_premium_only,
-        'play_id': play.id
+        'play_id': play_token
     })
 
+def stream_song(request, song_id):
+    """Serve song audio with byte-range support for seeking"""
+    song = get_object_or_404(
+        Song.objects.only('id', 'audio_file', 'is_premium_only', 'is_approved'), id=song_id, is_approved=True
+    )
+    quality = request.GET.get('q', '')
+    
+    # Access is checked once per stream; the signed URL covers later range requests
+    if streaming.check_stream_token(request.GET.get('t'), song.id, request.user, quality):
+        rendition = song.renditions.filter(quality=quality).first() if quality else None
+    else:
+        if not song.can_be_accessed_by(request.user):
+            return JsonResponse({'error': 'Premium content requires subscription'}, status=403)
+        # Unsigned requests get whatever the user's plan allows
+        rendition = song.rendition_for(request.user)
+    audio_file = rendition.file if rendition else song.audio_file
+    
+    path = streaming.local_path(audio_file)
+    if path is None:
+        if not audio_file:
+            raise Http404("Audio file not found")
+        # Remote storage (e.g. Cloudinary) handles ranges itself
+        return redirect(audio_file.url)
+    
+    # With a front proxy configured it sends the bytes (and handles ranges)
+    response = offload.offload_response(path)
+    if response is None:
+        response = streaming.serve_file(request, path)
+    response['Cache-Control'] = 'private, max-age=3600' if song.is_premium_only else 'public, max-age=86400'
+    return response
+
+def preview_song(request, song_id):
+    """Preview clip of a song; public and cacheable since it is all free users get"""
+    song = get_object_or_404(Song.objects.only('id', 'preview_file'), id=song_id, is_approved=True)
+    if not song.preview_file:
+        raise Http404("No preview available")
+    
+    path = streaming.local_path(song.preview_file)
+    if path is None:
+        return redirect(song.preview_file.url)
+    response = offload.offload_response(path, content_type='audio/mpeg')
+    if response is None:
+        response = streaming.serve_file(request, path, content_type='audio/mpeg')
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+def _hls_tiers_for(song, user):
+    """HLS tiers ``user`` may play: those their plan allows, or else the lowest one"""
+    allowed = Song.allowed_stream_qualities(user)
+    return [q for q in hls.hls_qualities(song) if q in allowed] or hls.hls_qualities(song)[:1]
+
+def hls_master(request, song_id):
+    """HLS master playlist listing the quality tiers the user's plan allows"""
+    song = get_object_or_404(Song, id=song_id, is_approved=True)
+    
+    if not streaming.check_stream_token(request.GET.get('t'), song.id, request.user, 'hls'):
+        if not song.can_be_accessed_by(request.user):
+            return JsonResponse({'error': 'Premium content requires subscription'}, status=403)
+    if not song.audio_file or not hls.is_packaged(song):
+        raise Http404("Song has not been packaged for HLS yet")
+    
+    qualities = _hls_tiers_for(song, request.user)
+    version = hls.hls_version(song)
+    playlist = hls.master_playlist(
+        song, qualities,
+        lambda quality: reverse('hls_file', args=[song.id, version, quality, 'index.m3u8'])
+    )
+    response = HttpResponse(playlist, content_type='application/vnd.apple.mpegurl')
+    # Per-user (tiers depend on the plan), and it is tiny
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
+
+def hls_file(request, song_id, version, quality, name):
+    """
+    Media playlist or segment; URLs are versioned so they never change.
+    Access and the quality tier are checked on every file, since segment
+    URLs are predictable from the master playlist.
+    """
+    song = get_object_or_404(Song, id=song_id, is_approved=True)
+    if not song.can_be_accessed_by(request.user):
+        return JsonResponse({'error': 'Premium content requires subscription'}, status=403)
+    if quality not in _hls_tiers_for(song, request.user):
+        return JsonResponse({'error': 'Quality not available on your plan'}, status=403)
+    path = hls.resolve_file(song_id, version, quality, name)
+    if path is None:
+        raise Http404("Not found")
+    content_type = 'application/vnd.apple.mpegurl' if name.endswith('.m3u8') else 'video/mp2t'
+    response = offload.offload_response(path, content_type=content_type)
+    if response is None:
+        response = streaming.serve_file(request, path, content_type=content_type)
+    # Shared caches may only keep what an anonymous listener could fetch
+    if not song.is_premium_only and quality in Song.allowed_stream_qualities(None):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+def song_waveform(request, song_id, version):
+    """Waveform peaks as raw uint8 min/max pairs; the version changes with the audio"""
+    waveform = get_object_or_404(SongWaveform, song_id=song_id, song__is_approved=True)
+    current = SongWaveform.version_for(waveform.source_name, waveform.buckets)
+    if version != current:
+        # Audio was replaced or the peaks recomputed since this URL was handed out
+        return redirect('song_waveform', song_id=song_id, version=current)
+    response = HttpResponse(bytes(waveform.peaks), content_type='application/octet-stream')
+    response['X-Waveform-Buckets'] = str(waveform.buckets)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @login_required
 def download_song(request, song_id):
     """Download song with Sangabiz branding"""
@@ -527,43 +502,24 @@ def download_song(request, song_id):
         if not song.audio_file or not os.path.exists(song.audio_file.path):
             raise FileNotFoundError("Audio file not found")
         
-        file_path = song.audio_file.path
+        spec = branding.BrandingSpec.for_song(song)
         
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            output_path = os.path.join(temp_dir, f"branded_{os.path.basename(file_path)}")
-            
-            # Copy original file
-            shutil.copy2(file_path, output_path)
-            
-            # Create branded cover
-            branded_cover_path = os.path.join(temp_dir, "branded_cover.jpg")
-            create_branded_cover(song, branded_cover_path)
-            
-            # Add branded metadata
-            add_branded_metadata(output_path, song, branded_cover_path)
-            
-            # Increment download count on the song model
-            song.increment_downloads()
-            
-            # Record download for detailed tracking
-            SongDownload.objects.create(
-                song=song,
-                user=request.user,
-                ip_address=get_client_ip(request),
-                file_size=os.path.getsize(output_path)
+        if not getattr(settings, 'BRANDED_DOWNLOAD_CACHE', True) and branding.HAS_MUTAGEN:
+            # No cache: stream a fresh tag followed by the untouched audio frames
+            stream, length = branding.open_branded_stream(
+                spec,
+                chunk_size=getattr(settings, 'AUDIO_STREAM_CHUNK_SIZE', 64 * 1024),
             )
-            
-            # Serve the branded file
-            filename = f"Sangabiz - {song.title} - {song.artist.name}.mp3"
-            response = FileResponse(
-                open(output_path, 'rb'),
-                content_type='audio/mpeg'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            response['Content-Length'] = os.path.getsize(output_path)
-            
+            song.increment_downloads()
+            ingest.record_download(song, user=request.user, ip_address=get_client_ip(request), file_size=length)
+            response = StreamingHttpResponse(stream, content_type=spec.content_type)
+            response['Content-Length'] = length
+            response['Content-Disposition'] = f'attachment; filename="{spec.download_filename}"'
             return response
+        
+        # Branded copies are cached on disk; only the first download of a version renders one
+        output_path = artifacts.branded_file_for(song)
+        return _serve_branded_download(request, song, output_path, spec)
             
     except FileNotFoundError as e:
         messages.error(request, 'Audio file not found on server')
@@ -573,42 +529,114 @@ def download_song(request, song_id):
         messages.error(request, f'Download failed: {str(e)}')
         return redirect('song_detail', song_id=song_id)
 
+def _serve_branded_download(request, song, output_path, spec):
+    """Count the download and send the branded file"""
+    # Increment download count on the song model
+    song.increment_downloads()
+    
+    # Record download for detailed tracking
+    ingest.record_download(
+        song,
+        user=request.user,
+        ip_address=get_client_ip(request),
+        file_size=os.path.getsize(output_path)
+    )
+    
+    # Serve the branded file, via the front proxy when offload is configured
+    response = offload.offload_response(output_path, content_type=spec.content_type, filename=spec.download_filename)
+    if response is None:
+        response = streaming.serve_file(request, output_path, content_type=spec.content_type,
+                                        filename=spec.download_filename)
+    return response
+
+def _download_job_payload(song, job_id, state):
+    payload = {
+        'success': state['status'] != jobs.FAILED,
+        'job_id': job_id,
+        'status': state['status'],
+        'status_url': reverse('download_job_status', args=[song.id, job_id]),
+    }
+    if state['status'] == jobs.PENDING:
+        payload['poll_after'] = jobs.poll_interval()
+    if state['status'] == jobs.READY:
+        payload['download_url'] = reverse('download_job_file', args=[song.id, job_id])
+    if state.get('error'):
+        payload['error'] = state['error']
+    return payload
+
+def _downloadable_song(request, song_id):
+    """Song and its branding spec, or a JSON error response"""
+    song = get_object_or_404(Song.objects.select_related('artist', 'genre'), id=song_id, is_approved=True)
+    if not song.can_be_accessed_by(request.user):
+        return song, None, JsonResponse({'success': False, 'error': 'Premium content requires subscription'}, status=403)
+    if not song.audio_file or not os.path.exists(song.audio_file.path):
+        return song, None, JsonResponse({'success': False, 'error': 'Audio file not found on server'}, status=404)
+    return song, branding.BrandingSpec.for_song(song), None
+
+@require_POST
+@login_required
+def prepare_download(request, song_id):
+    """Start building the branded download in the background and return a job id"""
+    song, spec, error = _downloadable_song(request, song_id)
+    if error:
+        return error
+    try:
+        job_id = jobs.submit_branding(spec)
+    except Exception as e:
+        print(f"Download preparation error: {str(e)}")
+        return JsonResponse({'success': False, 'error': 'Could not prepare download'}, status=500)
+    state = jobs.job_status(job_id, spec) or {'status': jobs.PENDING}
+    return JsonResponse(_download_job_payload(song, job_id, state), status=202 if state['status'] == jobs.PENDING else 200)
+
+@login_required
+def download_job_status(request, song_id, job_id):
+    """Job state, answered at once; pending jobs carry a Retry-After hint"""
+    song, spec, error = _downloadable_song(request, song_id)
+    if error:
+        return error
+    if job_id != artifacts.artifact_key(spec):
+        return JsonResponse({'success': False, 'error': 'Song changed, prepare the download again'}, status=410)
+    
+    state = jobs.job_status(job_id, spec)
+    if state is None:
+        return JsonResponse({'success': False, 'error': 'Unknown download job'}, status=404)
+    response = JsonResponse(_download_job_payload(song, job_id, state))
+    if state['status'] == jobs.PENDING:
+        response['Retry-After'] = str(jobs.poll_interval())
+    return response
+
+@login_required
+def download_job_file(request, song_id, job_id):
+    """Send the artifact of a finished job"""
+    song, spec, error = _downloadable_song(request, song_id)
+    if error:
+        return error
+    if job_id != artifacts.artifact_key(spec):
+        return JsonResponse({'success': False, 'error': 'Song changed, prepare the download again'}, status=410)
+    
+    output_path = artifacts.get_store().get(spec)
+    if output_path is None:
+        return redirect('download_job_status', song_id=song.id, job_id=job_id)
+    return _serve_branded_download(request, song, output_path, spec)
+
 def top_songs(request):
     """Top songs page with various rankings"""
-    most_played = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('-plays')[:20]
-    most_downloaded = Song.objects.filter(is_approved=True).select_related('artist', 'genre').order_by('-downloads')[:20]
-    
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    trending = Song.objects.filter(
-        is_approved=True,
-        play_history__played_at__gte=seven_days_ago
-    ).annotate(
-        recent_plays=Count('play_history'),
-        recent_downloads=Count('download_history', filter=Q(download_history__downloaded_at__gte=seven_days_ago))
-    ).select_related('artist', 'genre').order_by('-recent_plays', '-recent_downloads')[:20]
-    
-    trending_artists = Artist.objects.filter(is_verified=True).annotate(
-        recent_followers=Count(
-            'followers', 
-            filter=Q(followers__followed_at__gte=seven_days_ago)
-        ),
-        recent_plays=Coalesce(Sum(
-            'songs__plays',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0),
-        recent_downloads=Coalesce(Sum(
-            'songs__downloads',
-            filter=Q(songs__upload_date__gte=seven_days_ago, songs__is_approved=True)
-        ), 0)
-    ).filter(
-        Q(recent_followers__gt=0) | Q(recent_plays__gt=0) | Q(recent_downloads__gt=0)
-    ).order_by('-recent_plays', '-recent_downloads', '-recent_followers')[:5]
+    most_played = leaderboards.top_songs('plays', 20)
+    most_downloaded = leaderboards.top_songs('downloads', 20)
+    
+    # Trending over the last hour, day or week (?window=1h|24h|7d)
+    window = request.GET.get('window', '7d')
+    if window not in trending.WINDOWS:
+        window = '7d'
+    trending_songs = trending.top_songs(window, 20)
+    trending_artists = trending.top_artists(window, 5)
     
     context = {
         'most_played': most_played,
         'most_downloaded': most_downloaded,
-        'trending': trending,
+        'trending': trending_songs,
         'trending_artists': trending_artists,
+        'trending_window': window,
     }
     return render(request, 'music/top_songs.html', context)
 
@@ -622,9 +650,8 @@ def update_play_duration(request, song_id):
             play_id = data.get('play_id')
             
             if play_id:
-                play = SongPlay.objects.get(id=play_id, user=request.user)
-                play.duration_played = duration_played
-                play.save()
+                if not ingest.update_play_duration(play_id, duration_played, user=request.user):
+                    raise SongPlay.DoesNotExist
             else:
                 play = SongPlay.objects.filter(
                     song_id=song_id,
@@ -632,7 +659,7 @@ def update_play_duration(request, song_id):
                 ).order_by('-played_at').first()
                 if play:
                     play.duration_played = duration_played
-                    play.save()
+                    play.save(update_fields=['duration_played'])
                     
             return JsonResponse({'success': True})
             
@@ -907,6 +934,51 @@ def news_view(request):
         'subscription_form': subscription_form,
     }
     return render(request, 'music/news.html', context)
+def _chart_entries():
+    return Prefetch('entries', queryset=ChartEntry.objects.select_related('song__artist'))
+
+def charts_view(request):
+    """All active charts; entries are written by music.charts, this only reads them"""
+    active_charts = Chart.objects.filter(is_active=True).prefetch_related(_chart_entries())
+    featured_videos = YouTubeVideo.objects.filter(is_active=True, is_featured=True).order_by('-added_date')[:4]
+    
+    context = {
+        'charts': active_charts,
+        'featured_videos': featured_videos,
+    }
+    return render(request, 'music/charts.html', context)
+
+def chart_detail_view(request, chart_id):
+    """Full chart for this week, or a past week (?week=YYYY-MM-DD) from its snapshot"""
+    chart = get_object_or_404(Chart, id=chart_id, is_active=True)
+    weeks = list(chart.snapshots.values_list('week', flat=True)[:52])
+    
+    week = None
+    if request.GET.get('week'):
+        try:
+            week = charts.chart_week(datetime.strptime(request.GET['week'], '%Y-%m-%d'))
+        except ValueError:
+            raise Http404("Invalid week")
+    
+    if week is None or week == charts.chart_week():
+        entries = [
+            ({'position': entry.position, 'previous_position': entry.previous_position,
+              'weeks_on_chart': entry.weeks_on_chart}, entry.song)
+            for entry in chart.entries.select_related('song__artist')
+        ]
+        week = weeks[0] if weeks else None
+    else:
+        snapshot = get_object_or_404(ChartSnapshot, chart=chart, week=week)
+        entries = charts.snapshot_entries(snapshot)
+    
+    context = {
+        'chart': chart,
+        'entries': entries,
+        'week': week,
+        'weeks': weeks,
+    }
+    return render(request, 'music/chart_detail.html', context)
+
 def videos_view(request):
     """Videos page with YouTube videos"""
     featured_videos = YouTubeVideo.objects.filter(
@@ -918,12 +990,12 @@ def videos_view(request):
         is_active=True
     ).order_by('-added_date')
     
-    featured_artists = Artist.objects.filter(is_verified=True).annotate(
-        total_songs_count=Count('songs', filter=Q(songs__is_approved=True)),
-        total_plays=Coalesce(Sum('songs__plays', filter=Q(songs__is_approved=True)), 0),
-        total_downloads=Coalesce(Sum('songs__downloads', filter=Q(songs__is_approved=True)), 0),
-        followers_count=Count('followers')
-    ).order_by('-created_at')[:6]
+    featured_artists = Artist.objects.filter(is_verified=True).annotate(**artist_stats.stat_annotations(
+        total_songs_count='songs',
+        total_plays='plays',
+        total_downloads='downloads',
+        followers_count='followers',
+    )).order_by('-created_at')[:6]
     
     paginator = Paginator(all_videos, 12)
     page_number = request.GET.get('page')
@@ -1019,10 +1091,10 @@ def api_track_play(request):
         # Increment play count
         song.increment_plays()
         
-        # Create detailed play record if user is authenticated
+        # Queue detailed play record if user is authenticated
         if request.user.is_authenticated:
-            SongPlay.objects.create(
-                song=song,
+            ingest.record_play(
+                song,
                 user=request.user,
                 ip_address=get_client_ip(request),
                 duration_played=data.get('duration_played', 0),
@@ -1032,7 +1104,7 @@ def api_track_play(request):
         
         return JsonResponse({
             'success': True,
-            'plays': song.plays,
+            'plays': song.current_plays,
             'song_id': song.id
         })
         
@@ -1050,10 +1122,10 @@ def api_track_download(request):
         # Increment download count
         song.increment_downloads()
         
-        # Create detailed download record if user is authenticated
+        # Queue detailed download record if user is authenticated
         if request.user.is_authenticated:
-            SongDownload.objects.create(
-                song=song,
+            ingest.record_download(
+                song,
                 user=request.user,
                 ip_address=get_client_ip(request),
                 file_size=data.get('file_size', 0)
@@ -1061,7 +1133,7 @@ def api_track_download(request):
         
         return JsonResponse({
             'success': True,
-            'downloads': song.downloads,
+            'downloads': song.current_downloads,
             'song_id': song.id
         })
         
@@ -1074,8 +1146,8 @@ def get_song_stats(request, song_id):
     
     # Basic stats
     stats = {
-        'plays': song.plays,
-        'downloads': song.downloads,
+        'plays': song.current_plays,
+        'downloads': song.current_downloads,
         'title': song.title,
         'artist': song.artist.name
     }
@@ -1095,16 +1167,11 @@ def get_song_stats(request, song_id):
     )
     
     # Recent activity (last 7 days)
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    recent_plays = SongPlay.objects.filter(
-        song=song,
-        played_at__gte=seven_days_ago
-    ).count()
-    
-    recent_downloads = SongDownload.objects.filter(
-        song=song,
-        downloaded_at__gte=seven_days_ago
-    ).count()
+    recent = SongRollup.objects.filter(
+        song=song, period='day', bucket__gte=rollups.since(7)
+    ).aggregate(plays=Sum('plays'), downloads=Sum('downloads'))
+    recent_plays = recent['plays'] or 0
+    recent_downloads = recent['downloads'] or 0
     
     stats.update({
         'play_stats': play_stats,
@@ -1132,12 +1199,11 @@ def api_track_play(request):
         song = get_object_or_404(Song, id=song_id, is_approved=True)
         
         # Increment play count on the song model
-        song.plays += 1
-        song.save()
+        song.increment_plays()
         
-        # Create detailed play record
-        play = SongPlay.objects.create(
-            song=song,
+        # Queue detailed play record
+        play_token = ingest.record_play(
+            song,
             user=request.user,
             ip_address=get_client_ip(request),
             duration_played=data.get('duration_played', 0),
@@ -1148,9 +1214,9 @@ def api_track_play(request):
         
         return JsonResponse({
             'success': True,
-            'play_count': song.plays,
+            'play_count': song.current_plays,
             'song_id': song.id,
-            'play_id': play.id,
+            'play_id': play_token,
             'message': 'Play count updated successfully'
         })
         
@@ -1193,12 +1259,11 @@ def api_track_download(request):
             return JsonResponse({'success': False, 'error': 'Song not found'}, status=404)
         
         # Increment download count
-        song.downloads += 1
-        song.save()
+        song.increment_downloads()
         
-        # Create download record
-        download = SongDownload.objects.create(
-            song=song,
+        # Queue download record
+        ingest.record_download(
+            song,
             user=request.user,
             ip_address=get_client_ip(request),
             file_size=data.get('file_size', 0),
@@ -1207,7 +1272,7 @@ def api_track_download(request):
         
         return JsonResponse({
             'success': True,
-            'download_count': song.downloads,
+            'download_count': song.current_downloads,
             'song_id': song.id,
             'message': 'Download tracked successfully'
         })
@@ -1216,6 +1281,200 @@ def api_track_download(request):
         print(f"Download tracking error: {str(e)}")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
+MAX_EVENTS_PER_BATCH = 500
+PLAY_EVENT_TYPES = ('play', 'progress', 'complete')
+# Client timestamps older than this are clamped (offline queues are replayed within a day)
+MAX_EVENT_AGE = timedelta(days=1)
+PLAY_TOKEN_RE = re.compile(r'[A-Za-z0-9]{1,32}')
+
+
+def _parse_event_time(value, now):
+    """
+    Client timestamp (ISO string or epoch milliseconds), clamped to the last
+    MAX_EVENT_AGE and never in the future. Raises ValueError if unusable.
+    """
+    played_at = None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            played_at = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('Invalid timestamp')
+    elif isinstance(value, str):
+        played_at = parse_datetime(value)
+        if played_at is not None and timezone.is_naive(played_at):
+            played_at = timezone.make_aware(played_at, dt_timezone.utc)
+    if played_at is None or played_at > now:
+        return now
+    return max(played_at, now - MAX_EVENT_AGE)
+
+
+def _int_field(event, name):
+    """Integer value of ``event[name]``; raises ValueError for anything else (including Infinity)"""
+    value = event.get(name)
+    if isinstance(value, bool):
+        raise ValueError(name)
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(name)
+
+
+def _capped_duration(duration_played, song_duration):
+    """Seconds played, never more than the song lasts (when its duration is known)"""
+    if song_duration:
+        return min(duration_played, song_duration)
+    return duration_played
+
+
+@require_POST
+@login_required
+def api_track_events(request):
+    """
+    Record a batch of player events in one request.
+
+    Body: {"events": [{"type": "play", "song_id": 1, "play_id": "<client token>",
+    "timestamp": "...", "duration_played": 0}, {"type": "progress" | "complete",
+    "play_id": "<token>", "duration_played": 42}, ...]}
+
+    Plays may carry a client-generated play_id so that later progress events
+    in the same or a following batch can refer to them. Songs are validated
+    with a single id__in lookup; new plays are queued with ``ingest`` like
+    play_song's, and progress goes to the queued play or the written row.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list) or not events:
+        return JsonResponse({'success': False, 'error': 'events must be a non-empty list'}, status=400)
+    if len(events) > MAX_EVENTS_PER_BATCH:
+        return JsonResponse({
+            'success': False,
+            'error': f'At most {MAX_EVENTS_PER_BATCH} events per request'
+        }, status=400)
+    
+    now = timezone.now()
+    rejected = []
+    new_plays = {}  # play token -> play fields
+    durations = {}  # play token -> longest duration reported in this batch
+    
+    song_ids = set()
+    for event in events:
+        if isinstance(event, dict) and event.get('type') == 'play':
+            try:
+                song_ids.add(_int_field(event, 'song_id'))
+            except ValueError:
+                pass
+    songs = Song.objects.filter(id__in=song_ids, is_approved=True).in_bulk()
+    
+    for index, event in enumerate(events):
+        if not isinstance(event, dict) or event.get('type') not in PLAY_EVENT_TYPES:
+            rejected.append({'index': index, 'error': 'Unknown event type'})
+            continue
+        
+        try:
+            duration_played = max(0, _int_field(event, 'duration_played'))
+        except ValueError:
+            rejected.append({'index': index, 'error': 'Invalid duration_played'})
+            continue
+        
+        play_token = event.get('play_id') or ''
+        if play_token and not (isinstance(play_token, str) and PLAY_TOKEN_RE.fullmatch(play_token)):
+            rejected.append({'index': index, 'error': 'Invalid play_id'})
+            continue
+        
+        if event['type'] == 'play':
+            try:
+                song = songs.get(_int_field(event, 'song_id'))
+            except ValueError:
+                song = None
+            if song is None:
+                rejected.append({'index': index, 'error': 'Song not found'})
+                continue
+            if not song.can_be_accessed_by(request.user):
+                rejected.append({'index': index, 'error': 'Premium content requires subscription'})
+                continue
+            try:
+                played_at = _parse_event_time(event.get('timestamp'), now)
+            except ValueError:
+                rejected.append({'index': index, 'error': 'Invalid timestamp'})
+                continue
+            play_token = play_token or uuid.uuid4().hex
+            if play_token in new_plays:
+                rejected.append({'index': index, 'error': 'Duplicate play_id'})
+                continue
+            new_plays[play_token] = {
+                'song': song,
+                'played_at': played_at,
+            }
+            duration_played = _capped_duration(duration_played, song.duration)
+        elif not play_token:
+            rejected.append({'index': index, 'error': 'play_id required'})
+            continue
+        
+        durations[play_token] = max(durations.get(play_token, 0), duration_played)
+    
+    # Plays still in the ingest queue are updated there, including new plays
+    # of a retried batch that were queued by the first attempt
+    queue = ingest.get_queue()
+    queued = {
+        token for token in durations
+        if queue.update_pending_play(token, user_id=request.user.pk, duration_played=durations[token])
+    }
+    written_tokens = [token for token in durations if token not in queued]
+    
+    with transaction.atomic():
+        existing = {
+            play.play_token: play
+            for play in SongPlay.objects.filter(
+                user=request.user, play_token__in=written_tokens
+            ).select_related('song')
+        }
+        updated = []
+        for token in written_tokens:
+            play = existing.get(token)
+            if play is None:
+                continue
+            duration_played = _capped_duration(durations[token], play.song.duration)
+            if duration_played > play.duration_played:
+                play.duration_played = duration_played
+                updated.append(play)
+        SongPlay.objects.bulk_update(updated, ['duration_played'])
+    
+    # New plays go through the ingest queue like play_song's; a retried
+    # batch whose plays were already written must not count them twice
+    recorded = []
+    qualities = {}
+    for token, play in new_plays.items():
+        if token in queued or token in existing:
+            continue
+        song = play['song']
+        if song.pk not in qualities:
+            qualities[song.pk] = _stream_quality(song, request.user)
+        ingest.record_play(
+            song,
+            user=request.user,
+            ip_address=get_client_ip(request),
+            duration_played=durations.get(token, 0),
+            user_agent=request.META.get('HTTP_USER_AGENT', ''),
+            session_id=request.session.session_key or '',
+            audio_quality=qualities[song.pk],
+            played_at=play['played_at'],
+            play_token=token,
+        )
+        song.increment_plays()
+        recorded.append(token)
+    
+    return JsonResponse({
+        'success': True,
+        'accepted': len(events) - len(rejected),
+        'rejected': rejected,
+        'play_ids': recorded,
+        'unknown_play_ids': [token for token in written_tokens if token not in existing and token not in new_plays],
+    })
+
 @require_POST
 @login_required
 def api_like_song(request, song_id):
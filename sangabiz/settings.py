@@ -72,6 +72,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'music.offload.OffloadStandInMiddleware',
 ]
 
 ROOT_URLCONF = 'sangabiz.urls'
@@ -399,6 +400,114 @@ JAZZMIN_UI_TWEAKS = {
 ALLOWED_AUDIO_EXTENSIONS = ['mp3', 'wav', 'ogg', 'm4a', 'flac']
 MAX_AUDIO_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Play/download counters are buffered and flushed as batched updates (music/counters.py)
+# 'cache' shares pending increments between workers through CACHES (Redis); 'memory'
+# keeps them per process and is only for single-process development
+SONG_COUNTER_BACKEND = os.getenv('SONG_COUNTER_BACKEND', 'cache')
+SONG_COUNTER_FLUSH_INTERVAL = 5  # seconds between flushes
+SONG_COUNTER_MAX_PENDING = 1000  # flush early once this many increments are buffered
+
+# SongPlay/SongDownload rows are queued and written with bulk_create (music/ingest.py)
+EVENT_INGEST_BATCH_SIZE = 200  # write once this many events are queued
+EVENT_INGEST_FLUSH_INTERVAL = 2  # seconds between flushes
+EVENT_SPOOL_DIR = BASE_DIR / 'var' / 'event_spool'  # durable copy of the queue
+EVENT_SPOOL_LEASE = 120  # seconds without a sign of life before a worker's spool files are replayed by others
+
+# Range-aware audio streaming (music/streaming.py)
+AUDIO_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read per chunk when not using sendfile
+AUDIO_STREAM_TOKEN_MAX_AGE = 6 * 60 * 60  # seconds a signed stream URL stays valid
+
+# Cache of branded download files (music/artifacts.py)
+BRANDED_DOWNLOAD_ROOT = BASE_DIR / 'var' / 'branded'
+# False streams a freshly tagged file on every download instead of caching it
+BRANDED_DOWNLOAD_CACHE = True
+# Least recently downloaded files are evicted past this size
+BRANDED_CACHE_MAX_BYTES = int(os.getenv('BRANDED_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Rendered branded covers, keyed by cover contents + title + artist (music/branding.py)
+BRANDED_COVER_CACHE_ROOT = BASE_DIR / 'var' / 'covers'
+# Least recently used renders are evicted past this size
+BRANDED_COVER_CACHE_MAX_BYTES = int(os.getenv('BRANDED_COVER_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+
+# Background branding jobs (music/jobs.py)
+BRANDING_WORKERS = int(os.getenv('BRANDING_WORKERS', 2))
+BRANDING_JOB_TTL = 60 * 60
+# A pending job older than this is treated as lost and can be resubmitted
+BRANDING_JOB_TIMEOUT = 5 * 60
+# Seconds clients are told to wait between job status polls
+BRANDING_JOB_POLL_INTERVAL = 1
+
+# Post-upload media processing (music/processing)
+MEDIA_PROCESSING_ON_UPLOAD = True  # run stale stages in the background after each upload
+MEDIA_PROCESSING_WORKERS = int(os.getenv('MEDIA_PROCESSING_WORKERS', 2))
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+FFMPEG_TIMEOUT = 10 * 60  # seconds
+# Transcoding ladder, one rendition per Song.AUDIO_QUALITY_CHOICES tier
+AUDIO_RENDITIONS = {
+    'standard': {'codec': 'libmp3lame', 'bitrate': 128, 'extension': 'mp3'},
+    'high': {'codec': 'libmp3lame', 'bitrate': 320, 'extension': 'mp3'},
+    'ultra': {'codec': 'flac', 'bitrate': None, 'extension': 'flac'},  # lossless uploads only
+}
+# Preview clips (music/processing/preview.py): seconds at the end of a premium song
+# that no preview may include, however long its preview_duration
+PREVIEW_MIN_WITHHELD = 30
+# HLS packaging (music/processing/hls.py)
+HLS_ROOT = BASE_DIR / 'var' / 'hls'
+HLS_SEGMENT_SECONDS = 6
+HLS_AUDIO_CODEC = 'aac'
+# Waveform peaks (music/processing/waveform.py): min/max pairs per song, decode rate in Hz
+WAVEFORM_BUCKETS = 1000
+WAVEFORM_SAMPLE_RATE = 8000
+# Duplicate detection (music/processing/fingerprint.py): aligned landmark hashes needed,
+# and their share of the shorter song's hashes, before an upload is flagged
+FINGERPRINT_MIN_MATCHES = 20
+FINGERPRINT_MATCH_SCORE = 0.1
+# Highest rendition tier each premium plan streams
+STREAM_QUALITY_BY_PLAN = {
+    'free': 'standard',
+    'premium': 'high',
+    'premium_plus': 'ultra',
+}
+
+# Play/download rollups (analytics/rollups.py); daily rows are kept forever
+ROLLUP_HOURLY_RETENTION_DAYS = 14
+# Charts (music/charts.py, manage.py build_charts)
+CHART_SIZE = 50
+CHART_NEW_RELEASE_DAYS = 30
+LOCAL_CHART_GENRES = []  # Genre names ranked by the 'local_charts' chart type
+# Song.hot_score (music/hotness.py, manage.py update_hot_scores)
+HOT_SCORE_WINDOW_DAYS = 30
+HOT_SCORE_HALF_LIFE_DAYS = 3
+# Genre totals (music/genre_stats.py, manage.py refresh_genre_stats): seconds the cached list is served
+GENRE_STATS_CACHE_TIMEOUT = 5 * 60
+# Most played/downloaded boards (music/leaderboards.py): songs kept per board
+# 'redis' shares sorted sets through the default cache; 'memory' keeps them per process
+LEADERBOARD_BACKEND = os.getenv('LEADERBOARD_BACKEND', 'redis')
+LEADERBOARD_SIZE = 100
+LEADERBOARD_LOCAL_TTL = 60  # seconds before a per-process board is reloaded
+LEADERBOARD_REDIS_TTL = 60 * 60  # seconds before a Redis board is rebuilt from the database
+# Trending sections (music/trending.py, manage.py rebuild_trending): Count-Min sketch
+# size per time bucket, songs/artists tracked per bucket, seconds a ranking is cached
+TRENDING_SKETCH_WIDTH = 2048
+TRENDING_SKETCH_DEPTH = 4
+TRENDING_CANDIDATES = 200
+TRENDING_RESULT_TTL = 60
+TRENDING_LOCK_WAIT = 0.2  # seconds a flush waits for the bucket lock before keeping its counts for later
+# Full-text search (music/fulltext.py, manage.py rebuild_search_index)
+SEARCH_POSTGRES_CONFIG = 'simple'  # text search configuration; 'simple' suits mixed-language titles
+SEARCH_MAX_RESULTS = 1000  # matches considered when discover filters by ?q=
+
+# Let the front proxy send audio bytes after Django checks access (music/offload.py)
+# None: Django streams the file, 'nginx': X-Accel-Redirect, 'apache': X-Sendfile
+AUDIO_OFFLOAD_MODE = os.getenv('AUDIO_OFFLOAD_MODE') or None
+# Filesystem root -> nginx `internal` location that aliases it
+AUDIO_OFFLOAD_LOCATIONS = {
+    MEDIA_ROOT: '/protected/media/',
+    BRANDED_DOWNLOAD_ROOT: '/protected/branded/',
+    HLS_ROOT: '/protected/hls/',
+}
+# Serve offloaded responses in-process when no proxy is in front (runserver); read at startup
+AUDIO_OFFLOAD_STAND_IN = DEBUG
+
 # Cache configuration for VPS
 CACHES = {
     'default': {